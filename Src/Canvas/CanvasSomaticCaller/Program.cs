@@ -1,5 +1,6 @@
 ﻿using System;
 using System.Collections.Generic;
+using System.Diagnostics;
 using System.IO;
 using CanvasCommon;
 using Illumina.Common;
@@ -11,6 +12,16 @@ namespace CanvasSomaticCaller
 {
     class Program
     {
+        /// <summary>
+        /// One call of a warm worker, a JSON line on stdin
+        /// </summary>
+        private class WorkerRequest
+        {
+            public string ParameterConfig { get; set; }
+            public string OutFile { get; set; }
+            public string Log { get; set; }
+        }
+
         static void ShowHelp(OptionSet p)
         {
             Console.WriteLine("Usage: CanvasSomaticCaller.exe [OPTIONS]+");
@@ -41,6 +52,7 @@ namespace CanvasSomaticCaller
             int qualityFilterThreshold = 10; // Default quality filter threshold = 10, overridable via -q command-line argument
             // Parameters, for parameter-sweep, somatic model training:
             bool isTrainMode = false;
+            bool isWorkerMode = false;
             float? userPurity = null;
             float? userPloidy = null;
             CanvasCommon.CanvasSomaticClusteringMode somaticClusteringMode =
@@ -101,7 +113,11 @@ namespace CanvasSomaticCaller
                 },
                 {"u|definedpurity=", "INTERNAL: user pre-defined purity", v => userPurity = float.Parse(v)},
                 {"l|definedploidy=", "INTERNAL: user pre-defined ploidy", v => userPloidy = float.Parse(v)},
-                {"a|trainmodel=", "INTERNAL: user pre-defined ploidy", v => isTrainMode = v != null}
+                {"a|trainmodel=", "INTERNAL: user pre-defined ploidy", v => isTrainMode = v != null},
+                {
+                    "w|worker", "INTERNAL: warm worker for model training, reads one JSON request with the ParameterConfig, OutFile and Log of a call per line from stdin and writes one JSON result line per call",
+                    v => isWorkerMode = v != null
+                }
             };
 
             List<string> extraArgs = p.Parse(args);
@@ -118,7 +134,7 @@ namespace CanvasSomaticCaller
                 return 0;
             }
 
-            if (inFile == null || outFile == null || referenceFolder == null)
+            if (inFile == null || (outFile == null && !isWorkerMode) || referenceFolder == null)
             {
                 ShowHelp(p);
                 return 0;
@@ -147,53 +163,113 @@ namespace CanvasSomaticCaller
                 throw new ArgumentException(
                     $"Quality filter threshold must be greater than or equal to zero. Value was {qualityFilterThreshold}");
 
-            if (!File.Exists(parameterconfigPath))
+            if (!isWorkerMode && !File.Exists(parameterconfigPath))
             {
                 Console.WriteLine("Canvas error: File {0} does not exist! Exiting.", parameterconfigPath);
                 return 1;
             }
 
-            FileLocation parameterconfigFile = new FileLocation(parameterconfigPath);
-            SomaticCallerParameters somaticCallerParametersJSON = Deserialize<SomaticCallerParameters>(parameterconfigFile);
-
-            FileLocation qscoreConfigFile = new FileLocation(qualityScoreConfigPath);
-            CanvasCommon.QualityScoreParameters qscoreParametersJSON = Deserialize<CanvasCommon.QualityScoreParameters>(qscoreConfigFile);
-            var logger = new Logger(new[] { Console.Out }, new[] { Console.Error });
-            SomaticCaller caller = new SomaticCaller(logger);
-            caller.somaticCallerParameters = somaticCallerParametersJSON;
-            caller.somaticCallerQscoreParameters = qscoreParametersJSON;
-            caller.TruthDataPath = truthDataPath;
-            caller.SomaticVcfPath = somaticVCFPath;
-            caller.IsEnrichment = isEnrichment;
-            caller.IsDbsnpVcf = isDbsnpVcf;
-            caller.userPurity = userPurity;
-            caller.userPloidy = userPloidy;
-            caller.IsTrainingMode = truthDataPath != null || isTrainMode;
-            caller.IsTrainingMode = isTrainMode;
-            caller.QualityFilterThreshold = qualityFilterThreshold;
-
-            // Set parameters:
-
-            if (!string.IsNullOrEmpty(ploidyVcfPath))
+            // A new caller for every call: CallVariants modifies the segments and parameters it works on.
+            Func<string, string, int> callVariants = (callParameterconfigPath, callOutFile) =>
             {
-                caller.LoadReferencePloidy(ploidyVcfPath);
-            }
+                FileLocation parameterconfigFile = new FileLocation(callParameterconfigPath);
+                SomaticCallerParameters somaticCallerParametersJSON = Deserialize<SomaticCallerParameters>(parameterconfigFile);
 
-            double? localSDmetric = null;
-            double? evennessMetric = null;
+                FileLocation qscoreConfigFile = new FileLocation(qualityScoreConfigPath);
+                CanvasCommon.QualityScoreParameters qscoreParametersJSON = Deserialize<CanvasCommon.QualityScoreParameters>(qscoreConfigFile);
+                var logger = new Logger(new[] { Console.Out }, new[] { Console.Error });
+                SomaticCaller caller = new SomaticCaller(logger);
+                caller.somaticCallerParameters = somaticCallerParametersJSON;
+                caller.somaticCallerQscoreParameters = qscoreParametersJSON;
+                caller.TruthDataPath = truthDataPath;
+                caller.SomaticVcfPath = somaticVCFPath;
+                caller.IsEnrichment = isEnrichment;
+                caller.IsDbsnpVcf = isDbsnpVcf;
+                caller.userPurity = userPurity;
+                caller.userPloidy = userPloidy;
+                caller.IsTrainingMode = truthDataPath != null || isTrainMode;
+                caller.IsTrainingMode = isTrainMode;
+                caller.QualityFilterThreshold = qualityFilterThreshold;
 
-            if (!string.IsNullOrEmpty(localSdMetricFile))
-            {
-                localSDmetric = CanvasCommon.CanvasIO.ReadLocalSdMetricFromTextFile(localSdMetricFile);
-            }
+                // Set parameters:
+
+                if (!string.IsNullOrEmpty(ploidyVcfPath))
+                {
+                    caller.LoadReferencePloidy(ploidyVcfPath);
+                }
 
-            if (!string.IsNullOrEmpty(evennessMetricFile))
+                double? localSDmetric = null;
+                double? evennessMetric = null;
+
+                if (!string.IsNullOrEmpty(localSdMetricFile))
+                {
+                    localSDmetric = CanvasCommon.CanvasIO.ReadLocalSdMetricFromTextFile(localSdMetricFile);
+                }
+
+                if (!string.IsNullOrEmpty(evennessMetricFile))
+                {
+                    evennessMetric = CanvasCommon.CanvasIO.ReadEvennessMetricFromTextFile(evennessMetricFile);
+                }
+
+                caller.LoadBedFile(bedPath);
+                return caller.CallVariants(inFile, variantFrequencyFile, callOutFile, referenceFolder, name, localSDmetric, evennessMetric, somaticClusteringMode);
+            };
+
+            if (isWorkerMode)
+                return RunWorker(callVariants);
+            return callVariants(parameterconfigPath, outFile);
+        }
+
+        /// <summary>
+        /// INTERNAL: serve the calls of the model optimizer for one sample from a single process, so that the runtime
+        /// start-up and JIT compilation are paid once per sample. The sample inputs are still read by every call.
+        /// The output of a call goes to its Log file, stdout only carries one JSON result line per request.
+        /// </summary>
+        private static int RunWorker(Func<string, string, int> callVariants)
+        {
+            TextWriter protocolOut = Console.Out;
+            TextWriter protocolError = Console.Error;
+            string line;
+            while ((line = Console.In.ReadLine()) != null)
             {
-                evennessMetric = CanvasCommon.CanvasIO.ReadEvennessMetricFromTextFile(evennessMetricFile);
+                if (string.IsNullOrWhiteSpace(line))
+                    continue;
+                WorkerRequest request = JsonConvert.DeserializeObject<WorkerRequest>(line);
+                Stopwatch watch = Stopwatch.StartNew();
+                int exitCode;
+                string error = null;
+                using (StreamWriter log = new StreamWriter(request.Log ?? request.OutFile + ".log") { AutoFlush = true })
+                {
+                    Console.SetOut(log);
+                    Console.SetError(log);
+                    try
+                    {
+                        if (File.Exists(request.ParameterConfig))
+                        {
+                            exitCode = callVariants(request.ParameterConfig, request.OutFile);
+                        }
+                        else
+                        {
+                            error = $"File {request.ParameterConfig} does not exist";
+                            exitCode = 1;
+                        }
+                    }
+                    catch (Exception e)
+                    {
+                        log.WriteLine(e.ToString());
+                        error = e.Message;
+                        exitCode = 1;
+                    }
+                    finally
+                    {
+                        Console.SetOut(protocolOut);
+                        Console.SetError(protocolError);
+                    }
+                }
+                protocolOut.WriteLine(JsonConvert.SerializeObject(new { request.OutFile, ExitCode = exitCode, Seconds = watch.Elapsed.TotalSeconds, Error = error }));
+                protocolOut.Flush();
             }
-
-            caller.LoadBedFile(bedPath);
-            return caller.CallVariants(inFile, variantFrequencyFile, outFile, referenceFolder, name, localSDmetric, evennessMetric, somaticClusteringMode);
+            return 0;
         }
         private static T Deserialize<T>(IFileLocation path)
         {
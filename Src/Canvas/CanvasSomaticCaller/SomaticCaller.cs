@@ -418,7 +418,8 @@ namespace CanvasSomaticCaller
                     _segments.Clear();
                     CanvasSegmentWriter.WriteSegments(outputVCFPath, _segments, _model.DiploidCoverage, referenceFolder, name, ExtraHeaders,
                     ReferencePloidy, QualityFilterThreshold, false, null, CanvasFilter.SegmentSizeCutoff);
-                    Environment.Exit(0);
+                    // returned rather than exiting, a warm worker (CanvasSomaticCaller.exe --worker) goes on with its next call:
+                    return 0;
                 }
                 else if (e is NotEnoughUsableSegementsException)
                 {
@@ -1,8 +1,20 @@
 """
 Parameter sweep tool: Invoke Canvas across a smoke test, using various parameter combinations, to review overall accuracy.
+
+Combinations are run concurrently by a bounded pool of TestCanvasSomaticCaller.py processes, and a failed
+combination is rerun up to --retryMax times.  Completed combinations are recorded in a journal, so an
+interrupted sweep only re-runs unfinished or failed ones.
+Besides the full grid, a Latin hypercube or Sobol design can sample a subset of larger grids.
 """
 import os
+import sys
+import random
+import argparse
+import threading
+import subprocess
 import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 # Set up which parameters to vary, and which values to try:
 CanvasCallerParameters = []
@@ -14,54 +26,122 @@ CanvasCallerParameters.append(("-D", [1.25, 1.75, 2.5]))
 CanvasCallerParameters.append(("-C", [0.25, 1.0, 2.0]))
 CanvasCallerParameters.append(("-M", [500, 2000, 50000]))
 
-CommandLines = []
-Descriptions = []
+# Sobol direction numbers (Joe & Kuo): degree s, polynomial coefficients a, initial m values.
+# The first dimension is the van der Corput sequence.
+SobolDirections = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+]
+SobolBits = 32
+
+
+def EnumerateGrid(Parameters):
+    """
+    All combinations of parameter value indexes, varying the last parameter fastest
+    """
+    Combinations = []
+    CurrentIndexes = [0] * len(Parameters)
+    while 1:
+        Combinations.append(tuple(CurrentIndexes))
+        # Iterate to the next combination:
+        Index = len(Parameters) - 1
+        while Index >= 0:
+            CurrentIndexes[Index] += 1
+            if CurrentIndexes[Index] < len(Parameters[Index][1]):
+                break
+            CurrentIndexes[Index] = 0
+            Index -= 1
+        if Index < 0:
+            break
+    return Combinations
+
+
+def LatinHypercube(Dimensions, Count, Random):
+    """
+    Count points in the unit hypercube, one per stratum along every dimension
+    """
+    Columns = []
+    for Dimension in range(Dimensions):
+        Strata = range(Count)
+        Random.shuffle(Strata)
+        Columns.append([(Stratum + Random.random()) / Count for Stratum in Strata])
+    return zip(*Columns)
+
+
+def Sobol(Dimensions, Count):
+    """
+    First Count points (excluding the origin) of the Sobol sequence in the unit hypercube
+    """
+    if Dimensions > len(SobolDirections) + 1:
+        raise ValueError("Sobol design supports at most %s parameters" % (len(SobolDirections) + 1))
+    DirectionNumbers = [[1 << (SobolBits - Bit) for Bit in range(1, SobolBits + 1)]]
+    for Degree, Coefficients, InitialValues in SobolDirections[0:Dimensions - 1]:
+        V = [InitialValues[Bit] << (SobolBits - Bit - 1) for Bit in range(Degree)]
+        for Bit in range(Degree, SobolBits):
+            Value = V[Bit - Degree] ^ (V[Bit - Degree] >> Degree)
+            for Term in range(1, Degree):
+                if (Coefficients >> (Degree - 1 - Term)) & 1:
+                    Value ^= V[Bit - Term]
+            V.append(Value)
+        DirectionNumbers.append(V)
+    Points = []
+    X = [0] * Dimensions
+    for PointIndex in range(Count):
+        # Gray code ordering: flip the direction number of the lowest zero bit of the index
+        Bit = 0
+        while (PointIndex >> Bit) & 1:
+            Bit += 1
+        X = [X[Dimension] ^ DirectionNumbers[Dimension][Bit] for Dimension in range(Dimensions)]
+        Points.append(tuple(float(Value) / (1 << SobolBits) for Value in X))
+    return Points
 
-# Main test driver: Consider all combinations
-CurrentIndexes = [0] * len(CanvasCallerParameters)
-while 1:
-    #print CurrentIndexes
-    # Build the command-line for this parameter combo:
+
+def SampleGrid(Parameters, Design, Count, Seed):
+    """
+    Map a space-filling design onto the value lists of the parameters, dropping repeated combinations
+    """
+    if Design == "grid":
+        return EnumerateGrid(Parameters)
+    if Design == "lhs":
+        Points = LatinHypercube(len(Parameters), Count, random.Random(Seed))
+    else:
+        Points = Sobol(len(Parameters), Count)
+    Combinations = []
+    Seen = set()
+    for Point in Points:
+        Indexes = tuple(min(int(Value * len(Parameters[Index][1])), len(Parameters[Index][1]) - 1) for Index, Value in enumerate(Point))
+        if Indexes in Seen:
+            continue
+        Seen.add(Indexes)
+        Combinations.append(Indexes)
+    return Combinations
+
+
+def BuildCommandLine(Parameters, Indexes):
+    """
+    Build the command-line and description for this parameter combo
+    """
     CommandLine = "-x \""
     Description = ""
-    for Index in range(len(CanvasCallerParameters)):
-        Value = CanvasCallerParameters[Index][1][CurrentIndexes[Index]]
-        CommandLine += "%s %s "%(CanvasCallerParameters[Index][0], Value)
-        Description += "%s\t"%(Value)
+    for Index in range(len(Parameters)):
+        Value = Parameters[Index][1][Indexes[Index]]
+        CommandLine += "%s %s " % (Parameters[Index][0], Value)
+        Description += "%s\t" % (Value)
     CommandLine += "\""
-    Descriptions.append(Description)
-    CommandLines.append(CommandLine)
-    # Iterate to the next combination:
-    Index = len(CanvasCallerParameters) - 1
-    while Index >= 0:
-        CurrentIndexes[Index] += 1
-        #print Index, CurrentIndexes[Index],
-        if CurrentIndexes[Index] < len(CanvasCallerParameters[Index][1]):
-            break
-        CurrentIndexes[Index] = 0
-        Index -= 1
-        #print CurrentIndexes
-    if Index < 0:
-        break
-
-SweepFolder = "ParamSweep"
-if not os.path.exists(SweepFolder):
-    os.makedirs(SweepFolder)
-
-OutputFile = open(os.path.join(SweepFolder, "ResultsSummary.txt"), "wb")    
-for SetIndex in range(len(CommandLines)):
-    print CommandLines[SetIndex], Descriptions[SetIndex]
-    # Invoke test suite and save results:
-    TestOutputPath = os.path.join(SweepFolder, "Results%s.txt"%SetIndex)
-    CommandLine = "TestCanvasSomaticCaller.py %s -o %s"%(CommandLines[SetIndex], TestOutputPath)
-    print CommandLine
-    OutputFile.write("%s\t%s"%(SetIndex, Descriptions[SetIndex]))
-    try:
-        os.system(CommandLine)
-    except:
-        traceback.print_exc()
-        OutputFile.write("FAIL\n")
-        continue
+    return CommandLine, Description
+
+
+def SummarizeResults(TestOutputPath):
+    """
+    Count, minimum and mean accuracy and mean event count over the smoke test results
+    """
     File = open(TestOutputPath, "rb")
     Count = 0
     AccuracyMin = 9999
@@ -71,19 +151,135 @@ for SetIndex in range(len(CommandLines)):
         Bits = FileLine.split("\t")
         if len(Bits) < 2 or len(Bits[0]) == 0 or Bits[0][0] == "#":
             continue
-        print Bits[0], Bits[1]
         try:
             Value = float(Bits[1])
         except:
-            continue 
+            continue
         AccuracyMin = min(AccuracyMin, Value)
         Count += 1
         AccuracyMean += Value
         EventMean += float(Bits[3])
-    AccuracyMean /= max(1, Count) 
+    File.close()
+    AccuracyMean /= max(1, Count)
     EventMean /= max(1, Count)
-    OutputFile.write("%s\t%s\t%s\t%s\t\n"%(Count, AccuracyMin, AccuracyMean, EventMean))
-    print
-    print ">>>%s\t%s\t%s\t%s\t%s\t%s\t"%(SetIndex, Descriptions[SetIndex], Count, AccuracyMin, AccuracyMean, EventMean)
-    OutputFile.flush()
-                         
+    return "%s\t%s\t%s\t%s\t" % (Count, AccuracyMin, AccuracyMean, EventMean)
+
+
+def ReadJournal(JournalPath):
+    """
+    Summaries of combinations completed by previous runs, keyed on their command-line
+    """
+    Completed = {}
+    if not os.path.exists(JournalPath):
+        return Completed
+    for FileLine in open(JournalPath, "rb"):
+        Bits = FileLine.rstrip("\r\n").split("\t", 1)
+        # skip a partially written last line:
+        if len(Bits) == 2 and FileLine.endswith("\n"):
+            Completed[Bits[0]] = Bits[1]
+    return Completed
+
+
+class ParameterSweep:
+    """
+    Runs combinations concurrently, journals completions and writes ResultsSummary.txt in combination order
+    """
+
+    def __init__(self, Parameters, Combinations, SweepFolder, RetryMax=0):
+        self.SweepFolder = SweepFolder
+        self.RetryMax = RetryMax
+        self.CommandLines = []
+        self.Descriptions = []
+        for Indexes in Combinations:
+            CommandLine, Description = BuildCommandLine(Parameters, Indexes)
+            self.CommandLines.append(CommandLine)
+            self.Descriptions.append(Description)
+        self.JournalPath = os.path.join(SweepFolder, "Journal.txt")
+        self.Completed = ReadJournal(self.JournalPath)
+        self.Summaries = {}
+        self.NextSummaryIndex = 0
+        self.FailureCount = 0
+        self.Lock = threading.Lock()
+
+    def RunCombination(self, SetIndex):
+        # Invoke test suite and save results:
+        TestOutputPath = os.path.join(self.SweepFolder, "Results%s.txt" % SetIndex)
+        CommandLine = "TestCanvasSomaticCaller.py %s -o %s" % (self.CommandLines[SetIndex], TestOutputPath)
+        print CommandLine
+        for Attempt in range(self.RetryMax + 1):
+            try:
+                ExitCode = subprocess.call(CommandLine, shell=True)
+                if ExitCode == 0:
+                    return SetIndex, SummarizeResults(TestOutputPath)
+                print ">>>%s\t%sFAIL exit code %s (attempt %s)" % (SetIndex, self.Descriptions[SetIndex], ExitCode, Attempt + 1)
+            except:
+                traceback.print_exc()
+        return SetIndex, None
+
+    def RecordResult(self, SetIndex, Summary):
+        with self.Lock:
+            if Summary is None:
+                self.FailureCount += 1
+            elif self.CommandLines[SetIndex] not in self.Completed:
+                self.Completed[self.CommandLines[SetIndex]] = Summary
+                self.Journal.write("%s\t%s\n" % (self.CommandLines[SetIndex], Summary))
+                self.Journal.flush()
+                os.fsync(self.Journal.fileno())
+                print ">>>%s\t%s%s" % (SetIndex, self.Descriptions[SetIndex], Summary)
+            self.Summaries[SetIndex] = Summary
+            # Report every combination whose predecessors have all finished:
+            while self.NextSummaryIndex in self.Summaries:
+                Summary = self.Summaries.pop(self.NextSummaryIndex)
+                self.OutputFile.write("%s\t%s%s\n" % (self.NextSummaryIndex, self.Descriptions[self.NextSummaryIndex], Summary if Summary is not None else "FAIL"))
+                self.NextSummaryIndex += 1
+            self.OutputFile.flush()
+
+    def Run(self, Jobs):
+        self.Journal = open(self.JournalPath, "ab")
+        # Cut off a line torn by an interrupted run, so that the next record starts on a line of its own:
+        self.Journal.truncate(open(self.JournalPath, "rb").read().rfind("\n") + 1)
+        self.OutputFile = open(os.path.join(self.SweepFolder, "ResultsSummary.txt"), "wb")
+        Pending = []
+        for SetIndex in range(len(self.CommandLines)):
+            print self.CommandLines[SetIndex], self.Descriptions[SetIndex]
+            if self.CommandLines[SetIndex] in self.Completed:
+                self.RecordResult(SetIndex, self.Completed[self.CommandLines[SetIndex]])
+            else:
+                Pending.append(SetIndex)
+        print "%s of %s combinations already completed" % (len(self.CommandLines) - len(Pending), len(self.CommandLines))
+        Pool = ThreadPool(Jobs)
+        try:
+            for SetIndex, Summary in Pool.imap_unordered(self.RunCombination, Pending):
+                self.RecordResult(SetIndex, Summary)
+        finally:
+            Pool.terminate()
+            self.OutputFile.close()
+            self.Journal.close()
+        return self.FailureCount
+
+
+def GetCommandlineOptions():
+    Parser = argparse.ArgumentParser(description="Sweep CanvasSomaticCaller parameters over the smoke test")
+    Parser.add_argument("-j", "--jobs", dest="Jobs", type=int, default=multiprocessing.cpu_count(), help="Number of combinations to run concurrently (default: number of cores)")
+    Parser.add_argument("-d", "--design", dest="Design", default="grid", choices=["grid", "lhs", "sobol"], help="Full grid, Latin hypercube or Sobol sample of the grid (default grid)")
+    Parser.add_argument("-n", "--samples", dest="Samples", type=int, default=20, help="Number of points drawn by the lhs and sobol designs (default 20)")
+    Parser.add_argument("-s", "--seed", dest="Seed", type=int, default=None, help="Random seed of the lhs design")
+    Parser.add_argument("-r", "--retryMax", dest="RetryMax", type=int, default=0, help="Number of times a failed combination is rerun (default 0)")
+    Parser.add_argument("-o", "--output", dest="SweepFolder", default="ParamSweep", help="Output folder (default ParamSweep)")
+    return Parser.parse_args()
+
+
+def Main():
+    Options = GetCommandlineOptions()
+    if not os.path.exists(Options.SweepFolder):
+        os.makedirs(Options.SweepFolder)
+    # Main test driver: Consider all (or a sample of the) combinations
+    Combinations = SampleGrid(CanvasCallerParameters, Options.Design, Options.Samples, Options.Seed)
+    FailureCount = ParameterSweep(CanvasCallerParameters, Combinations, Options.SweepFolder, Options.RetryMax).Run(Options.Jobs)
+    if FailureCount:
+        print "%s combinations failed" % FailureCount
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    Main()
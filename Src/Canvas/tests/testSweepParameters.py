@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SweepParameters import *
+
+Parameters = [("-D", [1.25, 1.75, 2.5]), ("-C", [0.25, 1.0]), ("-M", [500, 2000, 50000])]
+
+
+class TestDesigns(unittest.TestCase):
+
+    def testEnumerateGrid(self):
+        Combinations = EnumerateGrid(Parameters)
+        self.assertEqual(len(Combinations), 18)
+        self.assertEqual(len(set(Combinations)), 18)
+        self.assertEqual(Combinations[0:4], [(0, 0, 0), (0, 0, 1), (0, 0, 2), (0, 1, 0)])
+        self.assertEqual(Combinations[-1], (2, 1, 2))
+        self.assertEqual(SampleGrid(Parameters, "grid", 5, None), Combinations)
+
+    def testLatinHypercube(self):
+        Points = LatinHypercube(3, 10, random.Random(1))
+        self.assertEqual(len(Points), 10)
+        for Dimension in range(3):
+            # one point per tenth of every dimension:
+            self.assertEqual(sorted(int(Point[Dimension] * 10) for Point in Points), range(10))
+        self.assertEqual(LatinHypercube(3, 10, random.Random(1)), Points)
+        self.assertNotEqual(LatinHypercube(3, 10, random.Random(2)), Points)
+
+    def testSobol(self):
+        self.assertEqual(Sobol(2, 4), [(0.5, 0.5), (0.75, 0.25), (0.25, 0.75), (0.375, 0.375)])
+        Dimensions = len(SobolDirections) + 1
+        Points = Sobol(Dimensions, 15) + [(0.0,) * Dimensions]
+        for Dimension in range(Dimensions):
+            # the first 2^k points, with the origin, have one point per 1/2^k of every dimension:
+            self.assertEqual(sorted(int(Point[Dimension] * 16) for Point in Points), range(16))
+        self.assertRaises(ValueError, Sobol, Dimensions + 1, 4)
+
+    def testSampleGrid(self):
+        for Design in ["lhs", "sobol"]:
+            Combinations = SampleGrid(Parameters, Design, 40, 3)
+            self.assertEqual(len(set(Combinations)), len(Combinations))
+            self.assertTrue(0 < len(Combinations) <= 18)
+            for Indexes in Combinations:
+                self.assertTrue(all(0 <= Index < len(Parameters[Dimension][1]) for Dimension, Index in enumerate(Indexes)))
+        self.assertEqual(SampleGrid(Parameters, "lhs", 8, 3), SampleGrid(Parameters, "lhs", 8, 3))
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.SweepFolder = tempfile.mkdtemp()
+        self.Combinations = EnumerateGrid(Parameters)[0:6]
+        self.Runs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.SweepFolder)
+
+    def MakeSweep(self, FailedIndexes=()):
+        """
+        Sweep whose combinations finish in reverse order instead of running the smoke test
+        """
+        Sweep = ParameterSweep(Parameters, self.Combinations, self.SweepFolder)
+        def RunCombination(SetIndex):
+            self.Runs.append(SetIndex)
+            time.sleep(0.02 * (len(self.Combinations) - SetIndex))
+            return SetIndex, None if SetIndex in FailedIndexes else "1\t%s\t%s\t2\t" % (SetIndex, SetIndex)
+        Sweep.RunCombination = RunCombination
+        return Sweep
+
+    def ReadSummary(self):
+        return [FileLine.split("\t") for FileLine in open(os.path.join(self.SweepFolder, "ResultsSummary.txt")).read().splitlines()]
+
+    def testSummaryInCombinationOrder(self):
+        self.assertEqual(self.MakeSweep().Run(6), 0)
+        self.assertEqual(sorted(self.Runs), range(6))
+        Lines = self.ReadSummary()
+        self.assertEqual([Line[0] for Line in Lines], [str(SetIndex) for SetIndex in range(6)])
+        self.assertEqual(Lines[1][0:6], ["1", "1.25", "0.25", "2000", "1", "1"])
+
+    def testResumeRunsOnlyUnfinishedCombinations(self):
+        self.assertEqual(self.MakeSweep(FailedIndexes=[2, 4]).Run(3), 2)
+        self.assertEqual([Line[4] for Line in self.ReadSummary()], ["1", "1", "FAIL", "1", "FAIL", "1"])
+        # a line torn by the interruption is not a completed combination:
+        with open(os.path.join(self.SweepFolder, "Journal.txt"), "ab") as Journal:
+            Journal.write("%s\t1\t" % BuildCommandLine(Parameters, self.Combinations[2])[0])
+        self.assertEqual(len(ReadJournal(os.path.join(self.SweepFolder, "Journal.txt"))), 4)
+        self.Runs = []
+        self.assertEqual(self.MakeSweep().Run(3), 0)
+        self.assertEqual(sorted(self.Runs), [2, 4])
+        self.assertEqual([Line[4] for Line in self.ReadSummary()], ["1"] * 6)
+        Completed = ReadJournal(os.path.join(self.SweepFolder, "Journal.txt"))
+        self.assertEqual(sorted(Completed.values()), sorted("1\t%s\t%s\t2\t" % (SetIndex, SetIndex) for SetIndex in range(6)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Batched execution of the per-sample tasks of a parameter step.
+
+Instead of one pyflow task per sample and stage, the CanvasSomaticCaller and EvaluateCNV commands
+of all samples of a parameter step are written to a manifest and run either
+
+  chunk   as pyflow tasks of batchSize samples each, running their samples one after the other
+  array   as a single SGE array job with one array task per sample, submitted with qsubPath
+
+Every sample keeps its own retries and a status file next to its outputs, so a failed sample is
+reported by name and a retried job only reruns the samples that did not complete. The status
+records the hash of the parameter configuration it was written for, so the outputs of another
+configuration left in the same folder are not taken as complete. The 'qsub'
+command of this script emulates 'qsub -sync y -t' locally, so that array mode can be tested
+without a grid engine.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import threading
+import subprocess
+
+ScriptDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.join(ScriptDir, "redist", "pyflow", "src"))
+
+STATUS_FILE = "BatchStatus.json"
+# qsub options followed by a value:
+QSUB_VALUE_OPTIONS = set(["-t", "-N", "-o", "-e", "-S", "-l", "-pe", "-q", "-b", "-sync", "-wd", "-P", "-tc", "-hold_jid"])
+
+
+class SampleBatch:
+    """
+    Collects the commands that addSomaticCanvasTask and addEvaluateCNVTask would add as pyflow tasks
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.memMb = 0
+        self.nCores = 1
+
+    def startSample(self, sampleName, outputPath, configHash=None):
+        self.entries.append({"sample": sampleName, "outputPath": outputPath, "configHash": configHash, "stages": []})
+
+    def addTask(self, label, command, memMb=0, nCores=1, dependencies=None, **options):
+        self.entries[-1]["stages"].append({"label": label, "command": command})
+        self.memMb = max(self.memMb, memMb)
+        self.nCores = max(self.nCores, nCores)
+        return label
+
+    def pendingEntries(self):
+        return [entry for entry in self.entries if entry["stages"]]
+
+
+def writeManifest(manifestPath, entries, memMb, nCores):
+    with open(manifestPath + ".tmp", "w") as manifestFile:
+        json.dump({"entries": entries, "memMb": memMb, "nCores": nCores}, manifestFile, indent=4)
+    os.rename(manifestPath + ".tmp", manifestPath)
+
+
+def readManifest(manifestPath):
+    with open(manifestPath) as manifestFile:
+        return json.load(manifestFile)
+
+
+def readStatus(entry):
+    """
+    Status of the sample, None if it was not run with the configuration of the entry
+    """
+    try:
+        with open(os.path.join(entry["outputPath"], STATUS_FILE)) as statusFile:
+            status = json.load(statusFile)
+    except (IOError, ValueError):
+        return None
+    if status.get("configHash") != entry.get("configHash"):
+        return None
+    return status
+
+
+def writeStatus(entry, status):
+    statusPath = os.path.join(entry["outputPath"], STATUS_FILE)
+    with open(statusPath + ".tmp", "w") as statusFile:
+        json.dump(status, statusFile)
+    os.rename(statusPath + ".tmp", statusPath)
+
+
+def isComplete(entry):
+    status = readStatus(entry)
+    return status is not None and all(stage["label"] in status["completedStages"] for stage in entry["stages"])
+
+
+def runEntry(entry, retryMax):
+    """
+    Run the stages of a sample in order, each retried up to retryMax times, and record the outcome
+    """
+    if isComplete(entry):
+        return 0
+    status = readStatus(entry) or {"attempts": 0, "completedStages": [], "configHash": entry.get("configHash")}
+    for stage in entry["stages"]:
+        # stages completed by an earlier attempt, e.g. the calls of a sample whose evaluation failed, are not rerun:
+        if stage["label"] in status["completedStages"]:
+            continue
+        for attempt in range(retryMax + 1):
+            status["attempts"] += 1
+            exitStatus = subprocess.call(stage["command"], shell=True)
+            if exitStatus == 0:
+                break
+            print >> sys.stderr, "Sample %s: %s failed with exit status %i (attempt %i)" % (entry["sample"], stage["label"], exitStatus, attempt + 1)
+        if exitStatus != 0:
+            status.update({"status": "failed", "stage": stage["label"], "exitStatus": exitStatus, "host": os.uname()[1]})
+            writeStatus(entry, status)
+            return exitStatus
+        status["completedStages"].append(stage["label"])
+    status.update({"status": "complete", "stage": None, "exitStatus": 0, "host": os.uname()[1]})
+    writeStatus(entry, status)
+    return 0
+
+
+def reportFailures(entries):
+    failures = []
+    for entry in entries:
+        status = readStatus(entry)
+        if not isComplete(entry):
+            failures.append(entry)
+            if status is None or status["status"] != "failed":
+                print >> sys.stderr, "Sample %s: not run" % entry["sample"]
+            else:
+                print >> sys.stderr, "Sample %s: %s failed with exit status %i after %i attempts" % (entry["sample"], status["stage"], status["exitStatus"], status["attempts"])
+    return failures
+
+
+def toRanges(indexes):
+    """
+    Contiguous (first, last) ranges of sorted 1-based array task indexes
+    """
+    ranges = []
+    for index in sorted(indexes):
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def getQsubResourceArgs(nCores, memMb):
+    try:
+        from pyflowConfig import siteConfig
+        return siteConfig.qsubResourceArg(nCores, memMb)
+    except ImportError:
+        return []
+
+
+def submitArrayJob(manifestPath, qsubPath, retryMax, jobName):
+    """
+    Run every pending sample of a manifest as a task of an SGE array job, resubmitting failed
+    samples up to retryMax times, and return the number of failed samples
+    """
+    manifest = readManifest(manifestPath)
+    entries = manifest["entries"]
+    logPath = os.path.join(os.path.dirname(os.path.abspath(manifestPath)), "ArrayJobLogs")
+    if not os.path.isdir(logPath):
+        os.makedirs(logPath)
+    runner = [sys.executable, os.path.abspath(__file__), "run", "--manifest", os.path.abspath(manifestPath), "--retryMax", "0"]
+    for attempt in range(retryMax + 1):
+        pending = [index + 1 for index, entry in enumerate(entries) if not isComplete(entry)]
+        if not pending:
+            break
+        submissions = []
+        for first, last in toRanges(pending):
+            qsub = qsubPath.split() + ["-V", "-cwd", "-b", "y", "-sync", "y", "-N", jobName, "-o", logPath, "-e", logPath, "-t", "%i-%i" % (first, last)]
+            qsub += getQsubResourceArgs(manifest["nCores"], manifest["memMb"]) + runner
+            submissions.append(subprocess.Popen(qsub))
+        for submission in submissions:
+            submission.wait()
+    return len(reportFailures(entries))
+
+
+def runTaskArray(taskIds, command, maxParallel):
+    """
+    Run command once per array task id with SGE_TASK_ID set, at most maxParallel at a time
+    """
+    exitStatuses = {}
+    lock = threading.Semaphore(maxParallel)
+
+    def runTask(taskId):
+        environment = dict(os.environ)
+        environment["SGE_TASK_ID"] = str(taskId)
+        try:
+            exitStatuses[taskId] = subprocess.call(command, env=environment)
+        finally:
+            lock.release()
+
+    threads = []
+    for taskId in taskIds:
+        lock.acquire()
+        thread = threading.Thread(target=runTask, args=(taskId,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return exitStatuses
+
+
+def fakeQsub(arguments, maxParallel):
+    """
+    Local stand-in for 'qsub -sync y [-t first-last[:step]] command': runs the array tasks on this host
+    """
+    options = {}
+    while arguments and arguments[0].startswith("-"):
+        if arguments[0] in QSUB_VALUE_OPTIONS:
+            options[arguments[0]] = arguments[1]
+            arguments = arguments[2:]
+        else:
+            arguments = arguments[1:]
+    taskIds = [1]
+    if "-t" in options:
+        match = re.match(r"^(\d+)(?:-(\d+)(?::(\d+))?)?$", options["-t"])
+        first = int(match.group(1))
+        taskIds = range(first, int(match.group(2) or first) + 1, int(match.group(3) or 1))
+    jobId = os.getpid()
+    print "Your job-array %i.%i-%i:1 (\"%s\") has been submitted" % (jobId, taskIds[0], taskIds[-1], options.get("-N", "job"))
+    exitStatuses = runTaskArray(taskIds, arguments, maxParallel)
+    for taskId in taskIds:
+        print "Job %i.%i exited with exit code %i." % (jobId, taskId, exitStatuses[taskId])
+    return max(exitStatuses.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the samples of a parameter step as batch or array jobs")
+    parser.add_argument("command", choices=["run", "submit", "qsub"], help="run: run the samples of a manifest (the array task SGE_TASK_ID only, when set); submit: run a manifest as an SGE array job; qsub: local qsub emulation")
+    parser.add_argument("--manifest", dest="manifest", help="Manifest of the samples of a parameter step")
+    parser.add_argument("--retryMax", dest="retryMax", type=int, default=3, help="Retries of a failed sample (default 3)")
+    parser.add_argument("--qsubPath", dest="qsubPath", default="qsub", help="qsub command used by submit (default qsub)")
+    parser.add_argument("--jobName", dest="jobName", default="SomaticCanvasBatch", help="Name of the array job")
+    parser.add_argument("--maxParallel", dest="maxParallel", type=int, default=4, help="Array tasks run at once by the qsub emulation (default 4)")
+    if len(sys.argv) > 1 and sys.argv[1] == "qsub":
+        # qsub arguments are passed through untouched:
+        options = parser.parse_args(["qsub"])
+        if "QSUB_MAX_PARALLEL" in os.environ:
+            options.maxParallel = int(os.environ["QSUB_MAX_PARALLEL"])
+        sys.exit(fakeQsub(sys.argv[2:], options.maxParallel))
+    options = parser.parse_args()
+    if options.command == "submit":
+        sys.exit(1 if submitArrayJob(options.manifest, options.qsubPath, options.retryMax, options.jobName) else 0)
+    entries = readManifest(options.manifest)["entries"]
+    if "SGE_TASK_ID" in os.environ and os.environ["SGE_TASK_ID"] != "undefined":
+        entries = [entries[int(os.environ["SGE_TASK_ID"]) - 1]]
+    for entry in entries:
+        runEntry(entry, options.retryMax)
+    sys.exit(1 if reportFailures(entries) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the optimizer orchestration layer.
+
+A synthetic training corpus is generated and CanvasSomaticCaller/EvaluateCNV are replaced by the
+'stub' command of this script, passed to the workflow as --monoPath: the stub caller writes CNV
+calls scored by the distance of their configuration to a hidden optimum, the stub EvaluateCNV
+writes a complete Results.txt, both after a configurable latency. The 'run' command measures
+
+  corpus       readTestCorpus time for the synthetic corpus
+  configIO     parameter JSON read, write and hash time per configuration
+  graph        time to build the tasks of iterations x parameters x samples as FullWorkflow adds
+               them, with their step configuration files (pyflow scheduling is part of endToEnd)
+  aggregation  Results.txt parsing and results store throughput, ranking and summary time
+  endToEnd     optimizeSomaticCanvasModel.py in local mode against the stubs: wall time and
+               scheduling overhead over the lower bound set by the stub task times
+
+and writes all numbers to a JSON file, so that regressions can be tracked between revisions.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+import numpy
+
+ScriptDir = os.path.abspath(os.path.dirname(__file__))
+from SomaticCanvasModelWorkflow import *
+from SomaticCanvasTelemetry import readRecords
+
+DEFAULT_MODEL_PARAMETERS = os.path.join(ScriptDir, "modelParameters.json")
+DEFAULT_CALLER_PARAMETERS = os.path.join(ScriptDir, "..", "..", "Src", "Canvas", "CanvasSomaticCaller", "SomaticCallerParameters.json")
+CHROMOSOMES = [("chr%i" % chromosome, 50000000) for chromosome in range(1, 23)]
+TRUTH_EVENTS_PER_CHROMOSOME = 20
+
+def stubScore(configPath):
+    """
+    Accuracy of a configuration on the synthetic corpus: highest at the centre of every parameter range
+    """
+    with open(configPath) as configFile:
+        config = json.load(configFile)
+    with open(DEFAULT_MODEL_PARAMETERS) as modelParametersFile:
+        modelParameters = json.load(modelParametersFile)
+    distance = 0.0
+    for name, (valueMin, valueMax) in modelParameters.iteritems():
+        if name in config:
+            distance += ((float(config[name]) - (valueMin + valueMax) / 2.0) / (valueMax - valueMin)) ** 2
+    return 95.0 - 20.0 * distance / len(modelParameters)
+
+
+def stubCaller(arguments):
+    options = dict(zip(arguments[0::2], arguments[1::2]))
+    score = stubScore(options["-c"])
+    rng = random.Random(options["-o"] + repr(score))
+    with gzip.open(options["-o"], "wb") as outFile:
+        outFile.write("##fileformat=VCFv4.1\n##source=SomaticCanvasBenchmark\n##BenchmarkScore=%f\n" % score)
+        outFile.write("##EstimatedTumorPurity=%.2f\n##OverallPloidy=%.2f\n" % (rng.uniform(0.3, 0.9), rng.uniform(1.8, 3.5)))
+        outFile.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tTumor\n")
+        with open(options["-t"]) as truthFile:
+            for line in truthFile:
+                if line.startswith("#"):
+                    continue
+                columns = line.rstrip("\n").split("\t")
+                info = dict(field.split("=") for field in columns[7].split(";"))
+                copyNumber = int(round(float(info["CN"]))) if rng.random() < score / 100.0 else 2
+                alt = "." if copyNumber == 2 else "<CNV>"
+                outFile.write("%s\t%s\t.\tN\t%s\t.\tPASS\tEND=%s\tGT:CN\t0/1:%i\n" % (columns[0], columns[1], alt, info["END"], copyNumber))
+
+
+def stubEvaluateCNV(arguments):
+    truthSetPath, cnvCallsPath, excludedBedPath, outFilePath = arguments[0:4]
+    header = {}
+    with gzip.open(cnvCallsPath) as inFile:
+        for line in inFile:
+            if not line.startswith("##"):
+                break
+            key, value = line[2:].rstrip("\n").split("=", 1)
+            header[key] = value
+    score = float(header["BenchmarkScore"])
+    rng = random.Random(hashlib.sha1(cnvCallsPath).hexdigest())
+    with open(outFilePath + ".tmp", "w") as outFile:
+        for title in ["Results for PASSing variants", "Results for all variants"]:
+            outFile.write("Purity\t%s\nPloidy\t%s\n%s\n" % (header["EstimatedTumorPurity"], header["OverallPloidy"], title))
+            for metric in EVALUATE_CNV_METRICS:
+                if metric in ("VariantEventsCalled", "VariantBasesCalled"):
+                    outFile.write("%s\t%i\n" % (metric, rng.randint(10, 1000) * (1 if metric == "VariantEventsCalled" else 100000)))
+                else:
+                    outFile.write("%s\t%.4f\n" % (metric, min(100.0, score + rng.gauss(0, 2))))
+            outFile.write("\n")
+    os.rename(outFilePath + ".tmp", outFilePath)
+
+
+def stubWorker(arguments, latency, jitter):
+    """
+    Stand-in for CanvasSomaticCaller.exe --worker: serve the JSON requests of stdin, each taking latency seconds
+    """
+    for line in iter(sys.stdin.readline, ""):
+        request = json.loads(line)
+        start = time.time()
+        time.sleep(max(0.0, latency * (1.0 + random.uniform(-jitter, jitter))))
+        stubCaller(arguments + ["-o", request["OutFile"], "-c", request["ParameterConfig"]])
+        with open(request["Log"], "w") as logFile:
+            logFile.write("Stub call of %s\n" % request["ParameterConfig"])
+        sys.stdout.write(json.dumps({"OutFile": request["OutFile"], "ExitCode": 0, "Seconds": time.time() - start, "Error": None}) + "\n")
+        sys.stdout.flush()
+
+
+def stub(arguments):
+    """
+    Stand-in for mono: --latency seconds [--jitter fraction] [--startup seconds] then the executable and
+    its arguments. --startup is paid once per process, as the start-up and JIT compilation of mono.
+    """
+    latency, jitter, startup = 0.0, 0.0, 0.0
+    while arguments and arguments[0].startswith("--"):
+        if arguments[0] == "--latency":
+            latency = float(arguments[1])
+        elif arguments[0] == "--jitter":
+            jitter = float(arguments[1])
+        elif arguments[0] == "--startup":
+            startup = float(arguments[1])
+        arguments = arguments[2:]
+    time.sleep(startup)
+    if os.path.basename(arguments[0]) == "CanvasSomaticCaller.exe" and "--worker" in arguments:
+        stubWorker([argument for argument in arguments[1:] if argument != "--worker"], latency, jitter)
+        return
+    time.sleep(max(0.0, latency * (1.0 + random.uniform(-jitter, jitter))))
+    if os.path.basename(arguments[0]) == "CanvasSomaticCaller.exe":
+        stubCaller(arguments[1:])
+    else:
+        stubEvaluateCNV(arguments[1:])
+
+
+def getStubMonoPath(latency, jitter, startup=0.0):
+    return "%s %s stub --latency %s --jitter %s --startup %s" % (sys.executable, os.path.join(ScriptDir, "SomaticCanvasBenchmark.py"), latency, jitter, startup)
+
+
+def writeSyntheticCorpus(corpusPath, nSamples, seed=0):
+    """
+    Training corpus of nSamples samples with small inputs, in the layout read by readTestCorpus
+    """
+    rng = random.Random(seed)
+    ensureDir(corpusPath)
+    ensureDir(os.path.join(corpusPath, "Reference"))
+    with open(os.path.join(corpusPath, "Reference", "GenomeSize.xml"), "w") as outFile:
+        outFile.write("<SquareGenomeSize>\n")
+        for chromosome, length in CHROMOSOMES:
+            outFile.write("  <Chromosome fileName=\"genome.fa\" name=\"%s\" length=\"%i\" />\n" % (chromosome, length))
+        outFile.write("</SquareGenomeSize>\n")
+    with open(os.path.join(corpusPath, "filter.bed"), "w") as outFile:
+        for chromosome, length in CHROMOSOMES:
+            outFile.write("%s\t0\t10000\n" % chromosome)
+    with open(os.path.join(corpusPath, "exclude.bed"), "w") as outFile:
+        for chromosome, length in CHROMOSOMES:
+            outFile.write("%s\t%i\t%i\n" % (chromosome, length / 2, length / 2 + 100000))
+    with open(os.path.join(corpusPath, "corpus.tsv"), "w") as corpusFile:
+        corpusFile.write("#sampleNames\tsampleDataPath\tsampleReferenceGenome\tsampleFilterBed\ttruthFile\texlcudeRegions\n")
+        for sampleIndex in range(nSamples):
+            sampleName = "Sample%04i" % sampleIndex
+            samplePath = os.path.join(corpusPath, "data", sampleName)
+            ensureDir(samplePath)
+            with open(os.path.join(samplePath, "truth.vcf"), "w") as outFile:
+                outFile.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+                for chromosome, length in CHROMOSOMES:
+                    starts = sorted(rng.sample(xrange(1, length - 200000, 200000), TRUTH_EVENTS_PER_CHROMOSOME))
+                    for start in starts:
+                        end = start + rng.randint(20000, 190000)
+                        outFile.write("%s\t%i\t.\tN\t<CNV>\t.\tPASS\tEND=%i;CN=%i\n" % (chromosome, start, end, rng.choice([0, 1, 3, 4])))
+            with open(os.path.join(samplePath, "Tumor.partitioned"), "w") as outFile:
+                for chromosome, length in CHROMOSOMES:
+                    for binIndex in range(50):
+                        outFile.write("%s\t%i\t%i\t%.2f\t%i\n" % (chromosome, binIndex * 1000000, (binIndex + 1) * 1000000, rng.uniform(50, 150), binIndex / 10))
+            with gzip.open(os.path.join(samplePath, "VFResultsTumor.txt.gz"), "wb") as outFile:
+                for chromosome, length in CHROMOSOMES:
+                    outFile.write("%s\t%i\tA\tG\t%i\t%i\n" % (chromosome, rng.randint(1, length), rng.randint(10, 50), rng.randint(10, 50)))
+            corpusFile.write("%s\tdata/%s\tReference\tfilter.bed\ttruth.vcf\texclude.bed\n" % (sampleName, sampleName))
+    return os.path.join(corpusPath, "corpus.tsv")
+
+
+class CorpusParams:
+    """Training samples read by readTestCorpus"""
+
+    pass
+
+
+class BenchmarkParams:
+    """Parameters of the workflows benchmarked in-process, as set by optimizeSomaticCanvasModel.getParams"""
+
+    def __init__(self, corpusFile, outputPath, configPath, modelParametersSet, monoPath):
+        self.executablePath = os.path.dirname(os.path.abspath(__file__))
+        self.outputPath = outputPath
+        self.configPath = configPath
+        self.trainingSamples = corpusFile
+        self.evaluateCNVPath = os.path.join(self.executablePath, "EvaluateCNV.exe")
+        with open(modelParametersSet) as modelParametersSetFile:
+            self.modelParametersSet = json.load(modelParametersSetFile)
+        self.mode = "local"
+        self.monoPath = monoPath
+        self.nbestParams = 2
+        self.cacheDir = None
+        self.evaluator = "EvaluateCNV"
+        self.stagingDir = None
+        self.taskSizing = "fixed"
+        self.memoryCore = 1024
+        self.pollInterval = 0.1
+        self.currentParameter = ""
+        self.currentParameterValue = 0
+        self.iteration = 0
+        readTestCorpus(self, corpusFile)
+
+
+def timeRepeated(function, repeats):
+    """
+    Median seconds of repeated calls of function
+    """
+    times = []
+    for repeat in range(repeats):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return float(numpy.median(times))
+
+
+def benchmarkCorpus(corpusFile, repeats):
+    params = CorpusParams()
+    seconds = timeRepeated(lambda: readTestCorpus(params, corpusFile), repeats)
+    return {"samples": params.sampleSize, "seconds": seconds, "samplesPerSecond": params.sampleSize / max(seconds, 1e-9)}
+
+
+def benchmarkConfigIO(configPath, workDir, repeats):
+    parameterConfig = readModelParameters(os.path.join(configPath, "SomaticCallerParameters.json"))
+    outFilePath = os.path.join(workDir, "SomaticCallerParameters.json")
+    return {
+        "readSeconds": timeRepeated(lambda: readModelParameters(os.path.join(configPath, "SomaticCallerParameters.json")), repeats),
+        "writeSeconds": timeRepeated(lambda: writeModelParameters(outFilePath, parameterConfig), repeats),
+        "hashSeconds": timeRepeated(lambda: hashConfig(parameterConfig), repeats),
+    }
+
+
+class TaskGraphRecorder:
+    """Task sink with the addTask signature of a pyflow workflow, recording the task graph instead of running it"""
+
+    def __init__(self):
+        self.tasks = {}
+
+    def addTask(self, label, command, dependencies=None, **resources):
+        self.tasks[label] = (command, dependencies, resources)
+        return label
+
+
+def benchmarkGraph(params, nIterations):
+    """
+    Build the CanvasSomaticCaller and EvaluateCNV tasks of nIterations iterations of all parameters on all samples
+    as FullWorkflow adds them, including the step configuration files
+    """
+    parameterConfig = readModelParameters(os.path.join(params.configPath, "SomaticCallerParameters.json"))
+    nTasks = 0
+    start = time.time()
+    for iteration in range(nIterations):
+        params.iteration = iteration
+        for stepParameter, (valueMin, valueMax) in sorted(params.modelParametersSet.iteritems()):
+            stepConfig = dict(parameterConfig)
+            params.currentParameter = stepParameter
+            params.currentParameterValue = mutateModelParameters(stepConfig, stepParameter, valueMin, valueMax, "")
+            registerParameterStep(params, "Parameter_" + stepParameter + "_" + str(params.currentParameterValue), stepParameter, params.currentParameterValue, stepConfig)
+            recorder = TaskGraphRecorder()
+            for sampleIndex in getSampleIndices(params):
+                canvasTaskID = addSomaticCanvasTask(recorder, params, sampleIndex)
+                addEvaluateCNVTask(recorder, params, sampleIndex, dependencies = canvasTaskID)
+            nTasks += len(recorder.tasks)
+    buildSeconds = time.time() - start
+    return {
+        "iterations": nIterations,
+        "parameters": len(params.modelParametersSet),
+        "samples": params.sampleSize,
+        "tasks": nTasks,
+        "buildSeconds": buildSeconds,
+        "tasksPerSecond": nTasks / max(buildSeconds, 1e-9),
+        "secondsPerIteration": buildSeconds / max(nIterations, 1),
+    }
+
+
+def benchmarkAggregation(params, nSteps):
+    """
+    Parse stub Results.txt files of nSteps parameter steps on all samples into the results store, then rank them
+    """
+    params.iteration = 0
+    params.sampleIndices = None
+    stepPaths = []
+    for step in range(nSteps):
+        stepPath = os.path.join(params.outputPath, "Iteration_0", "Parameter_Aggregation_%i" % step)
+        for sampleIndex in range(params.sampleSize):
+            samplePath = os.path.join(stepPath, params.sampleNames[sampleIndex])
+            ensureDir(samplePath)
+            with gzip.open(os.path.join(samplePath, "CNV.vcf.gz"), "wb") as outFile:
+                outFile.write("##BenchmarkScore=%f\n##EstimatedTumorPurity=0.5\n##OverallPloidy=2.0\n#CHROM\n" % (80 + step % 10))
+            stubEvaluateCNV(["", os.path.join(samplePath, "CNV.vcf.gz"), "", os.path.join(samplePath, "Results.txt")])
+        registerParameterStep(params, os.path.basename(stepPath), "Aggregation", step, {"Aggregation": step})
+        stepPaths.append(stepPath)
+    start = time.time()
+    for stepPath in stepPaths:
+        parseEvaluateCNV(params, stepPath)
+    parseSeconds = time.time() - start
+    nResults = nSteps * params.sampleSize
+    return {
+        "steps": nSteps,
+        "samples": params.sampleSize,
+        "parseSeconds": parseSeconds,
+        "resultsPerSecond": nResults / max(parseSeconds, 1e-9),
+        "loadTableSeconds": timeRepeated(lambda: getResultsStore(params).loadTable(params.iteration), 3),
+        "bestParametersSeconds": timeRepeated(lambda: getBestparameters(params, params.nbestParams), 3),
+        "iterationSummarySeconds": timeRepeated(lambda: writeIterationSummary(params), 3),
+    }
+
+
+def benchmarkEndToEnd(corpusFile, configPath, workDir, nIterations, latency, jitter, mode="local", startup=0.0, workerPool=0):
+    """
+    Run the optimizer against the stubs and compare its wall time with the stub latency on the critical path
+    """
+    outputPath = os.path.join(workDir, "EndToEnd")
+    shutil.rmtree(outputPath, ignore_errors=True)
+    command = [sys.executable, os.path.join(ScriptDir, "optimizeSomaticCanvasModel.py"), "-i", corpusFile, "-e", workDir, "-o", outputPath,
+               "-c", configPath, "-v", os.path.join(workDir, "EvaluateCNV.exe"), "-m", mode, "-p", DEFAULT_MODEL_PARAMETERS,
+               "--monoPath", getStubMonoPath(latency, jitter, startup), "--iterations", str(nIterations), "--taskSizing", "fixed", "--workerPool", str(workerPool)]
+    start = time.time()
+    with open(os.path.join(workDir, "EndToEnd.log"), "w") as logFile:
+        exitStatus = subprocess.call(command, stdout=logFile, stderr=subprocess.STDOUT)
+    wallSeconds = time.time() - start
+    records = readRecords(os.path.join(outputPath, "Telemetry.jsonl"))
+    taskSeconds = sum(record["wallSeconds"] for record in records)
+    # every iteration waits for its callers, then for its EvaluateCNV tasks, each stage taking at least
+    # its slowest task and its task time spread over all cores:
+    stageTimes = {}
+    for record in records:
+        stageTimes.setdefault((record["iteration"], record["kind"]), []).append(record["wallSeconds"])
+    nCores = multiprocessing.cpu_count()
+    criticalSeconds = sum(max(max(times), sum(times) / nCores) for times in stageTimes.itervalues())
+    errors = 0
+    logPath = os.path.join(outputPath, "pyflow.data", "logs", "pyflow_log.txt")
+    if os.path.exists(logPath):
+        with open(logPath) as logFile:
+            errors = sum(1 for line in logFile if "[ERROR]" in line)
+    return {
+        "mode": mode,
+        "workerPool": workerPool,
+        "startupSeconds": startup,
+        "exitStatus": exitStatus,
+        "workflowErrors": errors,
+        "iterations": nIterations,
+        "tasks": len(records),
+        "cores": nCores,
+        "latencySeconds": latency,
+        "wallSeconds": wallSeconds,
+        "taskSeconds": taskSeconds,
+        "criticalPathSeconds": criticalSeconds,
+        "overheadSeconds": wallSeconds - criticalSeconds,
+        "overheadSecondsPerIteration": (wallSeconds - criticalSeconds) / max(nIterations, 1),
+        "overheadSecondsPerTask": (wallSeconds - criticalSeconds) / max(len(records), 1),
+    }
+
+
+def runBenchmarks(options):
+    workDir = os.path.abspath(options.workDir)
+    shutil.rmtree(workDir, ignore_errors=True)
+    ensureDir(workDir)
+    configPath = os.path.join(workDir, "Config")
+    ensureDir(configPath)
+    shutil.copy(options.callerParameters, os.path.join(configPath, "SomaticCallerParameters.json"))
+    for executable in ["CanvasSomaticCaller.exe", "EvaluateCNV.exe"]:
+        open(os.path.join(workDir, executable), "w").close()
+    benchmarks = options.benchmarks.split(",")
+    results = {}
+    largeCorpus = writeSyntheticCorpus(os.path.join(workDir, "LargeCorpus"), options.samples)
+    smallCorpus = writeSyntheticCorpus(os.path.join(workDir, "SmallCorpus"), options.endToEndSamples)
+    if "corpus" in benchmarks:
+        results["corpus"] = benchmarkCorpus(largeCorpus, options.repeats)
+    if "configIO" in benchmarks:
+        results["configIO"] = benchmarkConfigIO(configPath, workDir, options.repeats)
+    if "graph" in benchmarks:
+        params = BenchmarkParams(largeCorpus, os.path.join(workDir, "GraphRun"), configPath, DEFAULT_MODEL_PARAMETERS, getStubMonoPath(0, 0))
+        results["graph"] = benchmarkGraph(params, options.iterations)
+    if "aggregation" in benchmarks:
+        params = BenchmarkParams(largeCorpus, os.path.join(workDir, "AggregationRun"), configPath, DEFAULT_MODEL_PARAMETERS, getStubMonoPath(0, 0))
+        results["aggregation"] = benchmarkAggregation(params, options.aggregationSteps)
+    if "endToEnd" in benchmarks:
+        results["endToEnd"] = benchmarkEndToEnd(smallCorpus, configPath, workDir, options.endToEndIterations, options.latency, options.jitter, options.endToEndMode,
+                                                 options.startup, options.endToEndWorkerPool)
+    return {
+        "host": os.uname()[1],
+        "time": time.time(),
+        "python": sys.version.split()[0],
+        "settings": dict((key, value) for key, value in vars(options).iteritems() if key != "command"),
+        "results": results,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "stub":
+        stub(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(description="Benchmark the optimizer orchestration layer against stub executables")
+    parser.add_argument("command", choices=["run"], help="run: run the benchmarks; stub: stand-in for mono used by the benchmarks")
+    parser.add_argument("--workDir", dest="workDir", required=True, help="Scratch directory, deleted and recreated")
+    parser.add_argument("--output", dest="output", default=None, help="JSON file of the results (default: stdout only)")
+    parser.add_argument("--benchmarks", dest="benchmarks", default="corpus,configIO,graph,aggregation,endToEnd", help="Comma-separated benchmarks to run (default all)")
+    parser.add_argument("--samples", dest="samples", type=int, default=200, help="Samples of the corpus, graph and aggregation benchmarks (default 200)")
+    parser.add_argument("--iterations", dest="iterations", type=int, default=40, help="Iterations of the graph benchmark (default 40)")
+    parser.add_argument("--aggregationSteps", dest="aggregationSteps", type=int, default=20, help="Parameter steps parsed by the aggregation benchmark (default 20)")
+    parser.add_argument("--endToEndSamples", dest="endToEndSamples", type=int, default=4, help="Samples of the end-to-end benchmark (default 4)")
+    parser.add_argument("--endToEndIterations", dest="endToEndIterations", type=int, default=2, help="Iterations of the end-to-end benchmark (default 2)")
+    parser.add_argument("--endToEndMode", dest="endToEndMode", default="local", choices=["local", "native"], help="Run mode of the optimizer in the end-to-end benchmark (default local)")
+    parser.add_argument("--latency", dest="latency", type=float, default=0.2, help="Seconds every stub task takes (default 0.2)")
+    parser.add_argument("--jitter", dest="jitter", type=float, default=0.0, help="Relative random variation of the stub latency (default 0)")
+    parser.add_argument("--startup", dest="startup", type=float, default=0.0, help="Seconds every stub process takes to start, as mono start-up and JIT compilation (default 0)")
+    parser.add_argument("--endToEndWorkerPool", dest="endToEndWorkerPool", type=int, default=0, help="--workerPool of the optimizer in the end-to-end benchmark (default 0, no warm workers)")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=5, help="Repeats of the micro benchmarks (default 5)")
+    parser.add_argument("--callerParameters", dest="callerParameters", default=DEFAULT_CALLER_PARAMETERS, help="Initial SomaticCallerParameters.json")
+    options = parser.parse_args()
+    report = runBenchmarks(options)
+    if options.output is not None:
+        with open(options.output, "w") as outFile:
+            json.dump(report, outFile, indent=4, sort_keys=True)
+    print json.dumps(report["results"], indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
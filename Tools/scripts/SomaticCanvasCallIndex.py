@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+"""
+Index of the CNV calls of optimization runs, shared across runs.
+
+With --callIndex DIR every CNV.vcf.gz is read once, when the metrics of its sample are parsed, and
+its calls are appended to the column files (start, end, CN, filter, quality) of the partitions of
+their chromosomes in Calls/. Within the segment of a callset the calls are sorted on start and
+stored with the running maximum of the ends, which turns an overlap query into two binary
+searches. Callsets are keyed on (config hash, sample) in Index.db and their calls are stored once
+per distinct content, so the parameter steps of all runs that evaluated a configuration share
+them. Queries map the columns of the partitions they need into memory and never decompress a vcf again.
+"""
+import os
+import sys
+import fcntl
+import numpy
+import sqlite3
+import hashlib
+import argparse
+from SomaticCanvasEvaluator import openMaybeGzip
+from SomaticCanvasResultsStore import ResultsStore, getResultsStore
+
+INDEX_FILE = "Index.db"
+CALL_FIELDS = ["start", "end", "cn", "filter", "quality"]
+# the filter column holds codes of the filters table:
+COLUMN_TYPES = [("start", numpy.int64), ("end", numpy.int64), ("cn", numpy.int32), ("filter", numpy.int16), ("quality", numpy.float64), ("maxEnd", numpy.int64)]
+
+
+def parseCallRecord(bits):
+    """
+    (start, end, CN, filter, quality) of a vcf record, None for records without END; CN is -1 when missing
+    """
+    info = dict((field.split("=", 1) + [""])[0:2] for field in bits[7].split(";"))
+    if "END" not in info:
+        return None
+    sample = {}
+    if len(bits) > 9:
+        sample = dict(zip(bits[8].split(":"), bits[-1].split(":")))
+    cn = sample.get("CN", info.get("CN", "."))
+    quality = float(bits[5]) if bits[5] != "." else numpy.nan
+    return (int(bits[1]), int(info["END"]), int(cn) if cn != "." else -1, bits[6], quality)
+
+
+def readCallset(callsPath):
+    """
+    Calls of a CNV.vcf(.gz) as per-chromosome arrays sorted on start
+    """
+    rows = {}
+    chromosomes = []
+    with openMaybeGzip(callsPath) as inFile:
+        for fileLine in inFile:
+            if fileLine.startswith("#"):
+                continue
+            bits = fileLine.rstrip("\r\n").split("\t")
+            if len(bits) < 8:
+                continue
+            call = parseCallRecord(bits)
+            if call is None:
+                continue
+            if bits[0] not in rows:
+                chromosomes.append(bits[0])
+                rows[bits[0]] = []
+            rows[bits[0]].append(call)
+    callset = {}
+    for chromosome in chromosomes:
+        calls = sorted(rows[chromosome])
+        callset[chromosome] = {
+            "start": numpy.array([call[0] for call in calls], dtype=numpy.int64),
+            "end": numpy.array([call[1] for call in calls], dtype=numpy.int64),
+            "cn": numpy.array([call[2] for call in calls], dtype=numpy.int32),
+            "filter": numpy.array([call[3] for call in calls], dtype=str),
+            "quality": numpy.array([call[4] for call in calls], dtype=numpy.float64),
+        }
+    return chromosomes, callset
+
+
+def hashCallset(chromosomes, callset):
+    sha1 = hashlib.sha1()
+    for chromosome in chromosomes:
+        sha1.update(chromosome + "\n")
+        for field in CALL_FIELDS:
+            sha1.update(field + "\n")
+            sha1.update(callset[chromosome][field].tostring())
+    return sha1.hexdigest()
+
+
+def overlapSlice(starts, maxEnds, regionStart, regionEnd):
+    """
+    Bounds of the calls that may overlap the closed interval [regionStart, regionEnd]: the running
+    maximum of the ends is sorted, so the first call reaching regionStart and the last one starting
+    at or before regionEnd are binary searches
+    """
+    return numpy.searchsorted(maxEnds, regionStart, side="left"), numpy.searchsorted(starts, regionEnd, side="right")
+
+
+def parseRegion(region):
+    """
+    chr8:120000000-130000000 as (chromosome, start, end), 1-based and closed as vcf POS and END;
+    a bare chromosome is the whole chromosome
+    """
+    if ":" not in region:
+        return region, 1, numpy.iinfo(numpy.int64).max
+    chromosome, interval = region.rsplit(":", 1)
+    start, end = interval.replace(",", "").split("-")
+    return chromosome, int(start), int(end)
+
+
+class CallIndex:
+    """
+    Catalog of the indexed callsets in SQLite and the call columns of every chromosome partition.
+    A partition holds one binary file per column, to which the calls of each new callset on the
+    chromosome are appended as a segment; the catalog records the offset of every segment and
+    only lists segments whose columns were fully written, so a writer interrupted by a crash leaves
+    a tail that the next writer cuts off.
+    """
+
+    def __init__(self, indexPath):
+        self.indexPath = indexPath
+        if not os.path.isdir(os.path.join(indexPath, "Calls")):
+            os.makedirs(os.path.join(indexPath, "Calls"))
+        self.path = os.path.join(indexPath, INDEX_FILE)
+        self.columns = {}
+        self.filters = None
+        connection = self.connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS callsets (configHash TEXT, sample TEXT, callsHash TEXT, nCalls INTEGER, PRIMARY KEY (configHash, sample))")
+            connection.execute("CREATE TABLE IF NOT EXISTS partitions (partition INTEGER PRIMARY KEY, chromosome TEXT UNIQUE)")
+            connection.execute("CREATE TABLE IF NOT EXISTS segments (callsHash TEXT, ordinal INTEGER, partition INTEGER, offset INTEGER, nCalls INTEGER, minStart INTEGER, maxEnd INTEGER, PRIMARY KEY (callsHash, partition))")
+            connection.execute("CREATE TABLE IF NOT EXISTS filters (code INTEGER PRIMARY KEY, filter TEXT UNIQUE)")
+            connection.execute("CREATE TABLE IF NOT EXISTS steps (run TEXT, iteration TEXT, step TEXT, configHash TEXT, PRIMARY KEY (run, iteration, step))")
+            connection.execute("CREATE INDEX IF NOT EXISTS callsetsSample ON callsets (sample)")
+            connection.execute("CREATE INDEX IF NOT EXISTS segmentsPartition ON segments (partition)")
+        connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=600)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def getColumnPath(self, partition, field):
+        return os.path.join(self.indexPath, "Calls", "Partition_%i" % partition, field + ".bin")
+
+    def getIndexedSamples(self, configHash):
+        connection = self.connect()
+        rows = connection.execute("SELECT sample FROM callsets WHERE configHash = ?", (configHash,)).fetchall()
+        connection.close()
+        return set(str(row[0]) for row in rows)
+
+    def getCode(self, connection, table, keyColumn, valueColumn, value):
+        connection.execute("INSERT OR IGNORE INTO %s (%s) VALUES (?)" % (table, valueColumn), (value,))
+        return connection.execute("SELECT %s FROM %s WHERE %s = ?" % (keyColumn, table, valueColumn), (value,)).fetchone()[0]
+
+    def appendSegment(self, connection, partition, columns):
+        """
+        Append the columns of a segment to a partition after its last committed segment, return the offset
+        """
+        offset = connection.execute("SELECT COALESCE(MAX(offset + nCalls), 0) FROM segments WHERE partition = ?", (partition,)).fetchone()[0]
+        if not os.path.isdir(os.path.dirname(self.getColumnPath(partition, "start"))):
+            os.makedirs(os.path.dirname(self.getColumnPath(partition, "start")))
+        for field, dtype in COLUMN_TYPES:
+            with open(self.getColumnPath(partition, field), "ab") as columnFile:
+                columnFile.truncate(offset * numpy.dtype(dtype).itemsize)
+                columnFile.write(columns[field].astype(dtype).tostring())
+                columnFile.flush()
+                os.fsync(columnFile.fileno())
+        return offset
+
+    def indexCalls(self, configHash, sampleName, callsPath):
+        """
+        Store the calls of a sample evaluated with a configuration, once per content
+        """
+        chromosomes, callset = readCallset(callsPath)
+        callsHash = hashCallset(chromosomes, callset)
+        # writers of all processes are serialized, readers only follow committed segments:
+        with open(os.path.join(self.indexPath, "Calls", "Write.lock"), "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            connection = self.connect()
+            with connection:
+                isStored = connection.execute("SELECT 1 FROM segments WHERE callsHash = ? LIMIT 1", (callsHash,)).fetchone() is not None
+                for ordinal, chromosome in enumerate(chromosomes if not isStored else []):
+                    columns = dict(callset[chromosome])
+                    filters, filterIndices = numpy.unique(columns["filter"], return_inverse=True)
+                    columns["filter"] = numpy.array([self.getCode(connection, "filters", "code", "filter", value) for value in filters])[filterIndices]
+                    columns["maxEnd"] = numpy.maximum.accumulate(columns["end"])
+                    partition = self.getCode(connection, "partitions", "partition", "chromosome", chromosome)
+                    offset = self.appendSegment(connection, partition, columns)
+                    connection.execute("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       (callsHash, ordinal, partition, offset, len(columns["start"]), int(columns["start"].min()), int(columns["end"].max())))
+                connection.execute("INSERT OR REPLACE INTO callsets VALUES (?, ?, ?, ?)",
+                                   (configHash, sampleName, callsHash, sum(len(callset[chromosome]["start"]) for chromosome in chromosomes)))
+            connection.close()
+        return callsHash
+
+    def recordStep(self, run, iteration, step, configHash):
+        connection = self.connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?)", (run, str(iteration), step, configHash))
+        connection.close()
+
+    def loadCallsets(self, sampleName=None, configHashes=None):
+        """
+        {(configHash, sample): callsHash} of the indexed callsets, optionally of one sample and of some configurations
+        """
+        query = "SELECT configHash, sample, callsHash FROM callsets"
+        arguments = []
+        if sampleName is not None:
+            query += " WHERE sample = ?"
+            arguments.append(sampleName)
+        connection = self.connect()
+        rows = connection.execute(query, arguments).fetchall()
+        connection.close()
+        return dict(((str(configHash), str(sample)), str(callsHash)) for configHash, sample, callsHash in rows
+                    if configHashes is None or configHash in configHashes)
+
+    def loadSteps(self, run=None):
+        """
+        [(run, iteration, step)] evaluating each configuration
+        """
+        query = "SELECT run, iteration, step, configHash FROM steps"
+        arguments = []
+        if run is not None:
+            query += " WHERE run = ?"
+            arguments.append(run)
+        connection = self.connect()
+        rows = connection.execute(query, arguments).fetchall()
+        connection.close()
+        steps = {}
+        for stepRun, iteration, step, configHash in rows:
+            steps.setdefault(str(configHash), []).append((str(stepRun), str(iteration), str(step)))
+        return steps
+
+    def loadSegments(self, chromosome=None, callsHash=None):
+        """
+        (chromosome, partition, offset, nCalls, minStart, maxEnd) of the segments of a chromosome by
+        callsHash, or of a callset by chromosome in vcf order
+        """
+        connection = self.connect()
+        if chromosome is not None:
+            rows = connection.execute("SELECT segments.callsHash, chromosome, segments.partition, offset, nCalls, minStart, maxEnd FROM segments "
+                                      "JOIN partitions ON segments.partition = partitions.partition WHERE chromosome = ?", (chromosome,)).fetchall()
+            connection.close()
+            return dict((str(row[0]), (str(row[1]),) + tuple(row[2:])) for row in rows)
+        rows = connection.execute("SELECT chromosome, segments.partition, offset, nCalls, minStart, maxEnd FROM segments "
+                                  "JOIN partitions ON segments.partition = partitions.partition WHERE callsHash = ? ORDER BY ordinal", (callsHash,)).fetchall()
+        connection.close()
+        return [(str(row[0]),) + tuple(row[1:]) for row in rows]
+
+    def getColumns(self, partition, nRows):
+        """
+        Columns of a partition mapped into memory, mapped again once they have grown past nRows
+        """
+        if partition not in self.columns or len(self.columns[partition]["start"]) < nRows:
+            self.columns[partition] = dict((field, numpy.memmap(self.getColumnPath(partition, field), dtype=dtype, mode="r")) for field, dtype in COLUMN_TYPES)
+        return self.columns[partition]
+
+    def getFilters(self, maxCode):
+        if self.filters is None or maxCode >= len(self.filters):
+            connection = self.connect()
+            rows = connection.execute("SELECT code, filter FROM filters").fetchall()
+            connection.close()
+            self.filters = numpy.array([""] * (max([code for code, value in rows] + [0]) + 1), dtype=object)
+            for code, value in rows:
+                self.filters[code] = str(value)
+        return self.filters
+
+    def loadCalls(self, segment, regionStart=None, regionEnd=None):
+        """
+        Calls of a segment, only those overlapping a region if one is given
+        """
+        chromosome, partition, offset, nCalls = segment[0:4]
+        columns = self.getColumns(partition, offset + nCalls)
+        low, high = 0, nCalls
+        if regionStart is not None:
+            low, high = overlapSlice(columns["start"][offset:offset + nCalls], columns["maxEnd"][offset:offset + nCalls], regionStart, regionEnd)
+        calls = dict((field, numpy.array(columns[field][offset + low:offset + high])) for field in CALL_FIELDS)
+        if regionStart is not None:
+            isOverlap = calls["end"] >= regionStart
+            calls = dict((field, values[isOverlap]) for field, values in calls.iteritems())
+        calls["filter"] = self.getFilters(calls["filter"].max() if len(calls["filter"]) else 0)[calls["filter"]]
+        return calls
+
+    def summary(self):
+        connection = self.connect()
+        nCallsets, nCalls = connection.execute("SELECT COUNT(*), TOTAL(nCalls) FROM callsets").fetchone()
+        nDistinct = connection.execute("SELECT COUNT(DISTINCT callsHash) FROM callsets").fetchone()[0]
+        nConfigs, nSamples = connection.execute("SELECT COUNT(DISTINCT configHash), COUNT(DISTINCT sample) FROM callsets").fetchone()
+        nRuns, nSteps = connection.execute("SELECT COUNT(DISTINCT run), COUNT(*) FROM steps").fetchone()
+        connection.close()
+        return nCallsets, int(nCalls), nDistinct, nConfigs, nSamples, nRuns, nSteps
+
+
+def getCallIndex(params):
+    """
+    Call index configured for this run or None when indexing is disabled
+    """
+    if getattr(params, "callIndex", None) is None:
+        return None
+    return CallIndex(params.callIndex)
+
+
+def indexStepCalls(params, tmpPath, sampleIndices):
+    """
+    Index the calls of the given samples of a parameter step that are not indexed for its configuration yet
+    """
+    index = getCallIndex(params)
+    if index is None:
+        return
+    step = os.path.basename(tmpPath)
+    steps = getResultsStore(params).loadSteps(params.iteration)
+    if (str(params.iteration), step) not in steps:
+        return
+    configHash = steps[(str(params.iteration), step)][3]
+    index.recordStep(os.path.abspath(params.outputPath), params.iteration, step, configHash)
+    indexedSamples = index.getIndexedSamples(configHash)
+    for sampleIndex in sampleIndices:
+        sampleName = params.sampleNames[sampleIndex]
+        callsPath = os.path.join(tmpPath, sampleName, "CNV.vcf.gz")
+        if sampleName not in indexedSamples and os.path.exists(callsPath):
+            index.indexCalls(configHash, sampleName, callsPath)
+
+
+def indexRun(index, outputPath):
+    """
+    Index the calls left in the output tree of a run made without --callIndex
+    """
+    run = os.path.abspath(outputPath)
+    nIndexed = 0
+    for (iteration, step), (parameter, value, parameterConfig, configHash) in sorted(ResultsStore(os.path.join(outputPath, "OptimizationResults.db")).loadSteps().iteritems()):
+        index.recordStep(run, iteration, step, configHash)
+        stepPath = os.path.join(outputPath, "Iteration_" + str(iteration), step)
+        if not os.path.isdir(stepPath):
+            continue
+        indexedSamples = index.getIndexedSamples(configHash)
+        for sampleName in sorted(os.listdir(stepPath)):
+            callsPath = os.path.join(stepPath, sampleName, "CNV.vcf.gz")
+            if sampleName not in indexedSamples and os.path.exists(callsPath):
+                index.indexCalls(configHash, sampleName, callsPath)
+                nIndexed += 1
+    return nIndexed
+
+
+def formatCall(chromosome, calls, i):
+    return "%s:%i-%i CN=%i %s" % (chromosome, calls["start"][i], calls["end"][i], calls["cn"][i], calls["filter"][i])
+
+
+def formatSteps(steps, maxSteps=3):
+    labels = ["%s/Iteration_%s/%s" % (run, iteration, step) for run, iteration, step in sorted(steps)]
+    if len(labels) > maxSteps:
+        labels = labels[0:maxSteps] + ["and %i more" % (len(labels) - maxSteps)]
+    return ", ".join(labels)
+
+
+def findRegionVariants(index, sampleName, region, run=None):
+    """
+    Distinct calls of a sample overlapping a region over all indexed configurations:
+    [(calls, configHashes)], the most common calls first
+    """
+    chromosome, regionStart, regionEnd = parseRegion(region)
+    steps = index.loadSteps(run)
+    callsets = index.loadCallsets(sampleName, set(steps) if run is not None else None)
+    segments = index.loadSegments(chromosome)
+    variants = {}
+    regionCalls = {}
+    for (configHash, sample), callsHash in callsets.iteritems():
+        if callsHash not in regionCalls:
+            segment = segments.get(callsHash)
+            if segment is None or segment[4] > regionEnd or segment[5] < regionStart:
+                regionCalls[callsHash] = ()
+            else:
+                calls = index.loadCalls(segment, regionStart, regionEnd)
+                regionCalls[callsHash] = tuple(formatCall(chromosome, calls, i) for i in range(len(calls["start"])))
+        variants.setdefault(regionCalls[callsHash], []).append(configHash)
+    return sorted(variants.iteritems(), key=lambda variant: (-len(variant[1]), variant[0]))
+
+
+def diffCalls(index, callsHashA, callsHashB):
+    """
+    Calls only in A, only in B and at the same interval with another CN or filter, over all chromosomes
+    """
+    if callsHashA == callsHashB:
+        return sum(segment[3] for segment in index.loadSegments(callsHash=callsHashA)), [], [], []
+    chromosomes = []
+    segmentsA, segmentsB = {}, {}
+    for segments, callsHash in ((segmentsA, callsHashA), (segmentsB, callsHashB)):
+        for segment in index.loadSegments(callsHash=callsHash):
+            segments[segment[0]] = segment
+            if segment[0] not in chromosomes:
+                chromosomes.append(segment[0])
+    noCalls = {"start": [], "end": []}
+    onlyA, onlyB, changed = [], [], []
+    nSame = 0
+    for chromosome in chromosomes:
+        callsA = index.loadCalls(segmentsA[chromosome]) if chromosome in segmentsA else noCalls
+        callsB = index.loadCalls(segmentsB[chromosome]) if chromosome in segmentsB else noCalls
+        intervalsA = dict(((callsA["start"][i], callsA["end"][i]), i) for i in range(len(callsA["start"])))
+        intervalsB = dict(((callsB["start"][i], callsB["end"][i]), i) for i in range(len(callsB["start"])))
+        for interval, i in sorted(intervalsA.iteritems()):
+            if interval not in intervalsB:
+                onlyA.append(formatCall(chromosome, callsA, i))
+            elif (callsA["cn"][i], callsA["filter"][i]) != (callsB["cn"][intervalsB[interval]], callsB["filter"][intervalsB[interval]]):
+                changed.append("%s -> CN=%i %s" % (formatCall(chromosome, callsA, i), callsB["cn"][intervalsB[interval]], callsB["filter"][intervalsB[interval]]))
+            else:
+                nSame += 1
+        onlyB += [formatCall(chromosome, callsB, i) for interval, i in sorted(intervalsB.iteritems()) if interval not in intervalsA]
+    return nSame, onlyA, onlyB, changed
+
+
+def getBestStepConfigHash(outputPath, iteration):
+    """
+    Configuration hash of the best ranked step of an iteration among the steps evaluated on the most samples
+    """
+    store = ResultsStore(os.path.join(outputPath, "OptimizationResults.db"))
+    table = store.loadTable(iteration)
+    if not len(table):
+        sys.exit("No evaluated steps in iteration %s of %s" % (iteration, outputPath))
+    stepIndex = table.rankSteps(table.sampleCounts().max())[0]
+    return store.loadSteps(iteration)[(table.stepIterations[stepIndex], table.stepNames[stepIndex])][3], table.stepNames[stepIndex]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the CNV calls of optimization runs and query them")
+    parser.add_argument("command", choices=["index", "summary", "overlap", "diff"],
+                        help="index: add the calls left in the output tree of a run; summary: report the index; "
+                             "overlap: distinct calls of a sample in a region over all configurations; diff: compare the calls of two configurations")
+    parser.add_argument("callIndex", help="Call index directory (--callIndex of optimizeSomaticCanvasModel.py)")
+    parser.add_argument("--run", dest="run", default=None, help="Output directory of an optimization run: the run to index, restricts overlap to its configurations and resolves --iterations")
+    parser.add_argument("--sample", dest="sample", default=None, help="Sample name")
+    parser.add_argument("--region", dest="region", default=None, help="Region of overlap, e.g. chr8:120000000-130000000")
+    parser.add_argument("--iterations", dest="iterations", nargs=2, default=None, help="diff the best ranked steps of two iterations of --run")
+    parser.add_argument("--configs", dest="configs", nargs=2, default=None, help="diff two configuration hashes")
+    parser.add_argument("--calls", dest="calls", action="store_true", default=False, help="List the differing calls")
+    options = parser.parse_args()
+    if options.command != "index" and not os.path.exists(os.path.join(options.callIndex, INDEX_FILE)):
+        sys.exit("No call index in %s" % options.callIndex)
+    index = CallIndex(options.callIndex)
+    run = os.path.abspath(options.run) if options.run is not None else None
+    if options.command == "index":
+        if run is None or not os.path.exists(os.path.join(run, "OptimizationResults.db")):
+            sys.exit("index needs the --run output directory of an optimization run")
+        print "Indexed %i callsets of %s" % (indexRun(index, run), run)
+    elif options.command == "summary":
+        nCallsets, nCalls, nDistinct, nConfigs, nSamples, nRuns, nSteps = index.summary()
+        print "%i callsets of %i samples and %i configurations, %i calls stored as %i distinct callsets; %i parameter steps of %i runs" % (
+            nCallsets, nSamples, nConfigs, nCalls, nDistinct, nSteps, nRuns)
+    elif options.command == "overlap":
+        if options.sample is None or options.region is None:
+            sys.exit("overlap needs --sample and --region")
+        steps = index.loadSteps(run)
+        for variantIndex, (calls, configHashes) in enumerate(findRegionVariants(index, options.sample, options.region, run)):
+            print "Variant %i: %i calls, %i configurations" % (variantIndex + 1, len(calls), len(configHashes))
+            for call in calls:
+                print "\t" + call
+            for configHash in sorted(configHashes):
+                print "\t%s\t%s" % (configHash, formatSteps(steps.get(configHash, [])))
+    else:
+        if options.iterations is not None:
+            if run is None:
+                sys.exit("diff --iterations needs --run")
+            configHashA, stepA = getBestStepConfigHash(run, options.iterations[0])
+            configHashB, stepB = getBestStepConfigHash(run, options.iterations[1])
+            print "Iteration %s: %s (%s)\nIteration %s: %s (%s)" % (options.iterations[0], stepA, configHashA, options.iterations[1], stepB, configHashB)
+        elif options.configs is not None:
+            configHashA, configHashB = options.configs
+        else:
+            sys.exit("diff needs --iterations or --configs")
+        callsetsA = index.loadCallsets(options.sample, set([configHashA]))
+        callsetsB = index.loadCallsets(options.sample, set([configHashB]))
+        print "Sample\tSame\tOnlyA\tOnlyB\tChanged"
+        for sampleName in sorted(set(sample for configHash, sample in callsetsA) & set(sample for configHash, sample in callsetsB)):
+            nSame, onlyA, onlyB, changed = diffCalls(index, callsetsA[(configHashA, sampleName)], callsetsB[(configHashB, sampleName)])
+            print "%s\t%i\t%i\t%i\t%i" % (sampleName, nSame, len(onlyA), len(onlyB), len(changed))
+            if options.calls:
+                for label, calls in (("-", onlyA), ("+", onlyB), ("~", changed)):
+                    for call in calls:
+                        print "\t%s %s" % (label, call)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Cross-validation of the somatic model optimization.
+
+The training samples are split into k folds (or a single holdout fold). Every fold follows its
+own optimization trajectory, selecting parameters on its training samples only, and the
+configuration it carries into an iteration is scored on its held-out samples as well, as is the
+configuration it selects in the last iteration (report lines "Final"). A last trajectory, All, is
+trained on every sample and produces the model of the run. Candidate configurations are evaluated
+once per sample and shared by all folds proposing them.
+"""
+import os
+import sys
+import json
+import argparse
+import numpy
+from SomaticCanvasResultsStore import ResultsStore
+
+ALL_SAMPLES_FOLD = "All"
+REPORT_HEADER = ["Iteration", "Fold", "Step", "TrainSamples", "TestSamples", "TrainScore", "TestScore", "TrainDirectionAccuracy", "TestDirectionAccuracy"]
+
+
+def getCrossValidationFolds(params):
+    """
+    (fold name, train sample indexes, test sample indexes) of every trajectory, empty without cross-validation
+    """
+    mode = getattr(params, "crossValidationMode", "none")
+    if mode == "none":
+        return []
+    order = [int(sampleIndex) for sampleIndex in numpy.random.RandomState(params.crossValidationSeed).permutation(params.sampleSize)]
+    folds = []
+    if mode == "holdout":
+        nTest = min(max(1, int(round(params.sampleSize * params.crossValidation))), params.sampleSize - 1)
+        folds.append(("Fold_0", sorted(order[nTest:]), sorted(order[0:nTest])))
+    else:
+        nFolds = min(params.crossValidationFolds, params.sampleSize)
+        for fold in range(nFolds):
+            test = sorted(order[fold::nFolds])
+            folds.append(("Fold_" + str(fold), sorted(set(order) - set(test)), test))
+    folds.append((ALL_SAMPLES_FOLD, range(params.sampleSize), []))
+    return folds
+
+
+def getFoldConfigPath(params, iteration, foldName):
+    """
+    Configuration selected by a fold trajectory at the end of an iteration, the initial one before the first iteration
+    """
+    if iteration < 0:
+        return os.path.join(params.configPath, "SomaticCallerParameters.json")
+    iterationPath = os.path.join(params.outputPath, "Iteration_" + str(iteration))
+    if foldName == ALL_SAMPLES_FOLD:
+        return os.path.join(iterationPath, "SomaticCallerParameters.json")
+    return os.path.join(iterationPath, foldName, "SomaticCallerParameters.json")
+
+
+def getFoldsPath(outputPath, iteration):
+    return os.path.join(outputPath, "Iteration_" + str(iteration), "CrossValidationFolds.json")
+
+
+def writeCrossValidationFolds(params, folds):
+    """
+    Record the samples and parameter steps of every fold trajectory of the current iteration
+    """
+    foldsPath = getFoldsPath(params.outputPath, params.iteration)
+    with open(foldsPath + ".tmp", "w") as foldsFile:
+        json.dump(folds, foldsFile, indent=4)
+    os.rename(foldsPath + ".tmp", foldsPath)
+
+
+def readCrossValidationFolds(outputPath, iteration):
+    with open(getFoldsPath(outputPath, iteration)) as foldsFile:
+        return json.load(foldsFile)
+
+
+def summarizeStep(table, step, sampleNames):
+    """
+    (score, mean DirectionAccuracy) of a parameter step over some samples, NaN without evaluated samples
+    """
+    subset = table.select((table.steps == step) & numpy.in1d(table.samples, sampleNames))
+    if len(subset.samples) == 0:
+        return float("nan"), float("nan")
+    return subset.stepScores()[0], numpy.mean(subset.column("DirectionAccuracy"))
+
+
+def foldReportLines(table, iteration, folds, stepKey="base"):
+    """
+    Train and test metrics of the configuration every fold carried into an iteration (or selected
+    in it, with stepKey "final"), and their mean over the folds
+    """
+    lines = []
+    foldMetrics = []
+    for fold in folds:
+        trainMetrics = summarizeStep(table, fold[stepKey], fold["train"])
+        testMetrics = summarizeStep(table, fold[stepKey], fold["test"])
+        lines.append([iteration, fold["name"], fold[stepKey], len(fold["train"]), len(fold["test"]), trainMetrics[0], testMetrics[0], trainMetrics[1], testMetrics[1]])
+        if fold["test"]:
+            foldMetrics.append((trainMetrics[0], testMetrics[0], trainMetrics[1], testMetrics[1]))
+    if foldMetrics:
+        means = numpy.nanmean(numpy.array(foldMetrics), axis=0)
+        lines.append([iteration, "Mean", "", "", ""] + list(means))
+    return lines
+
+
+def formatReportLine(line):
+    return "\t".join(("%.4f" % value) if isinstance(value, float) else str(value) for value in line)
+
+
+def writeReport(outFilePath, lines):
+    with open(outFilePath + ".tmp", "w") as outFile:
+        outFile.write("\t".join(REPORT_HEADER) + "\n")
+        for line in lines:
+            outFile.write(formatReportLine(line) + "\n")
+    os.rename(outFilePath + ".tmp", outFilePath)
+
+
+def readReport(inFilePath):
+    with open(inFilePath) as inFile:
+        return [line.rstrip("\n").split("\t") for line in inFile][1:]
+
+
+def iterationReportLines(table, iteration, folds):
+    """
+    Fold report of an iteration, followed by the metrics of the final selections after the last iteration
+    """
+    lines = foldReportLines(table, iteration, folds)
+    if all("final" in fold for fold in folds):
+        lines += foldReportLines(table, "Final", folds, "final")
+    return lines
+
+
+def writeCrossValidationReport(params, table, folds):
+    """
+    Write the fold report of the current iteration and rebuild the report of the run from all iterations so far
+    """
+    iterationPath = os.path.join(params.outputPath, "Iteration_" + str(params.iteration))
+    writeReport(os.path.join(iterationPath, "CrossValidation.txt"), iterationReportLines(table, params.iteration, folds))
+    lines = []
+    for iteration in range(params.iteration + 1):
+        reportPath = os.path.join(params.outputPath, "Iteration_" + str(iteration), "CrossValidation.txt")
+        if os.path.exists(reportPath):
+            lines += readReport(reportPath)
+    writeReport(os.path.join(params.outputPath, "CrossValidation.txt"), lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the cross-validation report of an optimization iteration")
+    parser.add_argument("outputPath", help="Output directory of the optimization run")
+    parser.add_argument("iteration", help="Iteration to report")
+    options = parser.parse_args()
+    if not os.path.exists(getFoldsPath(options.outputPath, options.iteration)):
+        sys.exit("No cross-validation folds in iteration %s of %s" % (options.iteration, options.outputPath))
+    folds = readCrossValidationFolds(options.outputPath, options.iteration)
+    table = ResultsStore(os.path.join(options.outputPath, "OptimizationResults.db")).loadTable(options.iteration)
+    for line in iterationReportLines(table, options.iteration, folds):
+        print formatReportLine(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+"""
+In-process port of the base-level metrics of EvaluateCNV (CNVEvaluator / MetricsCalculator).
+
+Truth and excluded intervals of a sample are loaded once into a SampleEvaluationIndex, which then
+scores any number of CNV.vcf.gz files with sorted-interval numpy sweeps and writes the same
+Results.txt sections as EvaluateCNV run with its default options (no ROI, kmer, ploidy or DQ options).
+"""
+import os
+import sys
+import gzip
+import numpy
+import threading
+
+from SomaticCanvasResultsStore import EVALUATE_CNV_METRICS, parseEvaluateCNVResults
+
+MAX_CN = 5
+MAX_PLOIDY = 2
+MIN_ENTRY_SIZE = 10000
+
+_sampleIndexes = {}
+_sampleIndexesLock = threading.Lock()
+
+
+def openMaybeGzip(path):
+    with open(path, "rb") as inFile:
+        isGzip = inFile.read(2) == "\x1f\x8b"
+    return gzip.open(path, "rb") if isGzip else open(path, "rb")
+
+
+def loadIntervalsFromBed(bedPath, getCn):
+    """
+    Intervals of a bed file per chromosome as (starts, ends, cns) arrays in file order
+    """
+    intervals = {}
+    with open(bedPath, "rb") as inFile:
+        for fileLine in inFile:
+            fileLine = fileLine.rstrip("\r\n")
+            if len(fileLine) == 0 or fileLine[0] == "#":
+                continue
+            bits = fileLine.rstrip("\t").split("\t")
+            if len(bits) < 3:
+                continue
+            cn = int(bits[3]) + int(bits[4]) if getCn else 0
+            intervals.setdefault(bits[0], []).append((int(bits[1]), int(bits[2]), cn))
+    return toIntervalArrays(intervals)
+
+
+def parseTruthVcfLine(fileLine):
+    bits = fileLine.rstrip("\r\n").split("\t")
+    start = int(bits[1])
+    end = 0
+    cn = -1
+    for subBit in bits[7].split(";"):
+        if subBit.startswith("CN="):
+            value = float(subBit[3:])
+            # EvaluateCNV rounds X.5 up to X+1, other values to the nearest even integer:
+            cn = int(numpy.round(value + 0.1 if subBit.endswith(".5") else value))
+        if subBit.startswith("END="):
+            end = int(subBit[4:])
+    if len(bits) > 8:
+        formatKeys = bits[8].split(":")
+        sampleValues = bits[9].split(":")
+        if "CN" in formatKeys:
+            cn = int(sampleValues[formatKeys.index("CN")])
+    if end == 0 or cn < 0:
+        raise ValueError("Invalid truth record, END cannot be 0 and CN must be >= 0: %s" % fileLine)
+    return bits[0], start, end, cn
+
+
+def loadKnownCn(truthSetPath):
+    if truthSetPath.endswith(".bed"):
+        return loadIntervalsFromBed(truthSetPath, True)
+    intervals = {}
+    with openMaybeGzip(truthSetPath) as inFile:
+        for fileLine in inFile:
+            if len(fileLine.strip()) == 0 or fileLine[0] == "#":
+                continue
+            chromosome, start, end, cn = parseTruthVcfLine(fileLine)
+            intervals.setdefault(chromosome, []).append((start, end, cn))
+    return toIntervalArrays(intervals)
+
+
+def toIntervalArrays(intervals):
+    arrays = {}
+    for chromosome, rows in intervals.iteritems():
+        columns = numpy.array(rows, dtype=numpy.int64).reshape(len(rows), 3)
+        arrays[chromosome] = (columns[:, 0], columns[:, 1], columns[:, 2])
+    return arrays
+
+
+class CnvCalls:
+    """
+    Copy number calls of a CNV.vcf(.gz) as per-chromosome arrays
+    """
+
+    def __init__(self, cnvCallsPath, minEntrySize=MIN_ENTRY_SIZE):
+        self.path = cnvCallsPath
+        self.headerLines = []
+        # chromosome order of the vcf, including chromosomes without usable calls:
+        self.chromosomes = []
+        rows = {}
+        with openMaybeGzip(cnvCallsPath) as inFile:
+            for fileLine in inFile:
+                if fileLine.startswith("#"):
+                    self.headerLines.append(fileLine.rstrip("\r\n"))
+                    continue
+                bits = fileLine.rstrip("\r\n").split("\t")
+                if len(bits) < 8:
+                    continue
+                if bits[0] not in rows:
+                    self.chromosomes.append(bits[0])
+                    rows[bits[0]] = []
+                call = self.parseCall(bits)
+                if call is not None and call[1] - call[0] >= minEntrySize:
+                    rows[bits[0]].append(call)
+        self.calls = {}
+        for chromosome in self.chromosomes:
+            columns = numpy.array(rows[chromosome], dtype=numpy.int64).reshape(len(rows[chromosome]), 5)
+            # columns: start, end, cn, reference ploidy (-1 if unknown), PASS filter
+            self.calls[chromosome] = columns
+
+    def parseCall(self, bits):
+        info = dict((field.split("=", 1) + [""])[0:2] for field in bits[7].split(";"))
+        if "END" not in info:
+            return None
+        sample = {}
+        if len(bits) > 9:
+            sample = dict(zip(bits[8].split(":"), bits[-1].split(":")))
+        if "CN" in sample:
+            cn = int(sample["CN"])
+        elif "CN" in info:
+            cn = int(info["CN"])
+        else:
+            return None
+        refPloidy = -1
+        if sample.get("GT", ".") != ".":
+            refPloidy = len(sample["GT"].replace("|", "/").split("/"))
+        return (int(bits[1]), int(info["END"]), cn, refPloidy, int(bits[6] == "PASS"))
+
+    def headerValue(self, key):
+        for headerLine in self.headerLines:
+            if key in headerLine:
+                return float(headerLine.split("=")[1])
+        return None
+
+
+def raggedRanges(lows, highs):
+    """
+    Group index and position of every element of the ranges [lows[i], highs[i])
+    """
+    counts = numpy.maximum(highs - lows, 0)
+    groups = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return groups, lows[groups] + offsets
+
+
+def overlapPairs(truthStarts, truthEnds, callStarts, callEnds):
+    """
+    (truth index, call index) of all overlapping truth intervals and calls, by a sweep over calls sorted by start
+    """
+    order = numpy.argsort(callStarts, kind="mergesort")
+    sortedStarts = callStarts[order]
+    maxEnds = numpy.maximum.accumulate(callEnds[order]) if len(order) else callEnds[order]
+    lows = numpy.searchsorted(maxEnds, truthStarts, side="right")
+    highs = numpy.searchsorted(sortedStarts, truthEnds, side="left")
+    truthIndex, sortedIndex = raggedRanges(lows, highs)
+    callIndex = order[sortedIndex]
+    overlaps = numpy.minimum(callEnds[callIndex], truthEnds[truthIndex]) - numpy.maximum(callStarts[callIndex], truthStarts[truthIndex])
+    isOverlap = overlaps > 0
+    return truthIndex[isOverlap], callIndex[isOverlap]
+
+
+class ExcludeIntervals:
+    """
+    Excluded intervals of one chromosome, in bed file order
+    """
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+        self.isSortedDisjoint = bool(numpy.all(starts[1:] >= ends[:-1]))
+
+    def exclude(self, overlapStarts, overlapEnds):
+        """
+        Bases excluded from each call/truth overlap, following the sequential rule of EvaluateCNV:
+        once the remaining overlap is smaller than the latest excluded overlap, the whole overlap is excluded
+        """
+        lengths = overlapEnds - overlapStarts
+        if not self.isSortedDisjoint:
+            return numpy.array([self.excludeSequential(start, end) for start, end in zip(overlapStarts, overlapEnds)], dtype=numpy.int64).reshape(len(lengths))
+        lows = numpy.searchsorted(self.ends, overlapStarts, side="right")
+        highs = numpy.searchsorted(self.starts, overlapEnds, side="left")
+        pairIndex, excludeIndex = raggedRanges(lows, highs)
+        excludedBases = numpy.minimum(self.ends[excludeIndex], overlapEnds[pairIndex]) - numpy.maximum(self.starts[excludeIndex], overlapStarts[pairIndex])
+        cumulative = numpy.cumsum(excludedBases)
+        groupOffsets = numpy.cumsum(numpy.bincount(pairIndex, minlength=len(lengths))) - numpy.bincount(pairIndex, minlength=len(lengths))
+        cumulative = cumulative - numpy.concatenate(([0], cumulative))[groupOffsets[pairIndex]]
+        isBroken = numpy.zeros(len(lengths), dtype=bool)
+        isBroken[pairIndex[lengths[pairIndex] - cumulative < excludedBases]] = True
+        excluded = numpy.bincount(pairIndex, weights=excludedBases, minlength=len(lengths)).astype(numpy.int64)
+        return numpy.where(isBroken, lengths, excluded)
+
+    def excludeSequential(self, overlapStart, overlapEnd):
+        overlapBases = overlapEnd - overlapStart
+        excluded = 0
+        for excludeStart, excludeEnd in zip(self.starts, self.ends):
+            excludeOverlap = min(excludeEnd, overlapEnd) - max(excludeStart, overlapStart)
+            if excludeOverlap <= 0:
+                continue
+            excluded += excludeOverlap
+            overlapBases -= excludeOverlap
+            if overlapBases < excludeOverlap:
+                return overlapEnd - overlapStart
+        return excluded
+
+
+def resolveChromosome(chromosome, keys):
+    """
+    Chromosome name as used in keys, adding or removing a chr prefix as EvaluateCNV does
+    """
+    if chromosome not in keys:
+        chromosome = chromosome.replace("chr", "")
+    if chromosome not in keys:
+        chromosome = "chr" + chromosome
+    return chromosome
+
+
+def formatMetric(value):
+    if numpy.isnan(value):
+        return "NaN"
+    if numpy.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return "%.4f" % value
+
+
+def calculateMetrics(baseCount, noCalls):
+    """
+    MetricsCalculator: percentages from base counts indexed [known CN, called CN, reference ploidy]
+    """
+    trueCn, callCn, ploidy = numpy.indices(baseCount.shape)
+    noCallCn, noCallPloidy = numpy.indices(noCalls.shape)
+    isLoss = trueCn < ploidy
+    isGain = trueCn > ploidy
+    isRight = trueCn == callCn
+    isRightDirection = (isLoss & (callCn < ploidy)) | ((trueCn == ploidy) & (callCn == ploidy)) | (isGain & (callCn > ploidy))
+    totalBases = float(baseCount.sum() + noCalls.sum())
+    isGainBases = float(baseCount[isGain].sum() + noCalls[noCallCn > noCallPloidy].sum())
+    isLossBases = float(baseCount[isLoss].sum() + noCalls[noCallCn < noCallPloidy].sum())
+    callGainBases = float(baseCount[callCn > ploidy].sum())
+    callLossBases = float(baseCount[callCn < ploidy].sum())
+    isGainBasesCorrect = baseCount[isRight & isGain].sum()
+    isLossBasesCorrect = baseCount[isRight & isLoss].sum()
+    isGainBasesCorrectDirection = baseCount[isGain & (callCn > ploidy)].sum()
+    isLossBasesCorrectDirection = baseCount[isLoss & (callCn < ploidy)].sum()
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        fractionalPrecision = numpy.float64(isGainBasesCorrect + isLossBasesCorrect) / (callGainBases + callLossBases)
+        fractionalRecall = numpy.float64(isGainBasesCorrect + isLossBasesCorrect) / (isGainBases + isLossBases)
+        metrics = {
+            "Accuracy": 100 * numpy.float64(baseCount[isRight].sum()) / totalBases,
+            "DirectionAccuracy": 100 * numpy.float64(baseCount[isRightDirection].sum()) / totalBases,
+            "F-score": 2 * fractionalPrecision * fractionalRecall / (fractionalPrecision + fractionalRecall),
+            "Recall": 100 * fractionalRecall,
+            "DirectionRecall": 100 * numpy.float64(isGainBasesCorrectDirection + isLossBasesCorrectDirection) / (isGainBases + isLossBases),
+            "Precision": 100 * fractionalPrecision,
+            "DirectionPrecision": 100 * numpy.float64(isGainBasesCorrectDirection + isLossBasesCorrectDirection) / (callGainBases + callLossBases),
+            "GainRecall": 100 * numpy.float64(isGainBasesCorrect) / isGainBases,
+            "GainDirectionRecall": 100 * numpy.float64(isGainBasesCorrectDirection) / isGainBases,
+            "GainPrecision": 100 * numpy.float64(isGainBasesCorrect) / callGainBases,
+            "GainDirectionPrecision": 100 * numpy.float64(isGainBasesCorrectDirection) / callGainBases,
+            "LossRecall": 100 * numpy.float64(isLossBasesCorrect) / isLossBases,
+            "LossPrecision": 100 * numpy.float64(isLossBasesCorrect) / callLossBases,
+            "LossDirectionPrecision": 100 * numpy.float64(isLossBasesCorrectDirection) / callLossBases,
+        }
+    # EvaluateCNV reports LossRecall under this name:
+    metrics["LossDirectionRecall"] = metrics["LossRecall"]
+    return metrics
+
+
+class SampleEvaluationIndex:
+    """
+    Truth set and excluded regions of a sample, loaded once and reused for every CNV.vcf.gz evaluated against them
+    """
+
+    def __init__(self, truthSetPath, excludedBedPath, minEntrySize=MIN_ENTRY_SIZE):
+        self.truthSetPath = truthSetPath
+        self.minEntrySize = minEntrySize
+        self.knownCn = {}
+        for chromosome, (starts, ends, cns) in loadKnownCn(truthSetPath).iteritems():
+            isKept = ends - starts >= minEntrySize
+            self.knownCn[chromosome] = (starts[isKept], ends[isKept], cns[isKept])
+        self.excludeIntervals = {}
+        if excludedBedPath:
+            for chromosome, (starts, ends, cns) in sorted(loadIntervalsFromBed(excludedBedPath, False).iteritems()):
+                self.excludeIntervals[chromosome] = ExcludeIntervals(starts, ends)
+
+    def getExcludeIntervals(self, calls):
+        """
+        Excluded intervals keyed on the chromosome names of the calls
+        """
+        excludeIntervals = {}
+        for chromosome, intervals in self.excludeIntervals.iteritems():
+            callChromosome = resolveChromosome(chromosome, calls.calls)
+            if callChromosome in calls.calls:
+                excludeIntervals[callChromosome] = intervals
+        return excludeIntervals
+
+    def countBases(self, calls, excludeIntervals, includePassingOnly, referenceCopyNumbers):
+        """
+        Base counts of one EvaluateCNV section; referenceCopyNumbers of the truth intervals are
+        estimated from the overlapping calls when missing, as in the first section of EvaluateCNV
+        """
+        baseCount = numpy.zeros((MAX_CN + 1, MAX_CN + 1, MAX_PLOIDY + 1), dtype=numpy.int64)
+        noCalls = numpy.zeros((MAX_CN + 1, MAX_PLOIDY + 1), dtype=numpy.int64)
+        eventAccuracies = []
+        for chromosome in sorted(self.knownCn):
+            truthStarts, truthEnds, truthCns = self.knownCn[chromosome]
+            if len(truthStarts) == 0:
+                continue
+            callChromosome = resolveChromosome(chromosome, calls.calls)
+            callColumns = calls.calls.get(callChromosome, numpy.zeros((0, 5), dtype=numpy.int64))
+            callStarts, callEnds, callCns, callPloidies, callPass = callColumns.T
+            if numpy.any(callPloidies < 0):
+                raise ValueError("Could not determine reference ploidy for calls on %s in %s" % (callChromosome, calls.path))
+            truthIndex, callIndex = overlapPairs(truthStarts, truthEnds, callStarts, callEnds)
+            overlapStarts = numpy.maximum(callStarts[callIndex], truthStarts[truthIndex])
+            overlapEnds = numpy.minimum(callEnds[callIndex], truthEnds[truthIndex])
+            excluded = numpy.zeros(len(truthIndex), dtype=numpy.int64)
+            if callChromosome in excludeIntervals:
+                excluded = excludeIntervals[callChromosome].exclude(overlapStarts, overlapEnds)
+            overlapBases = overlapEnds - overlapStarts - excluded
+            knownCns = numpy.minimum(truthCns, MAX_CN)
+            pairKnownCns = knownCns[truthIndex]
+            pairCallCns = numpy.minimum(callCns[callIndex], MAX_CN)
+            nTruth = len(truthStarts)
+            if chromosome not in referenceCopyNumbers:
+                weights = numpy.maximum(overlapBases, 1).astype(float)
+                weightSums = numpy.bincount(truthIndex, weights=weights, minlength=nTruth)
+                if numpy.any(weightSums == 0):
+                    raise ValueError("Truth variant on %s with no overlapping calls in %s, reference ploidy cannot be determined" % (chromosome, calls.path))
+                pairPloidies = callPloidies[callIndex]
+                referenceCopyNumbers[chromosome] = numpy.round(numpy.bincount(truthIndex, weights=weights * pairPloidies, minlength=nTruth) / weightSums).astype(numpy.int64)
+            else:
+                pairPloidies = referenceCopyNumbers[chromosome][truthIndex]
+            if numpy.any(pairPloidies > MAX_PLOIDY) or numpy.any(referenceCopyNumbers[chromosome] > MAX_PLOIDY):
+                raise ValueError("Reference ploidy above %i on %s is not supported" % (MAX_PLOIDY, chromosome))
+            isCounted = (callPass[callIndex] == 1) | (not includePassingOnly)
+            numpy.add.at(baseCount, (pairKnownCns[isCounted], pairCallCns[isCounted], pairPloidies[isCounted]), overlapBases[isCounted])
+            totalOverlapBases = numpy.bincount(truthIndex[isCounted], weights=overlapBases[isCounted], minlength=nTruth).astype(numpy.int64)
+            excludedBases = numpy.bincount(truthIndex, weights=excluded, minlength=nTruth).astype(numpy.int64)
+            nonOverlapBases = truthEnds - truthStarts - totalOverlapBases - excludedBases
+            if numpy.any(nonOverlapBases < 0):
+                raise ValueError("Truth variant on %s has negative non-overlap bases in %s" % (chromosome, calls.path))
+            numpy.add.at(noCalls, (knownCns, referenceCopyNumbers[chromosome]), nonOverlapBases)
+            # event level accuracy of variant truth intervals, over all overlapping calls:
+            isCorrect = pairKnownCns == pairCallCns
+            basesCalledCorrectly = numpy.bincount(truthIndex[isCorrect], weights=overlapBases[isCorrect], minlength=nTruth)
+            isVariant = truthCns != referenceCopyNumbers[chromosome]
+            eventAccuracies.append(basesCalledCorrectly[isVariant] / (truthEnds - truthStarts)[isVariant])
+        return baseCount, noCalls, numpy.sort(numpy.concatenate(eventAccuracies)) if eventAccuracies else numpy.zeros(0)
+
+    def evaluate(self, cnvCallsPath):
+        """
+        EvaluateCNV metrics of a CNV.vcf.gz as a list of (section title, metrics), PASSing variants first
+        """
+        calls = CnvCalls(cnvCallsPath, self.minEntrySize)
+        excludeIntervals = self.getExcludeIntervals(calls)
+        allCalls = numpy.concatenate([calls.calls[chromosome] for chromosome in calls.chromosomes] + [numpy.zeros((0, 5), dtype=numpy.int64)])
+        isAltVariant = allCalls[:, 2] != allCalls[:, 3]
+        includePassingOnly = "vcf" in os.path.basename(cnvCallsPath).lower()
+        sections = [(True, "Results for PASSing variants"), (False, "Results for all variants")] if includePassingOnly else [(False, "Results for all variants")]
+        referenceCopyNumbers = {}
+        results = []
+        for isPassingOnly, title in sections:
+            baseCount, noCalls, eventAccuracies = self.countBases(calls, excludeIntervals, isPassingOnly, referenceCopyNumbers)
+            metrics = calculateMetrics(baseCount, noCalls)
+            metrics["MeanEventAccuracy"] = 100 * eventAccuracies.sum() / max(1, len(eventAccuracies))
+            metrics["MedianEventAccuracy"] = 100 * eventAccuracies[len(eventAccuracies) // 2] if len(eventAccuracies) else numpy.nan
+            isCalled = isAltVariant & ((allCalls[:, 4] == 1) | (not isPassingOnly))
+            metrics["VariantEventsCalled"] = int(isCalled.sum())
+            metrics["VariantBasesCalled"] = int((allCalls[isCalled, 1] - allCalls[isCalled, 0]).sum())
+            results.append((title, metrics))
+        return calls, results
+
+    def writeResults(self, cnvCallsPath, outFilePath):
+        calls, results = self.evaluate(cnvCallsPath)
+        with open(outFilePath + ".tmp", "w") as outFile:
+            for title, metrics in results:
+                for headerKey, name in [("EstimatedTumorPurity", "Purity"), ("OverallPloidy", "Ploidy")]:
+                    value = calls.headerValue(headerKey)
+                    if value is not None:
+                        outFile.write("%s\t%s\n" % (name, value))
+                outFile.write(title + "\n")
+                for metric in EVALUATE_CNV_METRICS:
+                    if metric not in metrics:
+                        continue
+                    if metric in ("VariantEventsCalled", "VariantBasesCalled"):
+                        outFile.write("%s\t%i\n" % (metric, metrics[metric]))
+                    else:
+                        outFile.write("%s\t%s\n" % (metric, formatMetric(metrics[metric])))
+                outFile.write("\n")
+        os.rename(outFilePath + ".tmp", outFilePath)
+        return results
+
+
+def getSampleEvaluationIndex(truthSetPath, excludedBedPath):
+    """
+    Evaluation index of a sample shared by all evaluations of this process, reloaded when its inputs change
+    """
+    key = tuple((path, os.path.getmtime(path)) for path in (truthSetPath, excludedBedPath) if path)
+    with _sampleIndexesLock:
+        if key not in _sampleIndexes:
+            _sampleIndexes[key] = SampleEvaluationIndex(truthSetPath, excludedBedPath)
+        return _sampleIndexes[key]
+
+
+def compareResults(results, evaluateCNVResultsPath, tolerance=1e-4):
+    """
+    Metrics of the last section that differ from an EvaluateCNV results file, as (metric, ours, theirs)
+    """
+    expected = parseEvaluateCNVResults(evaluateCNVResultsPath)
+    title, metrics = results[-1]
+    differences = []
+    for metric in EVALUATE_CNV_METRICS:
+        if metric not in expected or metric not in metrics:
+            continue
+        ours = float(formatMetric(metrics[metric])) if metric not in ("VariantEventsCalled", "VariantBasesCalled") else metrics[metric]
+        theirs = expected[metric]
+        if theirs is None or numpy.isnan(ours) or numpy.isnan(theirs):
+            if not (numpy.isnan(ours) and (theirs is None or numpy.isnan(theirs))):
+                differences.append((metric, ours, theirs))
+        elif abs(ours - theirs) > tolerance:
+            differences.append((metric, ours, theirs))
+    return differences
+
+
+def main():
+    usage = "Usage:\n  SomaticCanvasEvaluator.py evaluate TruthSet ExcludedBed CNV.vcf.gz Results.txt [CNV.vcf.gz Results.txt ...]\n" \
+            "  SomaticCanvasEvaluator.py compare TruthSet ExcludedBed CNV.vcf.gz EvaluateCNVResults.txt [CNV.vcf.gz EvaluateCNVResults.txt ...]"
+    if len(sys.argv) < 6 or sys.argv[1] not in ("evaluate", "compare") or len(sys.argv) % 2 != 0:
+        print usage
+        sys.exit(2)
+    index = SampleEvaluationIndex(sys.argv[2], sys.argv[3])
+    nDifferences = 0
+    for cnvCallsPath, resultsPath in zip(sys.argv[4::2], sys.argv[5::2]):
+        if sys.argv[1] == "evaluate":
+            index.writeResults(cnvCallsPath, resultsPath)
+            continue
+        calls, results = index.evaluate(cnvCallsPath)
+        for metric, ours, theirs in compareResults(results, resultsPath):
+            print "%s\t%s\t%s\t%s" % (cnvCallsPath, metric, ours, theirs)
+            nDifferences += 1
+    if nDifferences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
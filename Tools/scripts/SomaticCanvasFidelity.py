@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Multi-fidelity evaluation on a chromosome subset of the training samples (--fidelityChromosomes).
+
+The Tumor.partitioned, VFResultsTumor.txt.gz, truth set and exclude regions of every sample are
+restricted once to the chosen chromosomes and cached in --fidelityDir, in a directory per sample
+named after the chromosomes and the content of the full inputs, so that later runs reuse them and
+a changed input is reduced again. In a low-fidelity iteration all candidates are first evaluated
+on these inputs, in the LowFidelity/ subdirectory of the run with a results store and journal of
+its own, and only the best of them are evaluated on the full inputs. The
+agreement of both rankings over the candidates evaluated at both fidelities is written to
+FidelityAgreement.txt after every iteration, to tune the chromosome subset.
+"""
+import os
+import sys
+import copy
+import gzip
+import json
+import numpy
+import shutil
+import hashlib
+import argparse
+import tempfile
+from SomaticCanvasEvaluator import openMaybeGzip
+from SomaticCanvasResultCache import describeInput
+from SomaticCanvasResultsStore import ResultsStore, getResultsStore
+
+LOW_FIDELITY_DIR = "LowFidelity"
+AGREEMENT_FILE = "FidelityAgreement.txt"
+# warm workers of the reduced inputs are keyed apart from the workers of the full inputs:
+WORKER_KEY_PREFIX = "LowFidelity:"
+
+
+def normalizeChromosome(chromosome):
+    """
+    chr8 and 8 name the same chromosome
+    """
+    if chromosome.lower().startswith("chr"):
+        return chromosome[3:]
+    return chromosome
+
+
+def parseChromosomes(chromosomes):
+    return sorted(set(normalizeChromosome(chromosome.strip()) for chromosome in chromosomes.split(",") if chromosome.strip()))
+
+
+def isGzip(path):
+    with open(path, "rb") as inFile:
+        return inFile.read(2) == "\x1f\x8b"
+
+
+def subsetFile(source, target, chromosomes):
+    """
+    Copy the header lines and the records on chromosomes of a tab-separated file, compressed as the
+    source is; returns the number of records kept and read
+    """
+    nKept = 0
+    nRecords = 0
+    with (gzip.open(target, "wb") if isGzip(source) else open(target, "wb")) as outFile:
+        with openMaybeGzip(source) as inFile:
+            for fileLine in inFile:
+                if fileLine.startswith("#") or fileLine.startswith("track") or fileLine.startswith("browser"):
+                    outFile.write(fileLine)
+                    continue
+                fields = fileLine.split(None, 1)
+                if not fields:
+                    continue
+                nRecords += 1
+                if normalizeChromosome(fields[0]) in chromosomes:
+                    outFile.write(fileLine)
+                    nKept += 1
+    return nKept, nRecords
+
+
+def getSampleSources(params, sampleIndex):
+    """
+    (reduced name, full path) of the inputs of a sample restricted by the low-fidelity evaluation
+    """
+    return [
+        ("Tumor.partitioned", os.path.join(params.sampleDataPath[sampleIndex], "Tumor.partitioned")),
+        ("VFResultsTumor.txt.gz", os.path.join(params.sampleDataPath[sampleIndex], "VFResultsTumor.txt.gz")),
+        ("Truth_" + os.path.basename(params.truthFiles[sampleIndex]), params.truthFiles[sampleIndex]),
+        ("Exclude_" + os.path.basename(params.exlcudeRegions[sampleIndex]), params.exlcudeRegions[sampleIndex]),
+    ]
+
+
+def buildReducedInputs(fidelityDir, sampleName, chromosomes, sources):
+    """
+    Directory of the inputs of a sample restricted to chromosomes and whether it was built, or
+    reused from a previous run. Built aside and renamed into place, so that concurrent runs sharing
+    fidelityDir never read a partial directory.
+    """
+    key = hashlib.sha1(json.dumps([chromosomes] + [(name, describeInput(path)) for name, path in sources])).hexdigest()
+    reducedPath = os.path.join(fidelityDir, "%s_%s" % (sampleName, key[0:16]))
+    if os.path.isdir(reducedPath):
+        return reducedPath, False
+    buildPath = tempfile.mkdtemp(prefix=".%s_" % sampleName, dir=fidelityDir)
+    try:
+        for name, source in sources:
+            nKept, nRecords = subsetFile(source, os.path.join(buildPath, name), chromosomes)
+            if nRecords > 0 and nKept == 0:
+                print >> sys.stderr, "Warning: none of the %i records of %s is on chromosomes %s" % (nRecords, source, ",".join(chromosomes))
+        try:
+            os.rename(buildPath, reducedPath)
+        except OSError:
+            # built by a concurrent run in the meantime:
+            if not os.path.isdir(reducedPath):
+                raise
+    finally:
+        shutil.rmtree(buildPath, ignore_errors=True)
+    return reducedPath, True
+
+
+def prepareLowFidelityInputs(params):
+    """
+    Build or reuse the reduced inputs of all training samples and keep their paths in params.lowFidelityInputs
+    """
+    chromosomes = parseChromosomes(params.fidelityChromosomes)
+    fidelityDir = getattr(params, "fidelityDir", None) or os.path.join(params.outputPath, LOW_FIDELITY_DIR, "Inputs")
+    if not os.path.isdir(fidelityDir):
+        os.makedirs(fidelityDir)
+    inputs = {"sampleDataPath": [], "truthFiles": [], "exlcudeRegions": []}
+    nBuilt = 0
+    for sampleIndex in range(params.sampleSize):
+        sources = getSampleSources(params, sampleIndex)
+        reducedPath, isBuilt = buildReducedInputs(fidelityDir, params.sampleNames[sampleIndex], chromosomes, sources)
+        nBuilt += isBuilt
+        inputs["sampleDataPath"].append(reducedPath)
+        inputs["truthFiles"].append(os.path.join(reducedPath, sources[2][0]))
+        inputs["exlcudeRegions"].append(os.path.join(reducedPath, sources[3][0]))
+    params.lowFidelityInputs = inputs
+    print "Low fidelity inputs of %i samples on chromosomes %s: %i built, %i reused from %s" % (params.sampleSize, ",".join(chromosomes), nBuilt, params.sampleSize - nBuilt, fidelityDir)
+
+
+def getLowFidelityParams(params):
+    """
+    Copy of params evaluating steps on the reduced inputs, in the LowFidelity/ subdirectory of the run
+    """
+    lowParams = copy.copy(params)
+    lowParams.outputPath = os.path.join(params.outputPath, LOW_FIDELITY_DIR)
+    for name, paths in params.lowFidelityInputs.iteritems():
+        setattr(lowParams, name, paths)
+    # calls on a chromosome subset are not the calls of the configuration:
+    lowParams.callIndex = None
+    lowParams.fidelity = "low"
+    return lowParams
+
+
+def isLowFidelityIteration(params):
+    """
+    Whether the candidates of the current iteration are screened at low fidelity first
+    """
+    if getattr(params, "lowFidelityInputs", None) is None:
+        return False
+    return params.fidelityIterations <= 0 or params.iteration < params.fidelityIterations
+
+
+def getWorkerKey(params, sampleIndex):
+    """
+    Key of the warm workers serving the caller tasks of a sample, see SomaticCanvasWorkerPool
+    """
+    if getattr(params, "fidelity", "full") == "low":
+        return WORKER_KEY_PREFIX + params.sampleNames[sampleIndex]
+    return params.sampleNames[sampleIndex]
+
+
+def resolveWorkerKey(params, workerKey):
+    """
+    Params and sample name of a worker key
+    """
+    if workerKey.startswith(WORKER_KEY_PREFIX):
+        return getLowFidelityParams(params), workerKey[len(WORKER_KEY_PREFIX):]
+    return params, workerKey
+
+
+def rankValues(values):
+    """
+    Ranks starting at 1, tied values get the average of their ranks
+    """
+    uniqueValues, inverse = numpy.unique(numpy.asarray(values, dtype=float), return_inverse=True)
+    counts = numpy.bincount(inverse)
+    firstRanks = numpy.cumsum(counts) - counts + 1
+    return (firstRanks + (counts - 1) / 2.0)[inverse]
+
+
+def spearmanCorrelation(x, y):
+    """
+    Spearman rank correlation, nan with fewer than 2 values or without variation
+    """
+    if len(x) < 2:
+        return numpy.nan
+    rankX = rankValues(x)
+    rankY = rankValues(y)
+    if rankX.std() == 0 or rankY.std() == 0:
+        return numpy.nan
+    return float(numpy.corrcoef(rankX, rankY)[0, 1])
+
+
+def getStepScores(store, iteration, sampleSize):
+    """
+    Score of every step of an iteration evaluated on all samples, keyed on step name
+    """
+    table = store.loadTable(iteration)
+    scores = table.stepScores()
+    return dict((table.stepNames[stepIndex], scores[stepIndex]) for stepIndex in table.rankSteps(sampleSize))
+
+
+def compareFidelities(lowScores, fullScores):
+    """
+    (steps at low fidelity, steps at both, Spearman, low-fidelity rank of the best step at full fidelity)
+    """
+    steps = sorted(set(lowScores) & set(fullScores))
+    if not steps:
+        return len(lowScores), 0, numpy.nan, None
+    bestStep = max(steps, key=lambda step: fullScores[step])
+    lowRanking = sorted(lowScores, key=lambda step: lowScores[step], reverse=True)
+    return len(lowScores), len(steps), spearmanCorrelation([lowScores[step] for step in steps], [fullScores[step] for step in steps]), lowRanking.index(bestStep) + 1
+
+
+def writeFidelityAgreement(params):
+    """
+    Agreement of the low- and full-fidelity rankings of every low-fidelity iteration and of all of them
+    together, written to outputPath/FidelityAgreement.txt; returns the rows
+    """
+    lowStore = getResultsStore(getLowFidelityParams(params))
+    fullStore = getResultsStore(params)
+    iterations = sorted(set(str(iteration) for iteration in lowStore.loadTable().iterations), key=lambda iteration: (len(iteration), iteration))
+    rows = []
+    allLowScores = {}
+    allFullScores = {}
+    for iteration in iterations:
+        lowScores = getStepScores(lowStore, iteration, params.sampleSize)
+        fullScores = getStepScores(fullStore, iteration, params.sampleSize)
+        rows.append((iteration,) + compareFidelities(lowScores, fullScores))
+        allLowScores.update(((iteration, step), score) for step, score in lowScores.iteritems())
+        allFullScores.update(((iteration, step), score) for step, score in fullScores.iteritems())
+    nLow, nBoth, correlation, bestRank = compareFidelities(allLowScores, allFullScores)
+    # the incumbents of the iterations differ, only the correlation is pooled over them:
+    rows.append(("All", nLow, nBoth, correlation, None))
+    with open(os.path.join(params.outputPath, AGREEMENT_FILE), "w") as outFile:
+        outFile.write("#Iteration\tLowFidelitySteps\tFullFidelitySteps\tSpearman\tLowFidelityRankOfBest\n")
+        for iteration, nLow, nBoth, correlation, bestRank in rows:
+            outFile.write("%s\t%i\t%i\t%.4f\t%s\n" % (iteration, nLow, nBoth, correlation, bestRank if bestRank is not None else "NA"))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the low-fidelity inputs of a training corpus, or report the fidelity agreement of a run")
+    parser.add_argument("command", choices=["build", "agreement"], help="build: reduce the inputs of all samples to --chromosomes in --fidelityDir; agreement: rewrite FidelityAgreement.txt of the run in --outputPath")
+    parser.add_argument("--input", dest="trainingSamples", default=None, help="Training samples of build")
+    parser.add_argument("--chromosomes", dest="fidelityChromosomes", default=None, help="Comma-separated chromosomes of build")
+    parser.add_argument("--fidelityDir", dest="fidelityDir", default=None, help="Directory of the reduced inputs of build")
+    parser.add_argument("--outputPath", dest="outputPath", default=None, help="Output directory of the optimization run of agreement")
+    options = parser.parse_args()
+    # the corpus reader lives with the workflow, which imports this module:
+    from SomaticCanvasModelWorkflow import readTestCorpus
+    if options.command == "build":
+        if options.trainingSamples is None or options.fidelityChromosomes is None or options.fidelityDir is None:
+            parser.error("build needs --input, --chromosomes and --fidelityDir")
+        params = argparse.Namespace(fidelityChromosomes=options.fidelityChromosomes, fidelityDir=options.fidelityDir)
+        readTestCorpus(params, options.trainingSamples)
+        return
+    if options.outputPath is None:
+        parser.error("agreement needs --outputPath")
+    params = argparse.Namespace(outputPath=options.outputPath, lowFidelityInputs={})
+    params.sampleSize = len(set(str(sample) for sample in ResultsStore(os.path.join(options.outputPath, "OptimizationResults.db")).loadTable().samples))
+    for iteration, nLow, nBoth, correlation, bestRank in writeFidelityAgreement(params):
+        print "%s\t%i\t%i\t%.4f\t%s" % (iteration, nLow, nBoth, correlation, bestRank if bestRank is not None else "NA")
+
+
+if __name__ == "__main__":
+    main()
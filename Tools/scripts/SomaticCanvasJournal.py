@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Append-only journal of the optimizer state, one fsync'd JSON line per event in Journal.jsonl:
+
+  propose     the parameter steps proposed for an iteration
+  evaluation  the evaluated samples of a parameter step and the hash of its configuration
+  best        the configuration selected by an iteration (per fold with cross-validation)
+
+A restarted run replays the journal into an OptimizerState.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+
+from SomaticCanvasResultsStore import ResultsStore
+
+JOURNAL_FILE = "Journal.jsonl"
+
+_journals = {}
+_journalsLock = threading.Lock()
+
+
+class OptimizerState:
+    """
+    Proposed steps, evaluated samples and selected configurations of a run, keyed by iteration
+    """
+
+    def __init__(self):
+        self.proposals = {}
+        self.evaluations = {}
+        self.best = {}
+
+    def apply(self, event):
+        iteration = str(event["iteration"])
+        if event["event"] == "propose":
+            self.proposals.setdefault(iteration, []).extend(event["steps"])
+        elif event["event"] == "evaluation":
+            self.evaluations.setdefault((iteration, event["step"]), {}).update((sampleName, event["configHash"]) for sampleName in event["samples"])
+        elif event["event"] == "best":
+            self.best[(iteration, event.get("fold"))] = (event["config"], event["score"])
+
+    def getProposals(self, iteration):
+        """
+        Steps proposed for an iteration as dicts of step, parameter, value and config, None before any proposal
+        """
+        return self.proposals.get(str(iteration))
+
+    def getEvaluatedSamples(self, iteration, step):
+        """
+        Configuration hash of the evaluated samples of a parameter step by sample name
+        """
+        return self.evaluations.get((str(iteration), step), {})
+
+    def getBest(self, iteration, fold=None):
+        return self.best.get((str(iteration), fold))
+
+    def getCompletedIterations(self):
+        """
+        Number of leading iterations that selected their configuration
+        """
+        iteration = 0
+        while (str(iteration), None) in self.best:
+            iteration += 1
+        return iteration
+
+
+def readEvents(journalPath):
+    """
+    Events of a journal and the length of its intact part; only the last line may be torn
+    """
+    events = []
+    intactLength = 0
+    if not os.path.exists(journalPath):
+        return events, intactLength
+    with open(journalPath) as inFile:
+        lines = inFile.readlines()
+    for lineIndex, fileLine in enumerate(lines):
+        try:
+            if not fileLine.endswith("\n"):
+                raise ValueError("unterminated line")
+            events.append(json.loads(fileLine))
+        except ValueError:
+            if lineIndex < len(lines) - 1:
+                raise Exception("Journal %s is corrupt at line %i" % (journalPath, lineIndex + 1))
+            break
+        intactLength += len(fileLine)
+    return events, intactLength
+
+
+class OptimizerJournal:
+    """
+    Journal of a run and the state replayed from it. Events are appended by the optimizer process only.
+    """
+
+    def __init__(self, journalPath):
+        self.journalPath = journalPath
+        self.lock = threading.Lock()
+        self.state = OptimizerState()
+        events, intactLength = readEvents(journalPath)
+        for event in events:
+            self.state.apply(event)
+        if os.path.exists(journalPath) and os.path.getsize(journalPath) > intactLength:
+            with open(journalPath, "r+") as journalFile:
+                journalFile.truncate(intactLength)
+                os.fsync(journalFile.fileno())
+
+    def append(self, event):
+        line = json.dumps(event, sort_keys=True) + "\n"
+        with self.lock:
+            isNew = not os.path.exists(self.journalPath)
+            with open(self.journalPath, "a") as journalFile:
+                journalFile.write(line)
+                journalFile.flush()
+                os.fsync(journalFile.fileno())
+            if isNew:
+                # the directory entry of a new journal has to be durable as well:
+                directory = os.open(os.path.dirname(os.path.abspath(self.journalPath)), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+            self.state.apply(event)
+
+    def recordProposals(self, iteration, steps):
+        """
+        Journal the (step, parameter, value, config) proposals of an iteration
+        """
+        self.append({"event": "propose", "iteration": str(iteration),
+                     "steps": [{"step": step, "parameter": parameter, "value": value, "config": config} for step, parameter, value, config in steps]})
+
+    def recordEvaluation(self, iteration, step, sampleNames, configHash):
+        self.append({"event": "evaluation", "iteration": str(iteration), "step": step, "samples": sorted(sampleNames), "configHash": configHash})
+
+    def recordBest(self, iteration, config, score, fold=None):
+        self.append({"event": "best", "iteration": str(iteration), "fold": fold, "config": config, "score": score})
+
+
+def getJournalPath(outputPath):
+    return os.path.join(outputPath, JOURNAL_FILE)
+
+
+def getJournal(params):
+    """
+    Journal shared by the workflows of this process, replayed once when it is first used
+    """
+    journalPath = getJournalPath(params.outputPath)
+    with _journalsLock:
+        if journalPath not in _journals:
+            _journals[journalPath] = OptimizerJournal(journalPath)
+        return _journals[journalPath]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the journal of an optimization run and report its state with the scores of its results store")
+    parser.add_argument("outputPath", help="Output directory of the optimization run")
+    options = parser.parse_args()
+    journalPath = getJournalPath(options.outputPath)
+    if not os.path.exists(journalPath):
+        sys.exit("No journal in %s" % options.outputPath)
+    events, intactLength = readEvents(journalPath)
+    state = OptimizerState()
+    for event in events:
+        state.apply(event)
+    print "%i events, %i iterations completed" % (len(events), state.getCompletedIterations())
+    if os.path.getsize(journalPath) > intactLength:
+        print "Torn last line of %i bytes" % (os.path.getsize(journalPath) - intactLength)
+    storePath = os.path.join(options.outputPath, "OptimizationResults.db")
+    table = ResultsStore(storePath).loadTable() if os.path.exists(storePath) else None
+    for iteration in sorted(state.proposals, key=lambda iteration: (not iteration.isdigit(), int(iteration) if iteration.isdigit() else iteration)):
+        steps = state.proposals[iteration]
+        evaluated = [step["step"] for step in steps if state.getEvaluatedSamples(iteration, step["step"])]
+        best = state.getBest(iteration)
+        print "Iteration %s: %i steps proposed, %i evaluated, %s" % (iteration, len(steps), len(evaluated), "selected" if best is not None else "not selected")
+        if table is not None and evaluated:
+            iterationTable = table.select(table.iterations == iteration)
+            ranking = iterationTable.rankSteps()
+            if len(ranking):
+                print "  best evaluated step %s, score %.4f" % (iterationTable.stepNames[ranking[0]], iterationTable.stepScores()[ranking[0]])
+
+
+if __name__ == "__main__":
+    main()
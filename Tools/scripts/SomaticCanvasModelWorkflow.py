@@ -1,17 +1,34 @@
 #!/usr/bin/env python
 import os
 import sys
-import re
 import json
 import numpy
 import operator
-import shutil
+import zlib
+import Queue
+import threading
 
 ScriptDir=os.path.abspath(os.path.dirname(__file__))
 pyFlowPath=os.path.join(ScriptDir,"redist","pyflow","src")
 sys.path.append(pyFlowPath)
 sys.path.append(ScriptDir)
 from pyflow import WorkflowRunner
+from SomaticCanvasResultCache import *
+from SomaticCanvasResultsStore import *
+from SomaticCanvasEvaluator import getSampleEvaluationIndex
+from SomaticCanvasStaging import getStagedSampleInputs
+from SomaticCanvasTelemetry import getTelemetryPrefix, getTelemetryArguments, recordInlineTask
+from SomaticCanvasResources import getTaskResources
+from SomaticCanvasCrossValidation import *
+from SomaticCanvasBatch import SampleBatch, writeManifest
+from SomaticCanvasJournal import getJournal, getJournalPath
+from SomaticCanvasRetention import collectArtifacts, finishPendingCollection
+from SomaticCanvasScreening import *
+from SomaticCanvasCallIndex import indexStepCalls
+from SomaticCanvasWorkerPool import getWorkerCallCommand
+from SomaticCanvasFidelity import prepareLowFidelityInputs, getLowFidelityParams, isLowFidelityIteration, getWorkerKey, resolveWorkerKey, writeFidelityAgreement
+
+MONO_PATH = "/illumina/sync/software/unofficial/Isas/packages/mono-4.0.2/bin/mono"
 
 def isint(x):
     try:
@@ -64,6 +81,19 @@ def readTestCorpus(params, testcorpus):
         params.truthFiles.append(os.path.join(baseDir, row['sampleDataPath'], row['truthFile']))
         params.exlcudeRegions.append(os.path.join(baseDir, row['exlcudeRegions']))
         params.sampleSize += 1
+    # reduced inputs of the low-fidelity evaluations, built once and cached:
+    if getattr(params, "fidelityChromosomes", None):
+        prepareLowFidelityInputs(params)
+
+
+def getSampleIndices(params):
+    """
+    Training samples evaluated by the current workflow: a subset while racing, all samples otherwise
+    """
+    sampleIndices = getattr(params, "sampleIndices", None)
+    if sampleIndices is None:
+        return range(params.sampleSize)
+    return sampleIndices
 
 
 def readModelParameters(model_parameters_file):
@@ -84,176 +114,545 @@ def updateModelParameters(parameterConfig, bestOptimizationParameters, bestOptim
 
 def mutateModelParameters(parameterConfig, parametername, parameterValueMin, parameterValueMax, parameterConfigFile):
     if  (parameterConfig.get(parametername)!= None):
-        newValue = numpy.random.uniform(parameterValueMin, parameterValueMax)
-        if isint(parameterValueMax) & isint(parameterValueMin):
-            newValue = int(round(newValue))
-        else:
-            newValue = round(newValue, 3)
+        newValue = roundParameterValue(numpy.random.uniform(parameterValueMin, parameterValueMax), parameterValueMin, parameterValueMax)
         parameterConfig[parametername] = newValue
         return newValue
     else:
         return sys.exit("Parameter %s does not exist in configuration file %s\n" % parametername, parameterConfigFile)
 
 
-def parseEvaluateCNV(params, tmpPath, outFilePath):
-    # Get results from the output file:
-    outFile =  open(outFilePath, 'a')
-    for sampleIndex in range(params.sampleSize):
+def parseEvaluateCNV(params, tmpPath):
+    """
+    Record all EvaluateCNV metrics of the evaluated samples of a parameter step in the results store
+    """
+    indexStepCalls(params, tmpPath, getSampleIndices(params))
+    sampleMetrics = {}
+    for sampleIndex in getSampleIndices(params):
         inputPath = os.path.join(tmpPath, params.sampleNames[sampleIndex], 'Results.txt')
-        inFile = open(inputPath, 'r')
-        Accuracy = "N/A"
-        DirectionAccuracy = "N/A"
-        Recall = "N/A"
-        Precision = "N/A"
-        for fileLine in inFile.xreadlines():
-            line = fileLine.strip().split("\t")
-            if line[0] == "Accuracy":
-                Accuracy = line[1]
-            if line[0] == "DirectionAccuracy":
-                DirectionAccuracy = line[1]
-            if line[0] == "Recall":
-                Recall = line[1]
-            if line[0] == "Precision":
-                Precision = line[1]
-        # Report results:
-        ResultString = params.sampleNames[sampleIndex] + "\t" + str(Accuracy) + "\t" + str(DirectionAccuracy) + "\t" + str(Recall) + "\t" + str(Precision)
-        outFile.write(ResultString + "\n")
-    outFile.close()
-
-
-def getBestparameters(resultsPath, nbestParams):
-    """
-    Best new parameters for a given iteration   
-    """
-    medianMeanAccuracy = []
-    meanAccuracy = []
-    optimizationStepParameter = []
-    optimizationStepParameterValue = []
-    inFile = open(resultsPath, "r")
-    for fileLine in inFile.xreadlines():
-        line = fileLine.strip().split("\t")
-        medianMeanAccuracy.append((float(line[1]) + float(line[2]))/2.0)
-        optimizationStepParameter.append(line[0].split("_")[0])
-        if isint(line[0].split("_")[1]):
-            optimizationStepParameterValue.append(int(line[0].split("_")[1]))
-        else:
-            optimizationStepParameterValue.append(float(line[0].split("_")[1]))
-    sortedAccuracy = sorted(range(len(medianMeanAccuracy)), key=lambda k: medianMeanAccuracy[k],reverse=True)
-    selectedOptimizationStepParameters = [optimizationStepParameter[i] for i in sortedAccuracy[0:nbestParams]]
-    selectedOptimizationStepParameterValues = [optimizationStepParameterValue[i] for i in sortedAccuracy[0:nbestParams]]
+        sampleMetrics[params.sampleNames[sampleIndex]] = parseEvaluateCNVResults(inputPath)
+    getResultsStore(params).recordSampleMetrics(params.iteration, os.path.basename(tmpPath), sampleMetrics)
+    # journaled once they are in the results store, a restart does not evaluate these samples again:
+    configHash = hashConfig(readModelParameters(os.path.join(tmpPath, "SomaticCallerParameters.json")))
+    getJournal(params).recordEvaluation(params.iteration, os.path.basename(tmpPath), sampleMetrics.keys(), configHash)
+
+
+def cacheSampleResults(params, tmpPath):
+    """
+    Store caller and EvaluateCNV outputs of an optimization step in the result cache
+    """
+    cache = getResultCache(params)
+    if cache is None:
+        return
+    configPath = os.path.join(tmpPath, "SomaticCallerParameters.json")
+    for sampleIndex in getSampleIndices(params):
+        outputPath = os.path.join(tmpPath, params.sampleNames[sampleIndex])
+        cnvCallsPath = os.path.join(outputPath, "CNV.vcf.gz")
+        if not os.path.exists(cnvCallsPath):
+            continue
+        cache.store("caller", callerCacheKey(params, sampleIndex, configPath), outputPath, CALLER_FILES)
+        cache.store("evaluate", evaluateCacheKey(params, sampleIndex, cnvCallsPath), outputPath, EVALUATE_FILES)
+    cache.evict()
+
+
+def readStepSampleResults(params, parameterStep):
+    """
+    Per-sample Accuracy and DirectionAccuracy of a parameter step of the current iteration
+    """
+    table = getResultsStore(params).loadTable(params.iteration, parameterStep)
+    return dict(zip(table.samples, zip(table.column("Accuracy"), table.column("DirectionAccuracy"))))
+
+
+def checkpointBestParameters(params, parameterConfig, score):
+    """
+    Atomically replace the best configuration found so far in outputPath/Best
+    """
+    bestPath = os.path.join(params.outputPath, "Best")
+    ensureDir(bestPath)
+    writeModelParameters(os.path.join(bestPath, "SomaticCallerParameters.json.tmp"), parameterConfig)
+    os.rename(os.path.join(bestPath, "SomaticCallerParameters.json.tmp"), os.path.join(bestPath, "SomaticCallerParameters.json"))
+    with open(os.path.join(bestPath, "Score.txt.tmp"), "w") as outFile:
+        outFile.write(str(score) + "\n")
+    os.rename(os.path.join(bestPath, "Score.txt.tmp"), os.path.join(bestPath, "Score.txt"))
+    getJournal(params).recordBest(params.iteration, parameterConfig, score)
+
+
+def restoreSelectedParameters(params, iteration):
+    """
+    Rewrite the configurations selected by an iteration from the journal, which a crash may have left half-written
+    """
+    for (bestIteration, fold), (parameterConfig, score) in getJournal(params).state.best.iteritems():
+        if bestIteration == str(iteration):
+            parameterConfigFile = getFoldConfigPath(params, iteration, fold or ALL_SAMPLES_FOLD)
+            ensureDir(os.path.dirname(parameterConfigFile))
+            writeModelParameters(parameterConfigFile + ".tmp", parameterConfig)
+            os.rename(parameterConfigFile + ".tmp", parameterConfigFile)
+
+
+class AnyTaskWaiter:
+    """
+    Wait until at least one of several tasks of a workflow has completed. pyflow can only wait for
+    all tasks of a set, so every task is waited for with waitForTasks() in a thread of its own;
+    isTaskComplete() of a sub-workflow is bound to its parent and cannot be used. The native
+    executor wakes the workflow as soon as a task completes instead.
+    """
+
+    def __init__(self, wflow, pollInterval):
+        self.wflow = wflow
+        self.pollInterval = pollInterval
+        self.waited = set()
+        self.completed = set()
+        self.done = Queue.Queue()
+
+    def waitForTask(self, label):
+        try:
+            self.done.put((label, self.wflow.waitForTasks(label)))
+        except:
+            self.done.put((label, 1))
+            raise
+
+    def wait(self, labels):
+        """
+        Labels of the completed tasks among labels, as soon as there is one
+        """
+        if hasattr(self.wflow, "waitForAnyTask"):
+            return self.wflow.waitForAnyTask(labels)
+        for label in labels:
+            if label not in self.waited:
+                self.waited.add(label)
+                waiter = threading.Thread(target=self.waitForTask, args=(label,))
+                waiter.daemon = True
+                waiter.start()
+        while True:
+            completed = [label for label in labels if label in self.completed]
+            if completed:
+                self.completed.difference_update(completed)
+                return completed
+            try:
+                label, retval = self.done.get(timeout=self.pollInterval)
+            except Queue.Empty:
+                continue
+            # waitForTasks() returns 1 for a failed task and for all tasks once task submission stopped:
+            if retval != 0:
+                raise Exception("Task submission stopped while waiting for: %s" % (",".join(labels)))
+            self.completed.add(label)
+
+
+def getBestparameters(params, nbestParams):
+    """
+    Best new parameters for a given iteration, ranked over the steps evaluated on all samples
+    """
+    store = getResultsStore(params)
+    table = store.loadTable(params.iteration)
+    steps = store.loadSteps(params.iteration)
+    selectedSteps = [steps[(table.stepIterations[i], table.stepNames[i])] for i in table.rankSteps(params.sampleSize)[0:nbestParams]]
+    selectedOptimizationStepParameters = [step[0] for step in selectedSteps]
+    selectedOptimizationStepParameterValues = [step[1] for step in selectedSteps]
     return selectedOptimizationStepParameters, selectedOptimizationStepParameterValues
 
 
-def parseOptimizationStep(params, inFilePath, outFilePath):
+def writeIterationSummary(params):
     """
-    Average over EvaluateCNV metrics for all samples for a given optimization step   
+    Median and mean EvaluateCNV metrics of every parameter step of an iteration, best first
     """
+    outFilePath = os.path.join(params.outputPath, "Iteration_" + str(params.iteration), "Results.txt")
+    writeStepSummary(getResultsStore(params).loadTable(params.iteration), outFilePath, params.sampleSize)
 
-    inFile =  open(inFilePath, 'r') 
-    outFile =  open(outFilePath, 'a') 
-    Accuracy = []
-    DirectionAccuracy = []
-    Recall = []
-    Precision = []
-    for fileLine in inFile.xreadlines():
-        line = fileLine.strip().split("\t")
-        Accuracy.append(float(line[1]))
-        DirectionAccuracy.append(float(line[2]))
-        Recall.append(float(line[3]))
-        Precision.append(float(line[4]))
 
-    medianAccuracy = numpy.median(Accuracy)
-    meanAccuracy = numpy.mean(Accuracy)
-    medianDirectionAccuracy = numpy.median(DirectionAccuracy)
-    meanDirectionAccuracy = numpy.mean(DirectionAccuracy)
-    medianRecall = numpy.median(Recall)
-    meanRecall = numpy.mean(Recall)
-    medianPrecision = numpy.median(Precision)
-    meanPrecision = numpy.mean(Precision)
-    ResultString = params.currentParameter + "_" + str(params.currentParameterValue) + "\t" + str(medianAccuracy) + "\t" + str(meanAccuracy) + "\t" + str(medianDirectionAccuracy) + "\t" + str(meanDirectionAccuracy) + "\t" + str(medianRecall) + "\t" + str(meanRecall) + "\t" + str(medianPrecision) + "\t" + str(meanPrecision)
-    outFile.write(ResultString + "\n")
-    outFile.close()
+def registerParameterStep(params, parameterStep, stepParameter, stepParameterValue, parameterConfig):
+    """
+    Write the configuration of a parameter step and record it in the results store
+    """
+    stepPath = os.path.join(params.outputPath, "Iteration_" + str(params.iteration), parameterStep)
+    ensureDir(stepPath)
+    writeModelParameters(os.path.join(stepPath, "SomaticCallerParameters.json"), parameterConfig)
+    getResultsStore(params).recordStep(params.iteration, parameterStep, stepParameter, stepParameterValue, parameterConfig, hashConfig(parameterConfig))
+    return stepPath
 
 
-class RunSomaticCanvasWorkflow(WorkflowRunner):
-    """Workflow for running CanvasSomaticCaller"""
+def addCrossValidationStep(steps, stepParameter, stepParameterValue, parameterConfig, sampleIndices):
+    """
+    Parameter step evaluating a configuration, shared with the folds that already need the same configuration
+    """
+    configHash = hashConfig(parameterConfig)
+    if configHash not in steps:
+        if stepParameterValue is None:
+            label = configHash[0:8]
+        else:
+            label = str(stepParameterValue) + "_" + configHash[0:8]
+        steps[configHash] = [stepParameter, label, stepParameterValue, parameterConfig, set()]
+    steps[configHash][4].update(sampleIndices)
+    return "Parameter_" + steps[configHash][0] + "_" + steps[configHash][1]
 
-    def __init__(self, params):
-        self.params = params
 
-    def workflow(self):
-        parameterStep = "Parameter_" + self.params.currentParameter + "_" + str(self.params.currentParameterValue)
-        otimizationTaskID = "Iteration_" + str(self.params.iteration) + parameterStep
-        tmpPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), parameterStep)
-        configPath = os.path.join(tmpPath, "SomaticCallerParameters.json")
-        ensureDir(tmpPath)
-        canvasBinary = os.path.join(self.params.executablePath, "CanvasSomaticCaller.exe")
-        print tmpPath
-        for sampleIndex in range(self.params.sampleSize):
-            canvasTaskID = "canvasTaskID_" + self.params.sampleNames[sampleIndex]
-            outputPath = os.path.join(tmpPath, self.params.sampleNames[sampleIndex])
-            ensureDir(outputPath)
-            canvasTask = "/illumina/sync/software/unofficial/Isas/packages/mono-4.0.2/bin/mono %s" % canvasBinary
-            canvasTask += " -v %s/VFResultsTumor.txt.gz" % self.params.sampleDataPath[sampleIndex]
-            canvasTask += " -i %s/Tumor.partitioned" % self.params.sampleDataPath[sampleIndex]
-            canvasTask += " -o %s" % os.path.join(outputPath, "CNV.vcf.gz")
-            canvasTask += " -b %s" % self.params.sampleFilterBed[sampleIndex]
-            canvasTask += " -n Tumor"
-            canvasTask += " -r %s" % self.params.sampleReferenceGenome[sampleIndex]
-            canvasTask += " -c %s" % configPath
-            canvasTask += " -t %s" % self.params.truthFiles[sampleIndex]
-            self.addTask(canvasTaskID, canvasTask, memMb = self.params.memoryCore, retryMax = 3, retryMode = "all")
-
-
-class RunEvaluateCNV(WorkflowRunner):
-    """Workflow for running RunEvaluateCNV"""
+def addCrossValidationTasks(workflow, params, steps):
+    """
+    Evaluate every shared cross-validation step of the current iteration on the samples of the folds needing it
+    """
+    tasks = []
+    for stepParameter, label, stepParameterValue, parameterConfig, sampleIndices in sorted(steps.values()):
+        params.currentParameter = stepParameter
+        params.currentParameterValue = label
+        params.sampleIndices = sorted(sampleIndices)
+        registerParameterStep(params, "Parameter_" + stepParameter + "_" + label, stepParameter, stepParameterValue, parameterConfig)
+        taskID = "WorkflowOptimizatioNStep_" + str(params.otimizationStep)
+        tasks.append(workflow.addWorkflowTask(taskID, FullWorkflow(params)))
+        params.otimizationStep += 1
+    params.sampleIndices = None
+    return tasks
+
+
+def roundParameterValue(value, parameterValueMin, parameterValueMax):
+    if isint(parameterValueMax) & isint(parameterValueMin):
+        return int(round(value))
+    return round(value, 3)
+
+
+def scoreAccuracies(accuracies):
+    """
+    Optimization objective of a parameter step: average of median and mean accuracy over samples
+    """
+    return (numpy.median(accuracies) + numpy.mean(accuracies)) / 2.0
+
+
+def loadEvaluationHistory(params):
+    """
+    Collect (parameter config, score) of every fully evaluated parameter step of the run
+    """
+    store = getResultsStore(params)
+    table = store.loadTable()
+    steps = store.loadSteps()
+    scores = table.stepScores()
+    history = []
+    for stepIndex in numpy.nonzero(table.sampleCounts() >= params.sampleSize)[0]:
+        stepKey = (table.stepIterations[stepIndex], table.stepNames[stepIndex])
+        if stepKey in steps:
+            history.append((steps[stepKey][2], scores[stepIndex]))
+    return history
+
+
+def getIterationSeed(params):
+    """
+    Seed of the draws of the current iteration, as engines are created again for every iteration:
+    None without --searchSeed, else derived from the seed and the iteration
+    """
+    if getattr(params, "searchSeed", None) is None:
+        return None
+    return [params.searchSeed, zlib.crc32(str(getattr(params, "iteration", 0))) & 0xffffffff]
+
+
+class MutationProposalEngine:
+    """
+    Mutate one parameter at a time within its modelParameters.json bounds
+    """
+    isJoint = False
 
     def __init__(self, params):
         self.params = params
 
-    def workflow(self):
-        parameterStep = "Parameter_" + self.params.currentParameter + "_" + str(self.params.currentParameterValue)
-        otimizationTaskID = "Iteration_" + str(self.params.iteration) + parameterStep
-        tmpPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), parameterStep)
-        ensureDir(tmpPath)
-        for sampleIndex in range(self.params.sampleSize):
-            evaluateCNVID = "evaluateCNVTaskID_" + self.params.sampleNames[sampleIndex]
-            outputPath = os.path.join(tmpPath, self.params.sampleNames[sampleIndex])
-            ensureDir(outputPath)
-            inputPath = os.path.join(outputPath, "CNV.vcf.gz")
-            evaluateCNVtask = "/illumina/sync/software/unofficial/Isas/packages/mono-4.0.2/bin/mono %s" % self.params.evaluateCNVPath + " "
-            evaluateCNVtask += self.params.truthFiles[sampleIndex] + " "
-            evaluateCNVtask += inputPath + " "
-            evaluateCNVtask += self.params.exlcudeRegions[sampleIndex] + " "
-            evaluateCNVtask +=  os.path.join(outputPath, "Results.txt")
-            self.addTask(evaluateCNVID, evaluateCNVtask, memMb = self.params.memoryCore, retryMax = 3, retryMode = "all")
-
-
-class ParseEvaluateCNV(WorkflowRunner):
-    """Workflow for parsing RunEvaluateCNV """
+    def propose(self, parameterConfig, parameterConfigFile, history, pending=()):
+        proposals = []
+        for keyModelParameters, valueModelParameters in self.params.modelParametersSet.iteritems():
+            stepConfig = dict(parameterConfig)
+            newModelParameter = mutateModelParameters(stepConfig, keyModelParameters, valueModelParameters[0], valueModelParameters[1], parameterConfigFile)
+            proposals.append((keyModelParameters, newModelParameter, stepConfig))
+        return proposals
+
+
+class RandomProposalEngine:
+    """
+    Draw joint configurations uniformly within modelParameters.json bounds
+    """
+    isJoint = True
 
     def __init__(self, params):
         self.params = params
+        self.parameterNames = sorted(params.modelParametersSet.keys())
+        self.lower = numpy.array([float(params.modelParametersSet[name][0]) for name in self.parameterNames])
+        self.upper = numpy.array([float(params.modelParametersSet[name][1]) for name in self.parameterNames])
+        self.random = numpy.random.RandomState(getIterationSeed(params))
+
+    def toConfig(self, parameterConfig, unitValues):
+        """
+        Map a point of the unit hypercube onto a rounded parameter configuration
+        """
+        stepConfig = dict(parameterConfig)
+        for name, lower, upper, unitValue in zip(self.parameterNames, self.lower, self.upper, unitValues):
+            stepConfig[name] = roundParameterValue(lower + unitValue * (upper - lower), self.params.modelParametersSet[name][0], self.params.modelParametersSet[name][1])
+        return stepConfig
+
+    def toUnit(self, parameterConfig):
+        values = numpy.array([float(parameterConfig.get(name, lower)) for name, lower in zip(self.parameterNames, self.lower)])
+        return numpy.clip((values - self.lower) / numpy.maximum(self.upper - self.lower, 1e-12), 0.0, 1.0)
+
+    def sampleCandidates(self, history, nCandidates):
+        return self.random.uniform(size=(nCandidates, len(self.parameterNames)))
+
+    def propose(self, parameterConfig, parameterConfigFile, history, pending=()):
+        seen = set(hashConfig(config) for config, score in history)
+        seen.update(hashConfig(config) for config in pending)
+        proposals = []
+        # evaluate the starting configuration first so that proposals are ranked against it:
+        if not history and not pending:
+            seen.add(hashConfig(parameterConfig))
+            proposals.append(("Proposal", 0, dict(parameterConfig)))
+        for attempt in range(100):
+            if len(proposals) >= self.params.proposalsPerIteration:
+                break
+            for unitValues in self.sampleCandidates(history, self.params.proposalsPerIteration):
+                stepConfig = self.toConfig(parameterConfig, unitValues)
+                if hashConfig(stepConfig) in seen:
+                    continue
+                seen.add(hashConfig(stepConfig))
+                proposals.append(("Proposal", len(proposals), stepConfig))
+                if len(proposals) >= self.params.proposalsPerIteration:
+                    break
+        return proposals
+
+
+class TPEProposalEngine(RandomProposalEngine):
+    """
+    Tree-structured Parzen estimator: propose joint configurations that maximize the ratio of
+    densities fitted to the best and to the remaining (config, score) pairs seen so far
+    """
+    gamma = 0.25
+    nStartup = 8
+    nCandidates = 256
+
+    def logDensity(self, points, observations):
+        """
+        Log density of a Parzen estimator (independent Gaussian kernels per dimension, uniform prior) at points
+        """
+        bandwidth = max(0.05, numpy.std(observations, axis=0).mean() * len(observations) ** -0.2)
+        distances = (points[:, numpy.newaxis, :] - observations[numpy.newaxis, :, :]) / bandwidth
+        kernels = numpy.exp(-0.5 * distances ** 2) / (bandwidth * numpy.sqrt(2 * numpy.pi))
+        densities = (kernels.sum(axis=1) + 1.0) / (len(observations) + 1.0)
+        return numpy.log(densities).sum(axis=1)
+
+    def sampleCandidates(self, history, nCandidates):
+        if len(history) < self.nStartup:
+            return RandomProposalEngine.sampleCandidates(self, history, nCandidates)
+        observations = numpy.array([self.toUnit(config) for config, score in history])
+        scores = numpy.array([score for config, score in history])
+        order = numpy.argsort(-scores)
+        nGood = max(1, int(numpy.ceil(self.gamma * len(history))))
+        good = observations[order[:nGood]]
+        bad = observations[order[nGood:]]
+        bandwidth = max(0.05, numpy.std(good, axis=0).mean() * len(good) ** -0.2)
+        centers = good[self.random.randint(len(good), size=self.nCandidates)]
+        candidates = numpy.clip(centers + self.random.normal(scale=bandwidth, size=centers.shape), 0.0, 1.0)
+        expectedImprovement = self.logDensity(candidates, good) - self.logDensity(candidates, bad)
+        return candidates[numpy.argsort(-expectedImprovement)]
+
+
+proposalEngines = {
+    "mutation": MutationProposalEngine,
+    "random": RandomProposalEngine,
+    "tpe": TPEProposalEngine,
+}
 
-    def workflow(self):
-        parameterStep = "Parameter_" + self.params.currentParameter + "_" + str(self.params.currentParameterValue)
-        tmpPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), parameterStep)
-        outFilePathEvaluateCNV = os.path.join(tmpPath, 'Results.txt')
-        outFilePathOptimizationStep = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), 'Results.txt')
-        parseEvaluateCNV(self.params, tmpPath, outFilePathEvaluateCNV)
-        parseOptimizationStep(self.params, outFilePathEvaluateCNV, outFilePathOptimizationStep)
+
+def getProposalEngine(params):
+    return proposalEngines[getattr(params, "searchEngine", "mutation")](params)
+
+
+def getCallerInputArguments(params, sampleIndex, inputPaths):
+    """
+    CanvasSomaticCaller arguments of the inputs of a sample, the same for all its calls
+    """
+    arguments = " -v %s" % inputPaths["VFResultsTumor.txt.gz"]
+    arguments += " -i %s" % inputPaths["Tumor.partitioned"]
+    arguments += " -b %s" % inputPaths["Filter_" + os.path.basename(params.sampleFilterBed[sampleIndex])]
+    arguments += " -n Tumor"
+    arguments += " -r %s" % inputPaths["Reference"]
+    arguments += " -t %s" % inputPaths["Truth_" + os.path.basename(params.truthFiles[sampleIndex])]
+    return arguments
+
+
+def getCallerWorkerCommand(params, workerKey):
+    """
+    Command of a warm CanvasSomaticCaller worker of a sample, see SomaticCanvasWorkerPool
+    """
+    params, sampleName = resolveWorkerKey(params, workerKey)
+    sampleIndex = params.sampleNames.index(sampleName)
+    stagingPrefix, inputPaths = getStagedSampleInputs(params, sampleIndex)
+    canvasBinary = os.path.join(params.executablePath, "CanvasSomaticCaller.exe")
+    return stagingPrefix + "%s %s --worker" % (getattr(params, "monoPath", MONO_PATH), canvasBinary) + getCallerInputArguments(params, sampleIndex, inputPaths)
+
+
+def addSomaticCanvasTask(wflow, params, sampleIndex):
+    """
+    Add the CanvasSomaticCaller task of a sample to wflow.
+    Returns None when the calls were restored from the result cache instead.
+    """
+    parameterStep = "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue)
+    tmpPath = os.path.join(params.outputPath, "Iteration_" + str(params.iteration), parameterStep)
+    configPath = os.path.join(tmpPath, "SomaticCallerParameters.json")
+    canvasBinary = os.path.join(params.executablePath, "CanvasSomaticCaller.exe")
+    canvasTaskID = "canvasTaskID_" + params.sampleNames[sampleIndex]
+    outputPath = os.path.join(tmpPath, params.sampleNames[sampleIndex])
+    ensureDir(outputPath)
+    # parameter set already evaluated on this sample, reuse its calls:
+    cache = getResultCache(params)
+    if cache is not None and cache.restore("caller", callerCacheKey(params, sampleIndex, configPath), outputPath):
+        return None
+    memMb, nCores = getTaskResources(params, "CanvasSomaticCaller", sampleIndex)
+    if getattr(params, "workerPoolSocket", None) is not None:
+        # the call is served by a warm worker of the sample, whose usage over the call is recorded as the telemetry of the task:
+        canvasTask = getWorkerCallCommand(params, getWorkerKey(params, sampleIndex), configPath, os.path.join(outputPath, "CNV.vcf.gz"),
+                                          os.path.join(outputPath, "CanvasSomaticCaller.log"), getTelemetryArguments(params, "CanvasSomaticCaller", sampleIndex, memMb, nCores))
+        return wflow.addTask(canvasTaskID, canvasTask, memMb = memMb, nCores = nCores, retryMax = 3, retryMode = "all")
+    canvasTask = getTelemetryPrefix(params, "CanvasSomaticCaller", sampleIndex, memMb, nCores)
+    # inputs are read from a node-local copy when staging is enabled:
+    stagingPrefix, inputPaths = getStagedSampleInputs(params, sampleIndex)
+    canvasTask += stagingPrefix + "%s %s" % (getattr(params, "monoPath", MONO_PATH), canvasBinary)
+    canvasTask += getCallerInputArguments(params, sampleIndex, inputPaths)
+    canvasTask += " -o %s" % os.path.join(outputPath, "CNV.vcf.gz")
+    canvasTask += " -c %s" % configPath
+    return wflow.addTask(canvasTaskID, canvasTask, memMb = memMb, nCores = nCores, retryMax = 3, retryMode = "all")
+
+
+def addEvaluateCNVTask(wflow, params, sampleIndex, dependencies=None):
+    """
+    Add the EvaluateCNV task of a sample to wflow.
+    Returns None when the evaluation of unchanged calls was restored from the result cache
+    or when the calls were scored in-process by the python evaluator instead.
+    """
+    parameterStep = "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue)
+    tmpPath = os.path.join(params.outputPath, "Iteration_" + str(params.iteration), parameterStep)
+    evaluateCNVID = "evaluateCNVTaskID_" + params.sampleNames[sampleIndex]
+    outputPath = os.path.join(tmpPath, params.sampleNames[sampleIndex])
+    ensureDir(outputPath)
+    inputPath = os.path.join(outputPath, "CNV.vcf.gz")
+    # calls unchanged by the parameter step, reuse their evaluation:
+    cache = getResultCache(params)
+    if cache is not None and os.path.exists(inputPath) and cache.restore("evaluate", evaluateCacheKey(params, sampleIndex, inputPath), outputPath):
+        return None
+    if getattr(params, "evaluator", "EvaluateCNV") == "python":
+        resultsPath = os.path.join(outputPath, "Results.txt")
+        # scored in the optimizer process, whose usage over the evaluation is recorded under its own kind, not sizing EvaluateCNV tasks:
+        recordInlineTask(params, "PythonEvaluator", sampleIndex, lambda: getSampleEvaluationIndex(params.truthFiles[sampleIndex], params.exlcudeRegions[sampleIndex]).writeResults(inputPath, resultsPath))
+        return None
+    memMb, nCores = getTaskResources(params, "EvaluateCNV", sampleIndex)
+    evaluateCNVtask = getTelemetryPrefix(params, "EvaluateCNV", sampleIndex, memMb, nCores)
+    evaluateCNVtask += "%s %s" % (getattr(params, "monoPath", MONO_PATH), params.evaluateCNVPath) + " "
+    evaluateCNVtask += params.truthFiles[sampleIndex] + " "
+    evaluateCNVtask += inputPath + " "
+    evaluateCNVtask += params.exlcudeRegions[sampleIndex] + " "
+    evaluateCNVtask +=  os.path.join(outputPath, "Results.txt")
+    return wflow.addTask(evaluateCNVID, evaluateCNVtask, memMb = memMb, nCores = nCores, dependencies = dependencies, retryMax = 3, retryMode = "all")
 
 
 class FullWorkflow(WorkflowRunner):
-    """Complete workflow for training Canvas somatic model"""
+    """
+    Complete workflow for training Canvas somatic model.
+    Each sample's EvaluateCNV task depends only on its own CanvasSomaticCaller task and
+    its metrics are recorded in the results store as soon as its evaluation has finished.
+    """
 
     def __init__(self, params):
         self.params = params
 
     def workflow(self):
-        somaticCanvasWorkflow = self.addWorkflowTask("runSomaticCanvasWorkflow", RunSomaticCanvasWorkflow(self.params))
-        runEvaluateCNVWorkflow = self.addWorkflowTask("runEvaluateCNV", RunEvaluateCNV(self.params), dependencies=somaticCanvasWorkflow)
-        self.addWorkflowTask("parseEvaluateCNV", ParseEvaluateCNV(self.params), dependencies=runEvaluateCNVWorkflow)
+        parameterStep = "Parameter_" + self.params.currentParameter + "_" + str(self.params.currentParameterValue)
+        tmpPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), parameterStep)
+        # samples evaluated with the same configuration before a restart are not run again:
+        configHash = hashConfig(readModelParameters(os.path.join(tmpPath, "SomaticCallerParameters.json")))
+        evaluatedSamples = getJournal(self.params).state.getEvaluatedSamples(self.params.iteration, parameterStep)
+        sampleIndices = [sampleIndex for sampleIndex in getSampleIndices(self.params) if evaluatedSamples.get(self.params.sampleNames[sampleIndex]) != configHash]
+        if not sampleIndices:
+            return
+        ensureDir(tmpPath)
+        print tmpPath
+        if getattr(self.params, "batchMode", "none") != "none":
+            self.runBatches(tmpPath, sampleIndices)
+            return
+        # with a result cache or the python evaluator the evaluation is only added once the calls exist:
+        isDynamic = getResultCache(self.params) is not None or getattr(self.params, "evaluator", "EvaluateCNV") == "python"
+        canvasTasks = {}
+        evaluateCNVTasks = {}
+        parsedSamples = []
+        waiter = AnyTaskWaiter(self, self.params.pollInterval)
+        for sampleIndex in sampleIndices:
+            canvasTaskID = addSomaticCanvasTask(self, self.params, sampleIndex)
+            if canvasTaskID is not None and isDynamic:
+                canvasTasks[canvasTaskID] = sampleIndex
+                continue
+            evaluateCNVID = addEvaluateCNVTask(self, self.params, sampleIndex, dependencies = canvasTaskID)
+            if evaluateCNVID is None:
+                parsedSamples.append(sampleIndex)
+            else:
+                evaluateCNVTasks[evaluateCNVID] = sampleIndex
+        while True:
+            if parsedSamples:
+                self.params.sampleIndices = parsedSamples
+                parseEvaluateCNV(self.params, tmpPath)
+                parsedSamples = []
+            if not canvasTasks and not evaluateCNVTasks:
+                break
+            for taskID in waiter.wait(canvasTasks.keys() + evaluateCNVTasks.keys()):
+                if taskID in canvasTasks:
+                    sampleIndex = canvasTasks.pop(taskID)
+                    evaluateCNVID = addEvaluateCNVTask(self, self.params, sampleIndex)
+                    if evaluateCNVID is None:
+                        parsedSamples.append(sampleIndex)
+                    else:
+                        evaluateCNVTasks[evaluateCNVID] = sampleIndex
+                else:
+                    parsedSamples.append(evaluateCNVTasks.pop(taskID))
+        self.params.sampleIndices = sampleIndices
+        cacheSampleResults(self.params, tmpPath)
+
+    def runBatches(self, tmpPath, sampleIndices):
+        """
+        Run the CanvasSomaticCaller and EvaluateCNV commands of all samples as tasks of batchSize
+        samples, or as one SGE array job, then parse the results of all samples
+        """
+        # with a result cache or the python evaluator the evaluation is only added once the calls exist:
+        isDynamic = getResultCache(self.params) is not None or getattr(self.params, "evaluator", "EvaluateCNV") == "python"
+        configHash = hashConfig(readModelParameters(os.path.join(tmpPath, "SomaticCallerParameters.json")))
+        batch = SampleBatch()
+        for sampleIndex in sampleIndices:
+            batch.startSample(self.params.sampleNames[sampleIndex], os.path.join(tmpPath, self.params.sampleNames[sampleIndex]), configHash)
+            canvasTaskID = addSomaticCanvasTask(batch, self.params, sampleIndex)
+            if canvasTaskID is None or not isDynamic:
+                addEvaluateCNVTask(batch, self.params, sampleIndex, dependencies = canvasTaskID)
+        self.runBatchJobs(tmpPath, "Calls", batch)
+        if isDynamic:
+            batch = SampleBatch()
+            for sampleIndex in sampleIndices:
+                batch.startSample(self.params.sampleNames[sampleIndex], os.path.join(tmpPath, self.params.sampleNames[sampleIndex]), configHash)
+                if not os.path.exists(os.path.join(tmpPath, self.params.sampleNames[sampleIndex], "Results.txt")):
+                    addEvaluateCNVTask(batch, self.params, sampleIndex)
+            self.runBatchJobs(tmpPath, "Evaluation", batch)
+        self.params.sampleIndices = sampleIndices
+        parseEvaluateCNV(self.params, tmpPath)
+        cacheSampleResults(self.params, tmpPath)
+
+    def runBatchJobs(self, tmpPath, name, batch):
+        """
+        Run the pending samples of a batch and wait for them, raising if any sample failed all its retries
+        """
+        entries = batch.pendingEntries()
+        if not entries:
+            return
+        batchScript = os.path.join(ScriptDir, "SomaticCanvasBatch.py")
+        batchTasks = []
+        if self.params.batchMode == "array":
+            manifestPath = os.path.join(tmpPath, name + "ArrayJob.json")
+            writeManifest(manifestPath, entries, batch.memMb, batch.nCores)
+            jobName = "%s_%s_%s" % (name, os.path.basename(os.path.dirname(tmpPath)), os.path.basename(tmpPath))
+            batchTask = "%s %s submit --manifest %s --qsubPath '%s' --jobName %s" % (sys.executable, batchScript, manifestPath, self.params.qsubPath, jobName)
+            # the array job is submitted and waited for from the head node:
+            batchTasks.append(self.addTask(name + "ArrayJobTaskID", batchTask, isForceLocal = True))
+        else:
+            for batchIndex in range(0, len(entries), self.params.batchSize):
+                manifestPath = os.path.join(tmpPath, "%sBatch_%i.json" % (name, batchIndex / self.params.batchSize))
+                writeManifest(manifestPath, entries[batchIndex:batchIndex + self.params.batchSize], batch.memMb, batch.nCores)
+                batchTask = "%s %s run --manifest %s" % (sys.executable, batchScript, manifestPath)
+                # samples are retried within the task, a retried task only reruns the samples that did not complete:
+                batchTasks.append(self.addTask("%sBatchTaskID_%i" % (name, batchIndex / self.params.batchSize), batchTask, memMb = batch.memMb, nCores = batch.nCores, retryMax = 1, retryMode = "all"))
+        if self.waitForTasks(batchTasks) != 0:
+            raise Exception("Samples of %s failed, see the BatchStatus.json of each sample" % tmpPath)
 
 
 class OptimizeSomaticCanvasWorkflow(WorkflowRunner):
@@ -273,19 +672,137 @@ class OptimizeSomaticCanvasWorkflow(WorkflowRunner):
         else:
             configPath = self.params.configPath
         parameterConfigFile = os.path.join(configPath, "SomaticCallerParameters.json")
-        for keyModelParameters, valueModelParameters in self.params.modelParametersSet.iteritems():
-            parameterConfig = readModelParameters(parameterConfigFile)
-            self.params.currentParameter  = keyModelParameters
-            newModelParameter = mutateModelParameters(parameterConfig, keyModelParameters, valueModelParameters[0], valueModelParameters[1], parameterConfigFile) 
-            self.params.currentParameterValue = newModelParameter
+        engine = getProposalEngine(self.params)
+        folds = getCrossValidationFolds(self.params)
+        if folds:
+            self.crossValidateCandidates(engine, folds)
+            return
+        journal = getJournal(self.params)
+        # an iteration interrupted by a crash evaluates the steps it already proposed:
+        proposals = journal.state.getProposals(self.params.iteration)
+        if proposals is None:
+            history = loadEvaluationHistory(self.params) if engine.isJoint else []
+            proposals = engine.propose(readModelParameters(parameterConfigFile), parameterConfigFile, history)
+            journal.recordProposals(self.params.iteration, [("Parameter_" + stepParameter + "_" + str(stepParameterValue), stepParameter, stepParameterValue, parameterConfig) for stepParameter, stepParameterValue, parameterConfig in proposals])
+        else:
+            proposals = [(step["parameter"], step["value"], step["config"]) for step in proposals]
+        if isLowFidelityIteration(self.params):
+            proposals = self.promoteLowFidelityCandidates(proposals)
+        candidates = []
+        for stepParameter, stepParameterValue, parameterConfig in proposals:
+            self.params.currentParameter  = stepParameter
+            self.params.currentParameterValue = stepParameterValue
             parameterStep = "Parameter_" + self.params.currentParameter + "_" + str(self.params.currentParameterValue)
-            parameterConfigPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), parameterStep)
-            ensureDir(parameterConfigPath)
-            tmpParameterConfigFile = os.path.join(parameterConfigPath, "SomaticCallerParameters.json")
-            writeModelParameters(tmpParameterConfigFile, parameterConfig)
-            taskID = "WorkflowOptimizatioNStep_" + str(self.params.otimizationStep)
-            self.addWorkflowTask(taskID, FullWorkflow(self.params))
+            registerParameterStep(self.params, parameterStep, stepParameter, stepParameterValue, parameterConfig)
+            if getattr(self.params, "racing", False):
+                candidates.append((self.params.otimizationStep, stepParameter, stepParameterValue))
+            else:
+                taskID = "WorkflowOptimizatioNStep_" + str(self.params.otimizationStep)
+                self.addWorkflowTask(taskID, FullWorkflow(self.params))
             self.params.otimizationStep += 1
+        if candidates:
+            self.raceCandidates(candidates)
+
+    def promoteLowFidelityCandidates(self, proposals):
+        """
+        Evaluate all proposals on the low-fidelity inputs and return the best fidelityPromotion of
+        them, at least nbestParams, and fidelityAudit others at random for the agreement report
+        """
+        lowParams = getLowFidelityParams(self.params)
+        lowTasks = []
+        for proposalIndex, (stepParameter, stepParameterValue, parameterConfig) in enumerate(proposals):
+            lowParams.currentParameter = stepParameter
+            lowParams.currentParameterValue = stepParameterValue
+            registerParameterStep(lowParams, "Parameter_" + stepParameter + "_" + str(stepParameterValue), stepParameter, stepParameterValue, parameterConfig)
+            lowTasks.append(self.addWorkflowTask("LowFidelityStep_" + str(proposalIndex), FullWorkflow(lowParams)))
+        if self.waitForTasks(lowTasks) != 0:
+            raise Exception("Low fidelity evaluations of iteration %s failed" % self.params.iteration)
+        candidateScores = []
+        for stepParameter, stepParameterValue, parameterConfig in proposals:
+            sampleResults = readStepSampleResults(lowParams, "Parameter_" + stepParameter + "_" + str(stepParameterValue))
+            candidateScores.append((scoreAccuracies([accuracy for accuracy, directionAccuracy in sampleResults.itervalues()]),
+                                    numpy.mean([directionAccuracy for accuracy, directionAccuracy in sampleResults.itervalues()])))
+        ranking = sorted(range(len(proposals)), key=lambda k: candidateScores[k], reverse=True)
+        nPromoted = max(int(self.params.nbestParams), int(numpy.ceil(len(proposals) * self.params.fidelityPromotion)))
+        # candidates that were not promoted keep the agreement report unbiased by the selection:
+        audited = list(numpy.random.RandomState(self.params.iteration).permutation(ranking[nPromoted:])[0:self.params.fidelityAudit])
+        print "Iteration %s: promoting %i of %i candidates to full fidelity, %i more audited" % (self.params.iteration, min(nPromoted, len(proposals)), len(proposals), len(audited))
+        return [proposals[k] for k in sorted(ranking[0:nPromoted] + audited)]
+
+    def crossValidateCandidates(self, engine, folds):
+        """
+        Apply the same parameter mutations to the configuration of every fold trajectory and evaluate
+        each distinct configuration once, on the training samples of the folds proposing it. The
+        configuration a fold carries into the iteration is also evaluated on its held-out samples.
+        """
+        parameterConfigFile = getFoldConfigPath(self.params, self.params.iteration - 1, ALL_SAMPLES_FOLD)
+        journal = getJournal(self.params)
+        proposals = journal.state.getProposals(self.params.iteration)
+        if proposals is None:
+            mutations = [(stepParameter, stepParameterValue) for stepParameter, stepParameterValue, parameterConfig in engine.propose(readModelParameters(parameterConfigFile), parameterConfigFile, [])]
+        else:
+            # the same mutations as before the restart, every fold applies all of them:
+            mutations = []
+            for step in proposals:
+                if step["parameter"] != "Base" and (step["parameter"], step["value"]) not in mutations:
+                    mutations.append((step["parameter"], step["value"]))
+        steps = {}
+        foldSteps = []
+        for foldName, trainIndices, testIndices in folds:
+            baseConfig = readModelParameters(getFoldConfigPath(self.params, self.params.iteration - 1, foldName))
+            baseStep = addCrossValidationStep(steps, "Base", None, baseConfig, trainIndices + testIndices)
+            candidates = []
+            for stepParameter, stepParameterValue in mutations:
+                stepConfig = dict(baseConfig)
+                stepConfig[stepParameter] = stepParameterValue
+                candidates.append((addCrossValidationStep(steps, stepParameter, stepParameterValue, stepConfig, trainIndices), stepParameter, stepParameterValue))
+            foldSteps.append({"name": foldName, "base": baseStep, "candidates": candidates,
+                              "train": [self.params.sampleNames[sampleIndex] for sampleIndex in trainIndices],
+                              "test": [self.params.sampleNames[sampleIndex] for sampleIndex in testIndices]})
+        ensureDir(os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration)))
+        writeCrossValidationFolds(self.params, foldSteps)
+        if proposals is None:
+            journal.recordProposals(self.params.iteration, [("Parameter_" + stepParameter + "_" + label, stepParameter, stepParameterValue, parameterConfig) for stepParameter, label, stepParameterValue, parameterConfig, sampleIndices in sorted(steps.values())])
+        addCrossValidationTasks(self, self.params, steps)
+        print "Iteration %s: %i distinct configurations for %i fold trajectories" % (self.params.iteration, len(steps), len(folds))
+
+    def raceCandidates(self, candidates):
+        """
+        Successive halving: evaluate all candidates on a small sample subset, then promote
+        the best 1/racingEta of them to racingEta times more samples until all samples are used
+        """
+        sampleOrder = list(numpy.random.RandomState(self.params.iteration).permutation(self.params.sampleSize))
+        nEvaluated = 0
+        nSamples = max(1, int(numpy.ceil(self.params.sampleSize * self.params.racingMinFraction)))
+        rung = 0
+        while candidates:
+            self.params.sampleIndices = sampleOrder[nEvaluated:nSamples]
+            isPartialEvaluation = nSamples < self.params.sampleSize
+            rungTasks = []
+            for optimizationStep, stepParameter, stepParameterValue in candidates:
+                self.params.currentParameter = stepParameter
+                self.params.currentParameterValue = stepParameterValue
+                taskID = "WorkflowOptimizatioNStep_" + str(optimizationStep) + "_Rung_" + str(rung)
+                rungTasks.append(self.addWorkflowTask(taskID, FullWorkflow(self.params)))
+            if not isPartialEvaluation:
+                break
+            if self.waitForTasks(rungTasks) != 0:
+                raise Exception("Racing rung %i of iteration %s failed" % (rung, self.params.iteration))
+            evaluatedSamples = [self.params.sampleNames[sampleIndex] for sampleIndex in sampleOrder[0:nSamples]]
+            candidateScores = []
+            for candidate in candidates:
+                parameterStep = "Parameter_" + candidate[1] + "_" + str(candidate[2])
+                sampleResults = readStepSampleResults(self.params, parameterStep)
+                accuracies = [sampleResults[sampleName][0] for sampleName in evaluatedSamples]
+                directionAccuracies = [sampleResults[sampleName][1] for sampleName in evaluatedSamples]
+                candidateScores.append((scoreAccuracies(accuracies), numpy.mean(directionAccuracies)))
+            promoted = promoteCandidates(candidateScores, self.params.nbestParams, self.params.racingEta)
+            print "Iteration %s rung %i: promoting %i of %i candidates after %i samples" % (self.params.iteration, rung, len(promoted), len(candidates), nSamples)
+            candidates = [candidates[k] for k in promoted]
+            nEvaluated = nSamples
+            nSamples = min(self.params.sampleSize, max(nSamples + 1, nSamples * self.params.racingEta))
+            rung += 1
+        self.params.sampleIndices = None
 
 
 class ParseOptimizeSomaticCanvasWorkflow(WorkflowRunner):
@@ -297,18 +814,222 @@ class ParseOptimizeSomaticCanvasWorkflow(WorkflowRunner):
         self.params = params
 
     def workflow(self):
-        resultsPath     = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration), "Results.txt")
-        bestOptimizationParameters, bestOptimizationParameterValues = getBestparameters(resultsPath, self.params.nbestParams)
         currentIterationPath  = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration))
+        if getCrossValidationFolds(self.params):
+            self.parseCrossValidation()
+            return
         if self.params.iteration > 0:
             previousIterationPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration - 1))
         else:
             previousIterationPath = self.params.configPath
-        parameterConfigFile = os.path.join(previousIterationPath, "SomaticCallerParameters.json")
-        parameterConfig = readModelParameters(parameterConfigFile)
-        updateModelParameters(parameterConfig, bestOptimizationParameters, bestOptimizationParameterValues)
+        parameterConfig = readModelParameters(os.path.join(previousIterationPath, "SomaticCallerParameters.json"))
+        if getProposalEngine(self.params).isJoint:
+            history = loadEvaluationHistory(self.params)
+            # joint proposals were evaluated as a whole, keep the best configuration seen so far:
+            if history:
+                parameterConfig, score = max(history, key=operator.itemgetter(1))
+            else:
+                print "Iteration %s: no configuration evaluated on all samples, keeping the previous one" % self.params.iteration
+                score = None
+        else:
+            bestOptimizationParameters, bestOptimizationParameterValues = getBestparameters(self.params, self.params.nbestParams)
+            updateModelParameters(parameterConfig, bestOptimizationParameters, bestOptimizationParameterValues)
+            # the combination of the best mutations has not been evaluated as a whole:
+            score = None
         parameterConfigFile = os.path.join(currentIterationPath, "SomaticCallerParameters.json")
         writeModelParameters(parameterConfigFile, parameterConfig)
+        writeIterationSummary(self.params)
+        getResultsStore(self.params).exportNumpy(os.path.join(self.params.outputPath, "OptimizationResults.npz"))
+        if isLowFidelityIteration(self.params):
+            iteration, nLow, nBoth, correlation, bestRank = [row for row in writeFidelityAgreement(self.params) if row[0] == str(self.params.iteration)][0]
+            print "Iteration %s: low and full fidelity Spearman %.3f over %i of %i candidates, best candidate ranked %s at low fidelity" % (iteration, correlation, nBoth, nLow, bestRank)
+        # journaled last, the iteration is complete once its selection is in the journal:
+        getJournal(self.params).recordBest(self.params.iteration, parameterConfig, score)
+        collectArtifacts(self.params, [parameterConfig])
+        if getattr(self.params, "lowFidelityInputs", None) is not None:
+            # low-fidelity steps are retained by the same rule, ranked in their own results store:
+            collectArtifacts(getLowFidelityParams(self.params), [parameterConfig])
+
+    def parseCrossValidation(self):
+        """
+        Update the configuration of every fold trajectory with its best mutations on its training
+        samples and report training and held-out metrics of the folds
+        """
+        table = getResultsStore(self.params).loadTable(self.params.iteration)
+        folds = readCrossValidationFolds(self.params.outputPath, self.params.iteration)
+        selectedConfigs = []
+        for fold in folds:
+            mutations = dict((step, (stepParameter, stepParameterValue)) for step, stepParameter, stepParameterValue in fold["candidates"])
+            trainTable = table.select(numpy.in1d(table.steps, mutations.keys()) & numpy.in1d(table.samples, fold["train"]))
+            bestMutations = [mutations[trainTable.stepNames[stepIndex]] for stepIndex in trainTable.rankSteps(len(fold["train"]))[0:self.params.nbestParams]]
+            parameterConfig = readModelParameters(getFoldConfigPath(self.params, self.params.iteration - 1, fold["name"]))
+            updateModelParameters(parameterConfig, [mutation[0] for mutation in bestMutations], [mutation[1] for mutation in bestMutations])
+            parameterConfigFile = getFoldConfigPath(self.params, self.params.iteration, fold["name"])
+            ensureDir(os.path.dirname(parameterConfigFile))
+            writeModelParameters(parameterConfigFile, parameterConfig)
+            selectedConfigs.append((fold["name"], parameterConfig))
+        if self.params.iteration == getattr(self.params, "totalIterations", 40) - 1:
+            table = self.scoreFinalSelection(folds, selectedConfigs)
+        writeCrossValidationReport(self.params, table, folds)
+        writeIterationSummary(self.params)
+        getResultsStore(self.params).exportNumpy(os.path.join(self.params.outputPath, "OptimizationResults.npz"))
+        journal = getJournal(self.params)
+        # the trajectory on all samples is journaled last and completes the iteration:
+        for foldName, parameterConfig in sorted(selectedConfigs, key=lambda selected: selected[0] == ALL_SAMPLES_FOLD):
+            journal.recordBest(self.params.iteration, parameterConfig, None, None if foldName == ALL_SAMPLES_FOLD else foldName)
+        collectArtifacts(self.params, [parameterConfig for foldName, parameterConfig in selectedConfigs])
+
+    def scoreFinalSelection(self, folds, selectedConfigs):
+        """
+        Evaluate the configuration every fold selected in the last iteration on its training and
+        held-out samples, before the iteration is journaled, and return the updated results table
+        """
+        steps = {}
+        for fold, (foldName, parameterConfig) in zip(folds, selectedConfigs):
+            sampleIndices = [self.params.sampleNames.index(sampleName) for sampleName in fold["train"] + fold["test"]]
+            fold["final"] = addCrossValidationStep(steps, "Final", None, parameterConfig, sampleIndices)
+        if self.waitForTasks(addCrossValidationTasks(self, self.params, steps)) != 0:
+            raise Exception("Evaluation of the final cross-validation selections failed")
+        writeCrossValidationFolds(self.params, folds)
+        return getResultsStore(self.params).loadTable(self.params.iteration)
+
+
+class AsyncOptimizeSomaticCanvasWorkflow(WorkflowRunner):
+    """
+    Steady-state optimization: keep asyncInFlight candidate evaluations running, update the
+    optimizer state as soon as any of them completes and propose a replacement right away
+    """
+
+    def __init__(self, params):
+        self.params = params
+
+    def workflow(self):
+        self.params.iteration = "Async"
+        iterationPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration))
+        ensureDir(iterationPath)
+        parameterConfigFile = os.path.join(self.params.configPath, "SomaticCallerParameters.json")
+        engine = getProposalEngine(self.params)
+        # every joint proposal should see all evaluations completed so far:
+        self.params.proposalsPerIteration = 1
+        history = loadEvaluationHistory(self.params)
+        if history:
+            bestConfig, bestScore = max(history, key=operator.itemgetter(1))
+        else:
+            bestConfig, bestScore = readModelParameters(parameterConfigFile), None
+        journal = getJournal(self.params)
+        journaledCandidates = journal.state.getProposals(self.params.iteration) or []
+        candidateIndex = len(journaledCandidates)
+        nEvaluations = len(history)
+        proposals = []
+        inFlight = {}
+        waiter = AnyTaskWaiter(self, self.params.pollInterval)
+        # proposals are submitted in a random order, reproducible with --searchSeed:
+        shuffler = numpy.random.RandomState(getIterationSeed(self.params))
+        # candidates proposed before a restart are evaluated on their remaining samples first:
+        for step in journaledCandidates:
+            if len(journal.state.getEvaluatedSamples(self.params.iteration, step["step"])) < self.params.sampleSize:
+                self.params.currentParameter = "Candidate"
+                self.params.currentParameterValue = int(step["step"].rsplit("_", 1)[1])
+                stepPath = registerParameterStep(self.params, step["step"], step["parameter"], step["value"], step["config"])
+                taskID = "AsyncOptimizationStep_" + str(self.params.currentParameterValue)
+                inFlight[self.addWorkflowTask(taskID, FullWorkflow(self.params))] = (step["config"], stepPath)
+        while nEvaluations + len(inFlight) < self.params.asyncEvaluations or inFlight:
+            while len(inFlight) < self.params.asyncInFlight and nEvaluations + len(inFlight) < self.params.asyncEvaluations:
+                if not proposals:
+                    pending = [config for config, stepPath in inFlight.itervalues()]
+                    proposals = engine.propose(bestConfig, parameterConfigFile, history, pending)
+                    shuffler.shuffle(proposals)
+                    if not proposals:
+                        break
+                stepParameter, stepParameterValue, parameterConfig = proposals.pop()
+                self.params.currentParameter = "Candidate"
+                self.params.currentParameterValue = candidateIndex
+                journal.recordProposals(self.params.iteration, [("Parameter_Candidate_" + str(candidateIndex), stepParameter, stepParameterValue, parameterConfig)])
+                stepPath = registerParameterStep(self.params, "Parameter_Candidate_" + str(candidateIndex), stepParameter, stepParameterValue, parameterConfig)
+                taskID = "AsyncOptimizationStep_" + str(candidateIndex)
+                inFlight[self.addWorkflowTask(taskID, FullWorkflow(self.params))] = (parameterConfig, stepPath)
+                candidateIndex += 1
+            if not inFlight:
+                break
+            for taskID in waiter.wait(inFlight.keys()):
+                parameterConfig, stepPath = inFlight.pop(taskID)
+                sampleResults = readStepSampleResults(self.params, os.path.basename(stepPath))
+                score = scoreAccuracies([accuracy for accuracy, directionAccuracy in sampleResults.itervalues()])
+                history.append((parameterConfig, score))
+                nEvaluations += 1
+                if bestScore is None or score > bestScore:
+                    bestConfig, bestScore = parameterConfig, score
+                    checkpointBestParameters(self.params, bestConfig, bestScore)
+                    print "Evaluation %i: new best score %s from %s" % (nEvaluations, bestScore, stepPath)
+                    # the mutation engine explores around the incumbent, drop proposals based on the previous one:
+                    if not engine.isJoint:
+                        proposals = []
+        writeIterationSummary(self.params)
+        getResultsStore(self.params).exportNumpy(os.path.join(self.params.outputPath, "OptimizationResults.npz"))
+        collectArtifacts(self.params, [bestConfig])
+
+
+class ScreeningWorkflow(WorkflowRunner):
+    """
+    Morris screening: evaluate a budget of one-parameter-at-a-time trajectories through the parameter
+    ranges on all training samples and write the parameter effects and the pruned parameter set
+    """
+
+    def __init__(self, params):
+        self.params = params
+
+    def workflow(self):
+        self.params.iteration = "Screening"
+        iterationPath = os.path.join(self.params.outputPath, "Iteration_" + str(self.params.iteration))
+        ensureDir(iterationPath)
+        baseConfig = readModelParameters(os.path.join(self.params.configPath, "SomaticCallerParameters.json"))
+        parameterNames = sorted(self.params.modelParametersSet)
+        for name in parameterNames:
+            if name not in baseConfig:
+                sys.exit("Parameter %s does not exist in configuration file %s\n" % (name, os.path.join(self.params.configPath, "SomaticCallerParameters.json")))
+        # the design of an interrupted screening is reused:
+        designPath = os.path.join(iterationPath, "ScreeningDesign.json")
+        if os.path.exists(designPath):
+            with open(designPath) as designFile:
+                design = json.load(designFile)
+        else:
+            design = morrisDesign(parameterNames, self.params.screeningTrajectories, self.params.screeningLevels, self.params.searchSeed or 0)
+            writeModelParameters(designPath + ".tmp", design)
+            os.rename(designPath + ".tmp", designPath)
+        steps = []
+        realizedPoints = []
+        for pointIndex, point in enumerate(getDesignPoints(design)):
+            parameterConfig = dict(baseConfig)
+            realizedPoint = []
+            for name, unitValue in zip(design["parameters"], point):
+                parameterValueMin, parameterValueMax = self.params.modelParametersSet[name]
+                parameterConfig[name] = roundParameterValue(parameterValueMin + unitValue * (parameterValueMax - parameterValueMin), parameterValueMin, parameterValueMax)
+                # a parameter fixed to a single value never changes and has no elementary effects:
+                realizedPoint.append(toUnitValue(parameterConfig[name], parameterValueMin, parameterValueMax))
+            steps.append(("Parameter_Point_" + str(pointIndex), "Point", pointIndex, parameterConfig))
+            realizedPoints.append(realizedPoint)
+        journal = getJournal(self.params)
+        if journal.state.getProposals(self.params.iteration) is None:
+            journal.recordProposals(self.params.iteration, steps)
+        print "Screening %i parameters with %i trajectories: %i evaluations" % (len(parameterNames), len(design["trajectories"]), len(steps))
+        pointTasks = []
+        for parameterStep, stepParameter, stepParameterValue, parameterConfig in steps:
+            self.params.currentParameter = stepParameter
+            self.params.currentParameterValue = stepParameterValue
+            registerParameterStep(self.params, parameterStep, stepParameter, stepParameterValue, parameterConfig)
+            pointTasks.append(self.addWorkflowTask("ScreeningPoint_" + str(stepParameterValue), FullWorkflow(self.params)))
+        if self.waitForTasks(pointTasks) != 0:
+            raise Exception("Evaluations of the screening design failed")
+        metrics = []
+        for parameterStep, stepParameter, stepParameterValue, parameterConfig in steps:
+            sampleResults = readStepSampleResults(self.params, parameterStep)
+            metrics.append((scoreAccuracies([accuracy for accuracy, directionAccuracy in sampleResults.itervalues()]),
+                            numpy.mean([directionAccuracy for accuracy, directionAccuracy in sampleResults.itervalues()])))
+        summary = summarizeEffects(elementaryEffects(design, realizedPoints, metrics), self.params.modelParametersSet, self.params.screeningThreshold)
+        writeScreeningResults(os.path.join(self.params.outputPath, EFFECTS_FILE), os.path.join(self.params.outputPath, SCREENED_PARAMETERS_FILE), summary)
+        for line in formatSummary(summary):
+            print line
+        writeIterationSummary(self.params)
 
 
 class OptimizeSomaticCanvasFullWorkflow(WorkflowRunner):
@@ -322,21 +1043,22 @@ class OptimizeSomaticCanvasFullWorkflow(WorkflowRunner):
         self.params.otimizationStep = 1
 
     def workflow(self):     
-        totalIterations = 40
-        currentIteration = 1
-        optimizeWorkflows = list()
-        parseWorkflows = list()
-        taskID = "OptimizeSomaticCanvasWorkflow_0"
-        self.params.iteration = 0
-        print taskID
-        optimizeWorkflows.append(self.addWorkflowTask(taskID, OptimizeSomaticCanvasWorkflow(self.params)))
-        taskID = "ParseOptimizeSomaticCanvasWorkflow_0" 
-        print taskID
-        parseWorkflows.append(self.addWorkflowTask(taskID, ParseOptimizeSomaticCanvasWorkflow(self.params), optimizeWorkflows[currentIteration-1]))
+        totalIterations = getattr(self.params, "totalIterations", 40)
+        # iterations that selected their configuration before a restart are not run again:
+        currentIteration = getJournal(self.params).state.getCompletedIterations()
+        if currentIteration > 0:
+            print "Resuming after iteration %i from %s" % (currentIteration - 1, getJournalPath(self.params.outputPath))
+            restoreSelectedParameters(self.params, currentIteration - 1)
+            finishPendingCollection(self.params)
+            if getattr(self.params, "lowFidelityInputs", None) is not None:
+                finishPendingCollection(getLowFidelityParams(self.params))
+        parseWorkflow = None
         while (currentIteration < totalIterations):
             self.params.iteration = currentIteration
             taskID = "OptimizeSomaticCanvasWorkflow_" + str(currentIteration)
-            optimizeWorkflows.append(self.addWorkflowTask(taskID, OptimizeSomaticCanvasWorkflow(self.params), dependencies = parseWorkflows[currentIteration-1]))
+            print taskID
+            optimizeWorkflow = self.addWorkflowTask(taskID, OptimizeSomaticCanvasWorkflow(self.params), dependencies = parseWorkflow)
             taskID = "ParseOptimizeSomaticCanvasWorkflow_" + str(currentIteration)
-            parseWorkflows.append(self.addWorkflowTask(taskID, ParseOptimizeSomaticCanvasWorkflow(self.params), dependencies = optimizeWorkflows[currentIteration]))
+            print taskID
+            parseWorkflow = self.addWorkflowTask(taskID, ParseOptimizeSomaticCanvasWorkflow(self.params), dependencies = optimizeWorkflow)
             currentIteration += 1
\ No newline at end of file
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Native local executor of the optimizer workflows (--mode native).
+
+Runs the same WorkflowRunner classes as pyflow local mode, in-process: command tasks are shell
+subprocesses started as soon as their dependencies are complete and the core and memory budget
+allows, and workflow tasks run their workflow() method in a thread, as in pyflow. Task state is
+kept in memory only, task completions wake waiting workflows immediately instead of being polled
+and task output is collected in a single log file. Retries follow pyflow: a failed task is
+retried up to retryMax times, retryWait seconds apart and within retryWindow seconds of its first
+start, and only with retryMode "all" since this is a local mode. After the first task error no new
+tasks are started: the tasks that have not started fail, running ones are waited for and run()
+returns 1.
+"""
+import os
+import sys
+import copy
+import time
+import signal
+import threading
+import subprocess
+
+WAIT_TIMEOUT = 1.0
+
+
+class NativeTask:
+
+    def __init__(self, label, namespace, command, workflow, dependencies, memMb, nCores, retry):
+        self.label = label
+        self.namespace = namespace
+        self.command = command
+        self.workflow = workflow
+        self.dependencies = dependencies
+        self.memMb = memMb
+        self.nCores = nCores
+        self.retryMax, self.retryWait, self.retryWindow, self.retryMode = retry
+        self.state = "waiting"
+        self.attempts = 0
+        self.firstStart = None
+        self.notBefore = 0
+        self.process = None
+        self.isWorkflowReturned = False
+
+
+def toLabels(labels):
+    if labels is None:
+        return []
+    if isinstance(labels, basestring):
+        return [labels]
+    return list(labels)
+
+
+class NativeExecutor:
+    """
+    Runs a WorkflowRunner and its sub-workflows with a bounded number of cores and memory
+    """
+
+    def __init__(self, nCores, memMb, logPath, retryMax=2, retryWait=90, retryWindow=360, retryMode="nonlocal"):
+        self.nCores = nCores
+        self.memMb = memMb
+        self.logPath = logPath
+        self.retry = (retryMax, retryWait, retryWindow, retryMode)
+        self.tasks = {}
+        # labels of the tasks added in each namespace, of the waiting tasks and of the workflow tasks running:
+        self.children = {}
+        self.waiting = []
+        self.runningWorkflows = []
+        self.nRunning = 0
+        self.freeCores = nCores
+        self.freeMemMb = memMb
+        self.isSubmissionActive = True
+        self.condition = threading.Condition()
+        self.logLock = threading.Lock()
+
+    def getFullLabel(self, namespace, label):
+        return namespace + "+" + label if namespace else label
+
+    def bind(self, workflow, namespace):
+        """
+        Route the task methods of a workflow instance to this executor
+        """
+        workflow.addTask = lambda label, command=None, **options: self.addTask(namespace, label, command, **options)
+        workflow.addWorkflowTask = lambda label, workflowRunnerInstance, dependencies=None: self.addWorkflowTask(namespace, label, workflowRunnerInstance, dependencies)
+        workflow.waitForTasks = lambda labels=None: self.waitForTasks(namespace, labels)
+        workflow.waitForAnyTask = lambda labels: self.waitForAnyTask(namespace, labels)
+        workflow.isTaskComplete = lambda label: self.tasks[self.getFullLabel(namespace, label)].state == "complete"
+
+    def addNativeTask(self, namespace, label, command, workflow, dependencies, memMb, nCores, retry):
+        fullLabel = self.getFullLabel(namespace, label)
+        with self.condition:
+            if fullLabel in self.tasks:
+                raise Exception("Task label '%s' is already in use" % fullLabel)
+            for dependency in dependencies:
+                if dependency not in self.tasks:
+                    raise Exception("Task '%s' depends on the unknown task '%s'" % (fullLabel, dependency))
+            self.tasks[fullLabel] = NativeTask(fullLabel, namespace, command, workflow, dependencies, memMb, nCores, retry)
+            self.children.setdefault(namespace, []).append(fullLabel)
+            self.waiting.append(fullLabel)
+            self.condition.notifyAll()
+        return label
+
+    def addTask(self, namespace, label, command, memMb=None, nCores=1, dependencies=None, retryMax=None, retryWait=None, retryWindow=None, retryMode=None, isForceLocal=False, **options):
+        memMb = memMb or 0
+        if nCores > self.nCores or memMb > self.memMb:
+            raise Exception("Task '%s' requests %i cores and %i MB, more than the %i cores and %i MB available" % (label, nCores, memMb, self.nCores, self.memMb))
+        retry = tuple(value if value is not None else default for value, default in zip((retryMax, retryWait, retryWindow, retryMode), self.retry))
+        dependencies = [self.getFullLabel(namespace, dependency) for dependency in toLabels(dependencies)]
+        return self.addNativeTask(namespace, label, command, None, dependencies, memMb, nCores, retry)
+
+    def addWorkflowTask(self, namespace, label, workflowRunnerInstance, dependencies=None):
+        # as in pyflow, the sub-workflow runs on a copy made when it is added:
+        workflow = copy.deepcopy(workflowRunnerInstance)
+        self.bind(workflow, self.getFullLabel(namespace, label))
+        dependencies = [self.getFullLabel(namespace, dependency) for dependency in toLabels(dependencies)]
+        return self.addNativeTask(namespace, label, None, workflow, dependencies, 0, 0, self.retry)
+
+    def isDone(self, fullLabel):
+        return self.tasks[fullLabel].state in ("complete", "error")
+
+    def getWaitedLabels(self, namespace, labels):
+        if labels is None:
+            return list(self.children.get(namespace, []))
+        return [self.getFullLabel(namespace, label) for label in toLabels(labels)]
+
+    def waitForTasks(self, namespace, labels=None):
+        """
+        pyflow's waitForTasks(): 1 if any of the tasks failed, 0 otherwise
+        """
+        with self.condition:
+            waitedLabels = self.getWaitedLabels(namespace, labels)
+            while not all(self.isDone(fullLabel) for fullLabel in waitedLabels):
+                self.condition.wait(WAIT_TIMEOUT)
+            return 1 if any(self.tasks[fullLabel].state == "error" for fullLabel in waitedLabels) else 0
+
+    def waitForAnyTask(self, namespace, labels):
+        """
+        Labels of the completed tasks among labels, as soon as there is one
+        """
+        with self.condition:
+            while True:
+                completed = [label for label in labels if self.tasks[self.getFullLabel(namespace, label)].state == "complete"]
+                if completed:
+                    return completed
+                if not self.isSubmissionActive:
+                    raise Exception("Task submission stopped while waiting for: %s" % (",".join(labels)))
+                self.condition.wait(WAIT_TIMEOUT)
+
+    def log(self, label, message):
+        with self.logLock:
+            with open(self.logPath, "a") as logFile:
+                for line in message.splitlines():
+                    logFile.write("[%s] %s\n" % (label, line))
+
+    def runCommand(self, task):
+        output = ""
+        try:
+            task.process = subprocess.Popen(task.command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+            output = task.process.communicate()[0]
+            exitStatus = task.process.returncode
+        except OSError, error:
+            output, exitStatus = str(error), 127
+        if output:
+            self.log(task.label, output)
+        with self.condition:
+            self.freeCores += task.nCores
+            self.freeMemMb += task.memMb
+            self.nRunning -= 1
+            if exitStatus == 0:
+                task.state = "complete"
+            else:
+                isRetried = task.retryMode == "all" and task.attempts <= task.retryMax and (task.retryWindow <= 0 or time.time() - task.firstStart < task.retryWindow)
+                print >> sys.stderr, "Task %s failed with exit status %i (attempt %i)%s" % (task.label, exitStatus, task.attempts, ", retrying" if isRetried else "")
+                if isRetried:
+                    task.state = "waiting"
+                    self.waiting.append(task.label)
+                    task.notBefore = time.time() + task.retryWait
+                else:
+                    self.failTask(task)
+            self.condition.notifyAll()
+
+    def runWorkflow(self, task):
+        try:
+            task.workflow.workflow()
+        except Exception:
+            import traceback
+            self.log(task.label, traceback.format_exc())
+            print >> sys.stderr, "Workflow task %s failed:\n%s" % (task.label, traceback.format_exc())
+            with self.condition:
+                self.runningWorkflows.remove(task.label)
+                self.nRunning -= 1
+                self.failTask(task)
+                self.condition.notifyAll()
+            return
+        with self.condition:
+            task.isWorkflowReturned = True
+            self.condition.notifyAll()
+
+    def failTask(self, task):
+        task.state = "error"
+        self.isSubmissionActive = False
+
+    def startTask(self, task):
+        task.state = "running"
+        self.nRunning += 1
+        if task.workflow is not None:
+            self.runningWorkflows.append(task.label)
+            thread = threading.Thread(target=self.runWorkflow, args=(task,))
+        else:
+            task.attempts += 1
+            if task.firstStart is None:
+                task.firstStart = time.time()
+            self.freeCores -= task.nCores
+            self.freeMemMb -= task.memMb
+            thread = threading.Thread(target=self.runCommand, args=(task,))
+        thread.daemon = True
+        thread.start()
+
+    def schedule(self):
+        """
+        Complete the workflow tasks whose tasks are all done, start the ready tasks that fit the free
+        resources and return the time of the next retry, called with the condition held
+        """
+        for fullLabel in list(self.runningWorkflows):
+            task = self.tasks[fullLabel]
+            children = self.children.get(fullLabel, [])
+            if task.isWorkflowReturned and all(self.isDone(child) for child in children):
+                self.runningWorkflows.remove(fullLabel)
+                self.nRunning -= 1
+                if any(self.tasks[child].state == "error" for child in children):
+                    self.failTask(task)
+                else:
+                    task.state = "complete"
+                self.condition.notifyAll()
+        now = time.time()
+        nextRetry = None
+        waiting = []
+        for fullLabel in self.waiting:
+            task = self.tasks[fullLabel]
+            # as in pyflow, tasks that have not started when submission stops are errors, so that the workflows waiting for them return:
+            if not self.isSubmissionActive or any(self.tasks[dependency].state == "error" for dependency in task.dependencies):
+                self.failTask(task)
+                self.condition.notifyAll()
+                continue
+            if all(self.tasks[dependency].state == "complete" for dependency in task.dependencies):
+                if task.notBefore > now:
+                    nextRetry = min(nextRetry or task.notBefore, task.notBefore)
+                elif task.nCores <= self.freeCores and task.memMb <= self.freeMemMb:
+                    self.startTask(task)
+                    continue
+            waiting.append(fullLabel)
+        self.waiting = waiting
+        return nextRetry
+
+    def run(self, workflow):
+        """
+        Run workflow to completion: 0 when every task completed, 1 otherwise
+        """
+        self.bind(workflow, "root")
+        self.addNativeTask("", "root", None, workflow, [], 0, 0, self.retry)
+        root = self.tasks["root"]
+        try:
+            with self.condition:
+                while True:
+                    nextRetry = self.schedule()
+                    if self.isDone("root") or (not self.isSubmissionActive and self.nRunning == 0):
+                        break
+                    timeout = WAIT_TIMEOUT if nextRetry is None else max(0.0, min(WAIT_TIMEOUT, nextRetry - time.time()))
+                    self.condition.wait(timeout)
+        except KeyboardInterrupt:
+            for task in self.tasks.values():
+                if task.state == "running" and task.process is not None and task.process.returncode is None:
+                    try:
+                        os.killpg(task.process.pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+            raise
+        return 0 if root.state == "complete" else 1
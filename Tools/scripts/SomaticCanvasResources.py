@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Memory and core sizing of optimizer tasks.
+
+The memory of a CanvasSomaticCaller or EvaluateCNV task is predicted from the size of the inputs
+of its sample: a linear model of peak RSS against input size is fitted on the telemetry of this
+and previous runs, and the peak RSS already observed on the sample itself is a floor of the
+prediction. Samples are sized from their own peak RSS while too few samples have telemetry to
+fit the model, and from a conservative prior in the input size without any telemetry. Cores are sized
+from the CPU time over wall time observed for each task kind.
+"""
+import os
+import math
+import argparse
+import threading
+import numpy
+from SomaticCanvasTelemetry import readRecords, readNewRecords, getTelemetryFile
+
+MIN_TASK_MEMORY_MB = 1024
+# prior of a task without telemetry: base MB + factor * input MB
+PRIOR_MEMORY = {"CanvasSomaticCaller": (2048, 4.0), "EvaluateCNV": (1024, 2.0)}
+# gzip input sizes are scaled to their approximate decompressed size:
+GZIP_EXPANSION = 4.0
+# predictions are raised by this margin and rounded up to a multiple of MEMORY_STEP_MB:
+MEMORY_MARGIN = 1.25
+MEMORY_STEP_MB = 256
+MIN_FITTED_SAMPLES = 3
+# a failed task that peaked above this fraction of its request is taken as out of memory:
+OOM_FRACTION = 0.9
+
+_sizingModels = {}
+_sizingModelsLock = threading.Lock()
+
+
+def inputSizeMb(paths):
+    size = 0.0
+    for path in paths:
+        if os.path.isfile(path):
+            size += os.path.getsize(path) * (GZIP_EXPANSION if path.endswith(".gz") else 1.0)
+    return size / (1 << 20)
+
+
+def getTaskInputs(params, kind, sampleIndex):
+    """
+    Input files driving the memory of a task of a sample
+    """
+    if kind == "CanvasSomaticCaller":
+        return [os.path.join(params.sampleDataPath[sampleIndex], "Tumor.partitioned"), os.path.join(params.sampleDataPath[sampleIndex], "VFResultsTumor.txt.gz")]
+    return [params.truthFiles[sampleIndex], params.exlcudeRegions[sampleIndex]]
+
+
+def roundUpMemory(memMb):
+    return int(math.ceil(memMb / float(MEMORY_STEP_MB))) * MEMORY_STEP_MB
+
+
+class TaskSizingModel:
+    """
+    Peak RSS model per task kind fitted on telemetry records
+    """
+
+    def __init__(self, records, maxMemMb, maxCores):
+        self.maxMemMb = maxMemMb
+        self.maxCores = maxCores
+        self.observedMemMb = {}
+        self.completedMemMb = {}
+        self.cpuUtilization = {}
+        self.fits = {}
+        # input sizes per task kind and sample, kept across refits:
+        self.inputMb = {}
+        self.addRecords(records)
+
+    def addRecords(self, records):
+        """
+        Update the observations with more telemetry records; the fits are redone on next use
+        """
+        for record in records:
+            key = (record["kind"], record["sample"])
+            observed = record["maxRssMb"]
+            if record["exitStatus"] == 0:
+                self.completedMemMb[key] = max(self.completedMemMb.get(key, 0), observed)
+            elif record.get("memMb") and observed >= OOM_FRACTION * record["memMb"]:
+                # killed at its limit, the task needs more than it got:
+                observed = 2 * record["memMb"]
+            self.observedMemMb[key] = max(self.observedMemMb.get(key, 0), observed)
+            if record["exitStatus"] == 0 and record["wallSeconds"] > 0:
+                utilization = (record["userSeconds"] + record["systemSeconds"]) / float(record["wallSeconds"])
+                self.cpuUtilization.setdefault(record["kind"], []).append(utilization)
+        if records:
+            self.fits = {}
+
+    def fit(self, kind, sampleInputMb):
+        """
+        Least squares (intercept, slope) of peak RSS against input size over the samples with completed tasks,
+        None with too few samples
+        """
+        if kind not in self.fits:
+            points = [(sampleInputMb[sample], memMb) for (recordKind, sample), memMb in self.completedMemMb.iteritems() if recordKind == kind and sample in sampleInputMb]
+            self.fits[kind] = None
+            if len(set(x for x, y in points)) >= MIN_FITTED_SAMPLES:
+                slope, intercept = numpy.polyfit([x for x, y in points], [y for x, y in points], 1)
+                if slope < 0:
+                    slope, intercept = 0.0, max(y for x, y in points)
+                self.fits[kind] = (intercept, slope)
+        return self.fits[kind]
+
+    def memory(self, kind, sample, sampleInputMb):
+        fitted = self.fit(kind, sampleInputMb)
+        observed = self.observedMemMb.get((kind, sample))
+        if fitted is not None:
+            predicted = MEMORY_MARGIN * max(fitted[0] + fitted[1] * sampleInputMb[sample], observed)
+        elif observed is not None:
+            predicted = MEMORY_MARGIN * observed
+        else:
+            base, factor = PRIOR_MEMORY[kind]
+            predicted = base + factor * sampleInputMb[sample]
+        return min(max(roundUpMemory(predicted), MIN_TASK_MEMORY_MB), self.maxMemMb)
+
+    def cores(self, kind):
+        utilization = self.cpuUtilization.get(kind)
+        if not utilization:
+            return 1
+        return min(max(int(math.ceil(numpy.median(utilization) - 0.25)), 1), self.maxCores)
+
+
+def readTelemetryHistory(params):
+    records = []
+    for telemetryFile in getattr(params, "telemetryHistory", []):
+        records += readRecords(telemetryFile)
+    return records
+
+
+def getTaskSizingModel(params):
+    """
+    Sizing model of the run in outputPath shared by the workflows of this process, updated with
+    the telemetry records appended since its last use
+    """
+    with _sizingModelsLock:
+        if params.outputPath not in _sizingModels:
+            _sizingModels[params.outputPath] = [TaskSizingModel(readTelemetryHistory(params), params.maxTaskMemoryMb, params.maxTaskCores), 0]
+        model, offset = _sizingModels[params.outputPath]
+        records, _sizingModels[params.outputPath][1] = readNewRecords(getTelemetryFile(params), offset)
+        model.addRecords(records)
+        return model
+
+
+def getTaskResources(params, kind, sampleIndex):
+    """
+    (memMb, nCores) of a task of a sample, the fixed memoryCore and a single core unless adaptive sizing is enabled
+    """
+    if getattr(params, "taskSizing", "fixed") != "adaptive":
+        return params.memoryCore, 1
+    model = getTaskSizingModel(params)
+    if kind not in model.inputMb:
+        model.inputMb[kind] = dict((params.sampleNames[i], inputSizeMb(getTaskInputs(params, kind, i))) for i in range(len(params.sampleNames)))
+    return model.memory(kind, params.sampleNames[sampleIndex], model.inputMb[kind]), model.cores(kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the peak memory per sample and the cores per task kind observed in telemetry files")
+    parser.add_argument("telemetryFiles", nargs="+", help="Telemetry.jsonl files of optimizer runs")
+    parser.add_argument("--maxTaskCores", dest="maxTaskCores", type=int, default=4, help="Upper bound of the cores of a task (default 4)")
+    options = parser.parse_args()
+    records = []
+    for telemetryFile in options.telemetryFiles:
+        records += readRecords(telemetryFile)
+    model = TaskSizingModel(records, None, options.maxTaskCores)
+    for (kind, sample), memMb in sorted(model.observedMemMb.iteritems()):
+        print "%s\t%s\tpeak RSS %.0f MB" % (kind, sample, memMb)
+    for kind in sorted(model.cpuUtilization):
+        print "%s\t%i cores" % (kind, model.cores(kind))
+
+
+if __name__ == "__main__":
+    main()
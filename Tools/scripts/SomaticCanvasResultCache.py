@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache of CanvasSomaticCaller and EvaluateCNV results.
+
+Entries are keyed on a canonical hash of everything that determines the output of a run:
+- CanvasSomaticCaller: normalized parameter JSON, sample inputs, reference and caller binary
+- EvaluateCNV: produced CNV.vcf.gz, truth set, excluded regions and EvaluateCNV binary
+The cache directory is safe to share between concurrent optimizer runs and is kept
+under a size budget by least-recently-used eviction.
+"""
+import os
+import sys
+import json
+import math
+import fcntl
+import shutil
+import hashlib
+import tempfile
+
+CALLER_FILES = ["CNV.vcf.gz", "CNV.vcf.gz.tbi"]
+EVALUATE_FILES = ["Results.txt"]
+
+_fileHashes = {}
+
+
+def normalizeParameterValue(value):
+    """
+    Map equivalent parameter values (1, 1.0, "1.0") onto a single representation
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, basestring):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, (int, long, float)):
+        # inf and nan have no integer value:
+        if math.isinf(value) or math.isnan(value):
+            return repr(float(value))
+        if float(value) == int(value):
+            return int(value)
+        return repr(float(value))
+    return value
+
+
+def canonicalParameterJson(parameterConfig):
+    """
+    Serialize a SomaticCallerParameters configuration independently of key order and number formatting
+    """
+    normalized = dict((key, normalizeParameterValue(value)) for key, value in parameterConfig.iteritems())
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+
+
+def hashConfig(parameterConfig):
+    return hashlib.sha1(canonicalParameterJson(parameterConfig)).hexdigest()
+
+
+def hashFile(path):
+    """
+    sha1 of file content, memoized on (path, size, mtime)
+    """
+    stat = os.stat(path)
+    memoKey = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memoKey not in _fileHashes:
+        digest = hashlib.sha1()
+        with open(path, "rb") as inFile:
+            for block in iter(lambda: inFile.read(1 << 20), ""):
+                digest.update(block)
+        _fileHashes[memoKey] = digest.hexdigest()
+    return _fileHashes[memoKey]
+
+
+def describeInput(path):
+    """
+    Identify an input file by its content, hashed once per (path, size, mtime): a copied corpus keeps
+    its keys and an input regenerated in place changes them
+    """
+    if os.path.exists(path):
+        return hashFile(path)
+    return [os.path.abspath(path), None]
+
+
+def describeReference(referenceFolder):
+    """
+    Identify the reference folder by what CanvasSomaticCaller takes from it: it reads the contigs of
+    GenomeSize.xml and names genome.fa in the VCF header, the FASTA is identified by its size
+    """
+    fastaPath = os.path.join(referenceFolder, "genome.fa")
+    return [describeInput(os.path.join(referenceFolder, "GenomeSize.xml")),
+            os.path.getsize(fastaPath) if os.path.exists(fastaPath) else None]
+
+
+def callerCacheKey(params, sampleIndex, parameterConfigFile):
+    with open(parameterConfigFile) as configFile:
+        parameterConfig = json.load(configFile)
+    canvasBinary = os.path.join(params.executablePath, "CanvasSomaticCaller.exe")
+    keyData = [
+        "CanvasSomaticCaller",
+        canonicalParameterJson(parameterConfig),
+        hashFile(canvasBinary) if os.path.exists(canvasBinary) else canvasBinary,
+        # read from the folder of the binary, as no other path is given on the command line:
+        describeInput(os.path.join(params.executablePath, "QualityScoreParameters.json")),
+        describeInput(os.path.join(params.sampleDataPath[sampleIndex], "VFResultsTumor.txt.gz")),
+        describeInput(os.path.join(params.sampleDataPath[sampleIndex], "Tumor.partitioned")),
+        describeInput(params.sampleFilterBed[sampleIndex]),
+        describeReference(params.sampleReferenceGenome[sampleIndex]),
+        describeInput(params.truthFiles[sampleIndex]),
+    ]
+    return hashlib.sha1(json.dumps(keyData)).hexdigest()
+
+
+def evaluateCacheKey(params, sampleIndex, cnvCallsPath):
+    keyData = [
+        "EvaluateCNV",
+        hashFile(cnvCallsPath),
+        hashFile(params.evaluateCNVPath) if os.path.exists(params.evaluateCNVPath) else params.evaluateCNVPath,
+        describeInput(params.truthFiles[sampleIndex]),
+        describeInput(params.exlcudeRegions[sampleIndex]),
+    ]
+    return hashlib.sha1(json.dumps(keyData)).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded, content-addressed store of result files shared between optimizer runs
+    """
+
+    def __init__(self, cacheDir, maxSizeMb):
+        self.cacheDir = cacheDir
+        self.maxSizeBytes = int(maxSizeMb) << 20
+        if not os.path.isdir(cacheDir):
+            try:
+                os.makedirs(cacheDir)
+            except OSError:
+                if not os.path.isdir(cacheDir):
+                    raise
+
+    def entryPath(self, kind, key):
+        return os.path.join(self.cacheDir, kind, key[0:2], key)
+
+    def _lock(self):
+        lockFile = open(os.path.join(self.cacheDir, ".lock"), "a")
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        return lockFile
+
+    def contains(self, kind, key):
+        return os.path.exists(os.path.join(self.entryPath(kind, key), "entry.json"))
+
+    def restore(self, kind, key, outputPath):
+        """
+        Link or copy the files of a cached entry into outputPath, return False on a cache miss
+        """
+        entryPath = self.entryPath(kind, key)
+        manifestPath = os.path.join(entryPath, "entry.json")
+        # the entry is not evicted while its files are linked:
+        lockFile = self._lock()
+        try:
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+            for fileName in manifest["files"]:
+                target = os.path.join(outputPath, fileName)
+                if os.path.exists(target):
+                    os.remove(target)
+                try:
+                    os.link(os.path.join(entryPath, fileName), target)
+                except OSError:
+                    shutil.copy2(os.path.join(entryPath, fileName), target)
+            # mark entry as recently used:
+            os.utime(manifestPath, None)
+        except (IOError, OSError, ValueError):
+            return False
+        finally:
+            lockFile.close()
+        return True
+
+    def store(self, kind, key, outputPath, fileNames):
+        """
+        Copy result files from outputPath into the cache; existing entries are only marked as used
+        """
+        if self.contains(kind, key):
+            os.utime(os.path.join(self.entryPath(kind, key), "entry.json"), None)
+            return
+        fileNames = [fileName for fileName in fileNames if os.path.exists(os.path.join(outputPath, fileName))]
+        if not fileNames:
+            return
+        kindPath = os.path.join(self.cacheDir, kind)
+        if not os.path.isdir(kindPath):
+            try:
+                os.makedirs(kindPath)
+            except OSError:
+                pass
+        tmpPath = tempfile.mkdtemp(prefix=".tmp", dir=kindPath)
+        size = 0
+        for fileName in fileNames:
+            shutil.copy2(os.path.join(outputPath, fileName), os.path.join(tmpPath, fileName))
+            size += os.path.getsize(os.path.join(tmpPath, fileName))
+        with open(os.path.join(tmpPath, "entry.json"), "w") as manifestFile:
+            json.dump({"files": fileNames, "size": size}, manifestFile)
+        entryPath = self.entryPath(kind, key)
+        lockFile = self._lock()
+        try:
+            if os.path.exists(entryPath):
+                shutil.rmtree(tmpPath)
+            else:
+                if not os.path.isdir(os.path.dirname(entryPath)):
+                    os.makedirs(os.path.dirname(entryPath))
+                os.rename(tmpPath, entryPath)
+        finally:
+            lockFile.close()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits into its size budget
+        """
+        lockFile = self._lock()
+        try:
+            entries = []
+            totalSize = 0
+            for kind in os.listdir(self.cacheDir):
+                kindPath = os.path.join(self.cacheDir, kind)
+                if kind.startswith(".") or not os.path.isdir(kindPath):
+                    continue
+                for prefix in os.listdir(kindPath):
+                    prefixPath = os.path.join(kindPath, prefix)
+                    if prefix.startswith(".") or not os.path.isdir(prefixPath):
+                        continue
+                    for key in os.listdir(prefixPath):
+                        manifestPath = os.path.join(prefixPath, key, "entry.json")
+                        try:
+                            with open(manifestPath) as manifestFile:
+                                size = json.load(manifestFile)["size"]
+                            entries.append((os.path.getmtime(manifestPath), size, os.path.join(prefixPath, key)))
+                        except (IOError, OSError, ValueError, KeyError):
+                            continue
+                        totalSize += size
+            entries.sort()
+            for lastUsed, size, entryPath in entries:
+                if totalSize <= self.maxSizeBytes:
+                    break
+                shutil.rmtree(entryPath, ignore_errors=True)
+                totalSize -= size
+        finally:
+            lockFile.close()
+        return totalSize
+
+
+def getResultCache(params):
+    """
+    Result cache configured for this run or None when caching is disabled
+    """
+    if getattr(params, "cacheDir", None) is None:
+        return None
+    return ResultCache(params.cacheDir, params.cacheSizeMb)
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] != "evict":
+        print "Usage: SomaticCanvasResultCache.py evict CacheDir MaxSizeMb"
+        sys.exit(2)
+    print ResultCache(sys.argv[2], sys.argv[3]).evict()
+
+
+if __name__ == "__main__":
+    main()
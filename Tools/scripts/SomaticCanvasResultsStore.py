@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Transactional store of the EvaluateCNV metrics of a somatic model optimization run.
+
+A single SQLite database in WAL mode holds every metric per (iteration, parameter step, sample)
+together with the parameter configuration of every step. Concurrent parse tasks upsert their rows,
+so re-parsing a sample after a restart never duplicates it. Rankings, medians and means are
+computed with numpy over the whole table.
+"""
+import os
+import json
+import numpy
+import sqlite3
+import argparse
+
+EVALUATE_CNV_METRICS = [
+    "Accuracy", "DirectionAccuracy", "F-score", "Recall", "DirectionRecall", "Precision", "DirectionPrecision",
+    "GainRecall", "GainDirectionRecall", "GainPrecision", "GainDirectionPrecision",
+    "LossRecall", "LossDirectionRecall", "LossPrecision", "LossDirectionPrecision",
+    "MeanEventAccuracy", "MedianEventAccuracy", "VariantEventsCalled", "VariantBasesCalled",
+    "ROIAccuracy", "ROIDirectionAccuracy",
+]
+SUMMARY_METRICS = ["Accuracy", "DirectionAccuracy", "Recall", "Precision"]
+
+
+def parseEvaluateCNVResults(inputPath):
+    """
+    Metrics of an EvaluateCNV results file; for repeated sections the last one (all variants) wins
+    """
+    metrics = {}
+    with open(inputPath) as inFile:
+        for fileLine in inFile:
+            line = fileLine.strip().split("\t")
+            if len(line) < 2 or line[0] not in EVALUATE_CNV_METRICS:
+                continue
+            try:
+                metrics[line[0]] = float(line[1])
+            except ValueError:
+                metrics[line[0]] = None
+    return metrics
+
+
+class ResultsTable:
+    """
+    Metrics of (iteration, step, sample) rows as a dense numpy array, grouped by parameter step
+    """
+
+    def __init__(self, iterations, steps, samples, values):
+        self.iterations = numpy.array(iterations, dtype=object)
+        self.steps = numpy.array(steps, dtype=object)
+        self.samples = numpy.array(samples, dtype=object)
+        self.values = numpy.array(values, dtype=float).reshape(len(samples), len(EVALUATE_CNV_METRICS))
+        stepKeys = numpy.array([iteration + "\t" + step for iteration, step in zip(iterations, steps)], dtype=object)
+        self.stepKeys, self.stepIndex = numpy.unique(stepKeys, return_inverse=True) if len(stepKeys) else (numpy.array([], dtype=object), numpy.array([], dtype=int))
+        self.stepIterations = numpy.array([stepKey.split("\t")[0] for stepKey in self.stepKeys], dtype=object)
+        self.stepNames = numpy.array([stepKey.split("\t")[1] for stepKey in self.stepKeys], dtype=object)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def column(self, metric):
+        return self.values[:, EVALUATE_CNV_METRICS.index(metric)]
+
+    def select(self, mask):
+        return ResultsTable(self.iterations[mask], self.steps[mask], self.samples[mask], self.values[mask])
+
+    def sampleCounts(self):
+        return numpy.bincount(self.stepIndex, minlength=len(self.stepKeys))
+
+    def stepSummary(self, metric):
+        """
+        Median and mean of metric over the samples of every parameter step
+        """
+        values = self.column(metric)
+        counts = self.sampleCounts()
+        means = numpy.bincount(self.stepIndex, weights=values, minlength=len(self.stepKeys)) / numpy.maximum(counts, 1)
+        # sort rows by step, then value, and pick the middle row(s) of every step:
+        order = numpy.lexsort((values, self.stepIndex))
+        starts = numpy.cumsum(counts) - counts
+        sortedValues = values[order]
+        if len(sortedValues) == 0:
+            return means, means
+        medians = (sortedValues[starts + (counts - 1) // 2] + sortedValues[starts + counts // 2]) / 2.0
+        return medians, means
+
+    def stepScores(self):
+        """
+        Optimization objective of every parameter step: average of median and mean accuracy
+        """
+        medians, means = self.stepSummary("Accuracy")
+        return (medians + means) / 2.0
+
+    def rankSteps(self, minSamples=0):
+        """
+        Indexes of parameter steps evaluated on at least minSamples samples, best first
+        """
+        scores = self.stepScores()
+        complete = numpy.nonzero(self.sampleCounts() >= minSamples)[0]
+        return complete[numpy.argsort(-scores[complete], kind="mergesort")]
+
+
+def promoteCandidates(candidateScores, nMinimum, eta):
+    """
+    Successive-halving promotion: indexes, in candidate order, of the best 1/eta of the candidates
+    by (score, direction accuracy) and at least nMinimum of them; ties keep the earlier candidate
+    """
+    ranking = sorted(range(len(candidateScores)), key=lambda k: candidateScores[k], reverse=True)
+    nPromoted = max(int(nMinimum), int(numpy.ceil(len(candidateScores) / float(eta))))
+    return sorted(ranking[0:nPromoted])
+
+
+class ResultsStore:
+    """
+    SQLite results database of an optimization run
+    """
+
+    def __init__(self, path):
+        self.path = path
+        connection = self.connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS steps (iteration TEXT, step TEXT, parameter TEXT, value TEXT, configHash TEXT, config TEXT, PRIMARY KEY (iteration, step))")
+            connection.execute("CREATE TABLE IF NOT EXISTS metrics (iteration TEXT, step TEXT, sample TEXT, %s, PRIMARY KEY (iteration, step, sample))" % ", ".join('"%s" REAL' % metric for metric in EVALUATE_CNV_METRICS))
+        connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=600)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def recordStep(self, iteration, step, parameter, value, parameterConfig, configHash):
+        connection = self.connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?)",
+                               (str(iteration), step, parameter, json.dumps(value), configHash, json.dumps(parameterConfig, sort_keys=True)))
+        connection.close()
+
+    def recordSampleMetrics(self, iteration, step, sampleMetrics):
+        """
+        Upsert the metrics of several samples of a parameter step in one transaction
+        """
+        rows = []
+        for sampleName, metrics in sampleMetrics.iteritems():
+            rows.append([str(iteration), step, sampleName] + [metrics.get(metric) for metric in EVALUATE_CNV_METRICS])
+        connection = self.connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO metrics VALUES (%s)" % ", ".join(["?"] * (3 + len(EVALUATE_CNV_METRICS))), rows)
+        connection.close()
+
+    def loadTable(self, iteration=None, step=None):
+        query = "SELECT * FROM metrics"
+        conditions = []
+        arguments = []
+        if iteration is not None:
+            conditions.append("iteration = ?")
+            arguments.append(str(iteration))
+        if step is not None:
+            conditions.append("step = ?")
+            arguments.append(step)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        connection = self.connect()
+        rows = connection.execute(query, arguments).fetchall()
+        connection.close()
+        if not rows:
+            return ResultsTable([], [], [], numpy.zeros((0, len(EVALUATE_CNV_METRICS))))
+        columns = zip(*rows)
+        values = numpy.array([[numpy.nan if value is None else value for value in row[3:]] for row in rows], dtype=float)
+        return ResultsTable(columns[0], columns[1], columns[2], values)
+
+    def loadSteps(self, iteration=None):
+        """
+        (parameter, value, config, configHash) of every parameter step, keyed on (iteration, step)
+        """
+        query = "SELECT iteration, step, parameter, value, config, configHash FROM steps"
+        arguments = []
+        if iteration is not None:
+            query += " WHERE iteration = ?"
+            arguments.append(str(iteration))
+        connection = self.connect()
+        rows = connection.execute(query, arguments).fetchall()
+        connection.close()
+        return dict(((row[0], row[1]), (row[2], json.loads(row[3]), json.loads(row[4]), row[5])) for row in rows)
+
+    def exportNumpy(self, outFilePath):
+        """
+        Write the whole metrics table as a numpy .npz view for offline analysis
+        """
+        table = self.loadTable()
+        numpy.savez(outFilePath, iterations=table.iterations.astype(str), steps=table.steps.astype(str),
+                    samples=table.samples.astype(str), metrics=numpy.array(EVALUATE_CNV_METRICS), values=table.values)
+
+
+def getResultsStore(params):
+    """
+    Results store shared by all workflows of the run in outputPath
+    """
+    return ResultsStore(os.path.join(params.outputPath, "OptimizationResults.db"))
+
+
+def writeStepSummary(table, outFilePath, minSamples=0):
+    """
+    Tab-separated median/mean of the summary metrics for every parameter step, best first
+    """
+    summaries = [table.stepSummary(metric) for metric in SUMMARY_METRICS]
+    with open(outFilePath, "w") as outFile:
+        for stepIndex in table.rankSteps(minSamples):
+            columns = [table.stepNames[stepIndex].replace("Parameter_", "", 1)]
+            for medians, means in summaries:
+                columns += [str(medians[stepIndex]), str(means[stepIndex])]
+            outFile.write("\t".join(columns) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the parameter steps of an optimization run")
+    parser.add_argument("database", help="OptimizationResults.db of the run")
+    parser.add_argument("--iteration", dest="iteration", default=None, help="Restrict to one iteration")
+    parser.add_argument("--export", dest="export", default=None, help="Write the metrics table to this .npz file")
+    options = parser.parse_args()
+    store = ResultsStore(options.database)
+    table = store.loadTable(options.iteration)
+    steps = store.loadSteps(options.iteration)
+    scores = table.stepScores()
+    counts = table.sampleCounts()
+    for stepIndex in table.rankSteps():
+        parameter, value, parameterConfig, configHash = steps.get((table.stepIterations[stepIndex], table.stepNames[stepIndex]), ("", "", None, ""))
+        print "%s\t%s\t%s\t%s\t%i\t%.4f" % (table.stepIterations[stepIndex], table.stepNames[stepIndex], parameter, value, counts[stepIndex], scores[stepIndex])
+    if options.export is not None:
+        store.exportNumpy(options.export)
+
+
+if __name__ == "__main__":
+    main()
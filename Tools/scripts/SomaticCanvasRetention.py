@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Retention of the per-sample artifacts of an optimization run (--retention topK).
+
+Once an iteration has journaled its selection, the sample directories of the steps that are
+neither among the --retentionTopK best nor selected are removed and their CNV.vcf.gz packed into
+CallsArchive/. 'summary' reports the archive, 'extract' writes back the calls of a sample.
+"""
+import os
+import sys
+import gzip
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import numpy
+from SomaticCanvasResultsStore import getResultsStore
+from SomaticCanvasCrossValidation import getCrossValidationFolds
+from SomaticCanvasResultCache import hashConfig
+
+ARCHIVE_DIR = "CallsArchive"
+
+
+def hashCalls(callsPath):
+    """
+    sha1 of the uncompressed calls, independent of the gzip header
+    """
+    sha1 = hashlib.sha1()
+    with gzip.open(callsPath, "rb") as callsFile:
+        for block in iter(lambda: callsFile.read(1 << 20), ""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class CallsArchive:
+    """
+    Pack files of gzip'd calls and their SQLite index
+    """
+
+    def __init__(self, archivePath):
+        self.archivePath = archivePath
+        if not os.path.isdir(archivePath):
+            os.makedirs(archivePath)
+        self.path = os.path.join(archivePath, "Index.db")
+        connection = self.connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, pack TEXT, offset INTEGER, length INTEGER)")
+            connection.execute("CREATE TABLE IF NOT EXISTS calls (iteration TEXT, step TEXT, sample TEXT, hash TEXT, PRIMARY KEY (iteration, step, sample))")
+            # archived steps whose directories are not removed yet:
+            connection.execute("CREATE TABLE IF NOT EXISTS pending (iteration TEXT, step TEXT, PRIMARY KEY (iteration, step))")
+        connection.close()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=600)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def loadCollectedSteps(self):
+        connection = self.connect()
+        rows = connection.execute("SELECT iteration, step FROM pending UNION SELECT DISTINCT iteration, step FROM calls").fetchall()
+        connection.close()
+        return set((str(iteration), str(step)) for iteration, step in rows)
+
+    def loadPendingSteps(self):
+        connection = self.connect()
+        rows = connection.execute("SELECT iteration, step FROM pending").fetchall()
+        connection.close()
+        return sorted((str(iteration), str(step)) for iteration, step in rows)
+
+    def completeStep(self, iteration, step):
+        connection = self.connect()
+        with connection:
+            connection.execute("DELETE FROM pending WHERE iteration = ? AND step = ?", (str(iteration), step))
+        connection.close()
+
+    def archiveCalls(self, iteration, step, sampleCalls):
+        """
+        Append the calls of the samples of a parameter step that are not archived yet to the pack of
+        its iteration, then index them and mark the step pending in one transaction
+        """
+        connection = self.connect()
+        hashes = {}
+        blobs = []
+        packedHashes = set()
+        packName = "Iteration_%s.pack" % iteration
+        with open(os.path.join(self.archivePath, packName), "ab") as packFile:
+            for sampleName, callsPath in sorted(sampleCalls.iteritems()):
+                callsHash = hashCalls(callsPath)
+                hashes[sampleName] = callsHash
+                isArchived = connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (callsHash,)).fetchone() is not None
+                if isArchived or callsHash in packedHashes:
+                    continue
+                packedHashes.add(callsHash)
+                packFile.seek(0, os.SEEK_END)
+                offset = packFile.tell()
+                with open(callsPath, "rb") as callsFile:
+                    shutil.copyfileobj(callsFile, packFile)
+                blobs.append((callsHash, packName, offset, packFile.tell() - offset))
+            packFile.flush()
+            os.fsync(packFile.fileno())
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)", blobs)
+            connection.executemany("INSERT OR REPLACE INTO calls VALUES (?, ?, ?, ?)", [(str(iteration), step, sampleName, callsHash) for sampleName, callsHash in hashes.iteritems()])
+            connection.execute("INSERT OR REPLACE INTO pending VALUES (?, ?)", (str(iteration), step))
+        connection.close()
+
+    def extract(self, iteration, step, sampleName, outputPath):
+        connection = self.connect()
+        row = connection.execute("SELECT blobs.pack, blobs.offset, blobs.length FROM calls JOIN blobs ON calls.hash = blobs.hash WHERE iteration = ? AND step = ? AND sample = ?",
+                                 (str(iteration), step, sampleName)).fetchone()
+        connection.close()
+        if row is None:
+            raise Exception("No archived calls of sample %s in step %s of iteration %s" % (sampleName, step, iteration))
+        pack, offset, length = row
+        with open(os.path.join(self.archivePath, pack), "rb") as packFile:
+            packFile.seek(offset)
+            with open(outputPath, "wb") as outFile:
+                outFile.write(packFile.read(length))
+
+    def summary(self):
+        connection = self.connect()
+        nCalls = connection.execute("SELECT COUNT(*) FROM calls").fetchone()[0]
+        nBlobs, nBytes = connection.execute("SELECT COUNT(*), TOTAL(length) FROM blobs").fetchone()
+        nSteps = connection.execute("SELECT COUNT(*) FROM (SELECT DISTINCT iteration, step FROM calls)").fetchone()[0]
+        connection.close()
+        return nSteps, nCalls, nBlobs, nBytes
+
+
+def getCallsArchive(params):
+    return CallsArchive(os.path.join(params.outputPath, ARCHIVE_DIR))
+
+
+def selectRetainedSteps(params, selectedConfigs):
+    """
+    (iteration, step) of the retentionTopK best steps evaluated on all training samples of each fold,
+    all samples without cross-validation, and of the steps evaluating one of selectedConfigs
+    """
+    store = getResultsStore(params)
+    table = store.loadTable()
+    retained = set()
+    for foldName, trainIndices, testIndices in getCrossValidationFolds(params) or [(None, range(params.sampleSize), [])]:
+        trainTable = table.select(numpy.in1d(table.samples, [params.sampleNames[sampleIndex] for sampleIndex in trainIndices]))
+        for stepIndex in trainTable.rankSteps(len(trainIndices))[0:params.retentionTopK]:
+            retained.add((str(trainTable.stepIterations[stepIndex]), str(trainTable.stepNames[stepIndex])))
+    selectedHashes = set(hashConfig(selectedConfig) for selectedConfig in selectedConfigs)
+    for stepKey, (parameter, value, config, configHash) in store.loadSteps().iteritems():
+        if configHash in selectedHashes:
+            retained.add((str(stepKey[0]), str(stepKey[1])))
+    return retained
+
+
+def removeStepOutputs(stepPath):
+    """
+    Remove everything of a parameter step but its configuration, which stays next to the archived calls
+    """
+    if not os.path.isdir(stepPath):
+        return
+    for name in os.listdir(stepPath):
+        if name == "SomaticCallerParameters.json":
+            continue
+        path = os.path.join(stepPath, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def finishPendingCollection(params):
+    """
+    Remove the outputs of the steps whose calls an interrupted run archived
+    """
+    if getattr(params, "retention", "all") == "all" or not os.path.exists(os.path.join(params.outputPath, ARCHIVE_DIR, "Index.db")):
+        return
+    archive = getCallsArchive(params)
+    for iteration, step in archive.loadPendingSteps():
+        removeStepOutputs(os.path.join(params.outputPath, "Iteration_" + iteration, step))
+        archive.completeStep(iteration, step)
+
+
+def collectArtifacts(params, selectedConfigs):
+    """
+    Reduce every finished parameter step outside the retained ones to its configuration, archiving the calls of its samples
+    """
+    if getattr(params, "retention", "all") == "all":
+        return
+    finishPendingCollection(params)
+    archive = getCallsArchive(params)
+    retained = selectRetainedSteps(params, selectedConfigs)
+    collected = archive.loadCollectedSteps()
+    nCollected = 0
+    for iteration, step in getResultsStore(params).loadSteps():
+        stepKey = (str(iteration), str(step))
+        if stepKey in retained or stepKey in collected:
+            continue
+        stepPath = os.path.join(params.outputPath, "Iteration_" + stepKey[0], stepKey[1])
+        if not os.path.isdir(stepPath):
+            continue
+        sampleCalls = {}
+        for sampleName in params.sampleNames:
+            callsPath = os.path.join(stepPath, sampleName, "CNV.vcf.gz")
+            if os.path.exists(callsPath):
+                sampleCalls[sampleName] = callsPath
+        archive.archiveCalls(stepKey[0], stepKey[1], sampleCalls)
+        removeStepOutputs(stepPath)
+        archive.completeStep(stepKey[0], stepKey[1])
+        nCollected += 1
+    if nCollected:
+        print "Archived the calls of %i parameter steps, keeping %i steps in full" % (nCollected, len(retained))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the calls archive of an optimization run or extract archived calls")
+    parser.add_argument("command", choices=["summary", "extract"], help="summary: report the archive; extract: write the archived CNV.vcf.gz of a sample")
+    parser.add_argument("outputPath", help="Output directory of the optimization run")
+    parser.add_argument("--iteration", dest="iteration", help="Iteration of the parameter step")
+    parser.add_argument("--step", dest="step", help="Parameter step, e.g. Parameter_DeviationFactor_1.5")
+    parser.add_argument("--sample", dest="sample", help="Sample name")
+    parser.add_argument("--output", dest="output", default="CNV.vcf.gz", help="Extracted calls (default CNV.vcf.gz)")
+    options = parser.parse_args()
+    archivePath = os.path.join(options.outputPath, ARCHIVE_DIR)
+    if not os.path.exists(os.path.join(archivePath, "Index.db")):
+        sys.exit("No calls archive in %s" % options.outputPath)
+    archive = CallsArchive(archivePath)
+    if options.command == "extract":
+        if options.iteration is None or options.step is None or options.sample is None:
+            sys.exit("extract needs --iteration, --step and --sample")
+        archive.extract(options.iteration, options.step, options.sample, options.output)
+        return
+    nSteps, nCalls, nBlobs, nBytes = archive.summary()
+    print "%i parameter steps archived: %i sample calls stored as %i distinct files, %.1f MB" % (nSteps, nCalls, nBlobs, nBytes / float(1 << 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Morris elementary effects screening of the model parameters.
+
+A budget of r trajectories through a grid of --screeningLevels levels of the modelParameters.json
+ranges is evaluated on all training samples; every trajectory changes one parameter at a time, so
+it yields one elementary effect per parameter for r * (k + 1) evaluations of k parameters. The
+mean absolute effect mu* ranks the influence of the parameters on the optimization objective, and
+parameters whose mu* is below --screeningThreshold times the largest one are dropped from the
+pruned parameter set the optimizer reads with -p.
+"""
+import sys
+import json
+import argparse
+import numpy
+
+EFFECTS_FILE = "ScreeningEffects.json"
+SCREENED_PARAMETERS_FILE = "ScreenedModelParameters.json"
+# metrics of a design point, the first one ranks the parameters:
+SCREENING_METRICS = ["Score", "DirectionAccuracy"]
+
+
+def warnDuplicateKeys(pairs):
+    """
+    json object_pairs_hook: json keeps the last of repeated keys, say so instead of doing it silently
+    """
+    keys = [key for key, value in pairs]
+    for key in sorted(set(key for key in keys if keys.count(key) > 1)):
+        print >> sys.stderr, "Warning: parameter %s is defined %i times, using its last range %s" % (key, keys.count(key), [value for pairKey, value in pairs if pairKey == key][-1])
+    return dict(pairs)
+
+
+def readParameterSet(parameterSetFile):
+    with open(parameterSetFile) as inFile:
+        return json.load(inFile, object_pairs_hook=warnDuplicateKeys)
+
+
+def morrisDesign(parameterNames, nTrajectories, nLevels, seed):
+    """
+    Trajectories of unit points on a grid of nLevels levels, each followed by the index of the parameter changed at every step
+    """
+    random = numpy.random.RandomState(seed)
+    delta = nLevels / (2.0 * (nLevels - 1))
+    startLevels = [level / float(nLevels - 1) for level in range(nLevels) if level / float(nLevels - 1) <= 1 - delta + 1e-9]
+    trajectories = []
+    for trajectory in range(nTrajectories):
+        point = [startLevels[random.randint(len(startLevels))] for name in parameterNames]
+        points = [list(point)]
+        changed = []
+        for parameterIndex in random.permutation(len(parameterNames)):
+            # a step down is as likely as a step up wherever both stay in the unit interval:
+            if point[parameterIndex] - delta >= -1e-9 and random.randint(2):
+                point[parameterIndex] = max(point[parameterIndex] - delta, 0.0)
+            else:
+                point[parameterIndex] = min(point[parameterIndex] + delta, 1.0)
+            points.append(list(point))
+            changed.append(int(parameterIndex))
+        trajectories.append({"points": points, "changed": changed})
+    return {"parameters": list(parameterNames), "levels": nLevels, "seed": seed, "trajectories": trajectories}
+
+
+def getDesignPoints(design):
+    return [point for trajectory in design["trajectories"] for point in trajectory["points"]]
+
+
+def toUnitValue(value, parameterValueMin, parameterValueMax):
+    """
+    Position of a realized value in the range of its parameter, 0 for a range of a single value
+    """
+    if parameterValueMax == parameterValueMin:
+        return 0.0
+    return (value - parameterValueMin) / float(parameterValueMax - parameterValueMin)
+
+
+def elementaryEffects(design, realizedPoints, metrics):
+    """
+    Elementary effects of every parameter on every metric: metric change over the change of the
+    parameter in units of its range, as realized after rounding; steps rounded to no change are skipped
+    """
+    effects = dict((name, []) for name in design["parameters"])
+    pointIndex = 0
+    for trajectory in design["trajectories"]:
+        for step, parameterIndex in enumerate(trajectory["changed"]):
+            before, after = pointIndex + step, pointIndex + step + 1
+            change = realizedPoints[after][parameterIndex] - realizedPoints[before][parameterIndex]
+            if abs(change) > 1e-12:
+                effects[design["parameters"][parameterIndex]].append([(metrics[after][k] - metrics[before][k]) / change for k in range(len(SCREENING_METRICS))])
+        pointIndex += len(trajectory["points"])
+    return effects
+
+
+def summarizeEffects(effects, parameterSet, threshold):
+    """
+    mu*, mu and sigma per parameter and metric, parameters ranked on the mu* of the objective
+    """
+    summary = {}
+    for name, parameterEffects in effects.iteritems():
+        values = numpy.array(parameterEffects, dtype=float).reshape(len(parameterEffects), len(SCREENING_METRICS))
+        summary[name] = {"range": parameterSet[name], "nEffects": len(parameterEffects)}
+        for k, metric in enumerate(SCREENING_METRICS):
+            if len(parameterEffects):
+                summary[name][metric] = {"muStar": float(numpy.mean(numpy.abs(values[:, k]))), "mu": float(numpy.mean(values[:, k])), "sigma": float(numpy.std(values[:, k]))}
+            else:
+                summary[name][metric] = {"muStar": 0.0, "mu": 0.0, "sigma": 0.0}
+    return rankEffects(summary, threshold)
+
+
+def rankEffects(summary, threshold):
+    """
+    Rank parameters on mu* of the objective and retain those above threshold times the largest mu*
+    """
+    ranking = sorted(summary, key=lambda name: (-summary[name][SCREENING_METRICS[0]]["muStar"], name))
+    largest = summary[ranking[0]][SCREENING_METRICS[0]]["muStar"] if ranking else 0.0
+    for rank, name in enumerate(ranking):
+        summary[name]["rank"] = rank + 1
+        # the most influential parameter is always kept:
+        summary[name]["retained"] = bool(rank == 0 or (largest > 0 and summary[name][SCREENING_METRICS[0]]["muStar"] >= threshold * largest))
+    return summary
+
+
+def writePrunedParameterSet(parametersPath, summary):
+    with open(parametersPath, "w") as outFile:
+        json.dump(dict((name, entry["range"]) for name, entry in summary.iteritems() if entry["retained"]), outFile, indent=4, sort_keys=True)
+
+
+def writeScreeningResults(effectsPath, parametersPath, summary):
+    with open(effectsPath, "w") as outFile:
+        json.dump(summary, outFile, indent=4, sort_keys=True)
+    writePrunedParameterSet(parametersPath, summary)
+
+
+def formatSummary(summary):
+    lines = ["Rank\tParameter\tRetained\tEffects\t" + "\t".join("%s mu*\t%s mu\t%s sigma" % (metric, metric, metric) for metric in SCREENING_METRICS)]
+    for name in sorted(summary, key=lambda name: summary[name]["rank"]):
+        entry = summary[name]
+        columns = [str(entry["rank"]), name, "yes" if entry["retained"] else "no", str(entry["nEffects"])]
+        for metric in SCREENING_METRICS:
+            columns += ["%.4f" % entry[metric]["muStar"], "%.4f" % entry[metric]["mu"], "%.4f" % entry[metric]["sigma"]]
+        lines.append("\t".join(columns))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the parameter effects of a screening run, optionally re-pruning the parameter set with another threshold")
+    parser.add_argument("effectsFile", help="ScreeningEffects.json of a screening run")
+    parser.add_argument("--threshold", dest="threshold", type=float, default=None, help="Retain parameters with mu* of at least this fraction of the largest mu*")
+    parser.add_argument("--output", dest="output", default=None, help="Pruned parameter set written with --threshold; the effects file is left unchanged")
+    options = parser.parse_args()
+    with open(options.effectsFile) as inFile:
+        summary = json.load(inFile)
+    if options.threshold is not None:
+        summary = rankEffects(summary, options.threshold)
+        if options.output is not None:
+            writePrunedParameterSet(options.output, summary)
+    for line in formatSummary(summary):
+        print line
+
+
+if __name__ == "__main__":
+    main()
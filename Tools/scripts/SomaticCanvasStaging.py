@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+"""
+Node-local staging of training sample inputs (--stagingDir).
+
+The 'run' command stages the inputs of a sample in entries of the staging directory, one for the
+sample files and one per folder, and runs a CanvasSomaticCaller task against the staged copies
+while holding a shared lock on its entries. 'evict' applies the size budget, 'verify' re-checks
+the checksums of all entries.
+"""
+import os
+import sys
+import json
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+
+def describeSource(path):
+    """
+    Path, size and modification time of an input, of every file in it for a folder
+    """
+    stat = os.stat(path)
+    if os.path.isdir(path):
+        return [os.path.abspath(path)] + [describeSource(os.path.join(path, fileName)) for fileName in sorted(os.listdir(path))]
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+
+def stagingKey(sources):
+    """
+    Name of the staging entry of a set of (name, path) inputs, changes whenever an input changes
+    """
+    return hashlib.sha1(json.dumps([(name, describeSource(path)) for name, path in sources])).hexdigest()
+
+
+def getStagingEntries(sources):
+    """
+    (key, sources) of the staging entries of some (name, path) inputs: one for the files and one for
+    every folder, so that a folder used by several samples is staged once
+    """
+    files = [(name, path) for name, path in sources if not os.path.isdir(path)]
+    entries = [(stagingKey(files), files)] if files else []
+    for name, path in sources:
+        if os.path.isdir(path):
+            entries.append((stagingKey([(name, path)]), [(name, path)]))
+    return entries
+
+
+def copyWithChecksum(source, target):
+    """
+    Copy source to target and return the sha1 of the copy, after checking it against the source content read
+    """
+    sourceDigest = hashlib.sha1()
+    with open(source, "rb") as inFile:
+        with open(target, "wb") as outFile:
+            for block in iter(lambda: inFile.read(1 << 20), ""):
+                sourceDigest.update(block)
+                outFile.write(block)
+            outFile.flush()
+            os.fsync(outFile.fileno())
+    shutil.copystat(source, target)
+    targetDigest = fileChecksum(target)
+    if targetDigest != sourceDigest.hexdigest():
+        raise IOError("Checksum mismatch after staging %s to %s" % (source, target))
+    return targetDigest
+
+
+def fileChecksum(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as inFile:
+        for block in iter(lambda: inFile.read(1 << 20), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StagingArea:
+    """
+    Size-bounded directory of staged sample inputs on local disk
+    """
+
+    def __init__(self, stagingDir, maxSizeMb):
+        self.stagingDir = stagingDir
+        self.maxSizeBytes = int(maxSizeMb) << 20
+        if not os.path.isdir(stagingDir):
+            try:
+                os.makedirs(stagingDir)
+            except OSError:
+                if not os.path.isdir(stagingDir):
+                    raise
+
+    def entryPath(self, key):
+        return os.path.join(self.stagingDir, key)
+
+    def _lock(self, name, mode):
+        lockFile = open(os.path.join(self.stagingDir, name), "a")
+        try:
+            fcntl.flock(lockFile, mode)
+        except IOError:
+            lockFile.close()
+            return None
+        return lockFile
+
+    def isValid(self, key):
+        """
+        Staged files exist with the size and modification time of their source, which is unchanged
+        since it was staged
+        """
+        try:
+            with open(os.path.join(self.entryPath(key), "entry.json")) as manifestFile:
+                manifest = json.load(manifestFile)
+            for name, stagedFile in manifest["files"].iteritems():
+                stat = os.stat(os.path.join(self.entryPath(key), name))
+                if [stat.st_size, int(stat.st_mtime)] != [stagedFile["size"], stagedFile["mtime"]]:
+                    return False
+                if describeSource(stagedFile["source"])[1:] != [stagedFile["size"], stagedFile["mtime"]]:
+                    return False
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def stageFile(self, source, target):
+        """
+        Hardlink (on the same filesystem) or copy a file, and describe the staged file for the manifest
+        """
+        sha1 = None
+        if os.stat(source).st_dev == os.stat(self.stagingDir).st_dev:
+            try:
+                os.link(source, target)
+                sha1 = fileChecksum(target)
+            except OSError:
+                pass
+        if sha1 is None:
+            sha1 = copyWithChecksum(source, target)
+        stat = os.stat(target)
+        # a hardlink keeps the file on disk when the source is replaced, it counts against the budget:
+        return {"source": os.path.abspath(source), "size": stat.st_size, "mtime": int(stat.st_mtime), "sha1": sha1, "staged": stat.st_size}
+
+    def stageDirectory(self, source, target, files):
+        """
+        Stage the files of a directory and link anything else to the shared copy
+        """
+        os.mkdir(target)
+        for fileName in sorted(os.listdir(source)):
+            sourcePath = os.path.join(source, fileName)
+            if os.path.isfile(sourcePath):
+                files[os.path.join(os.path.basename(target), fileName)] = self.stageFile(sourcePath, os.path.join(target, fileName))
+            else:
+                os.symlink(os.path.abspath(sourcePath), os.path.join(target, fileName))
+
+    def stage(self, key, sources):
+        """
+        Make sure the (name, path) inputs are staged under key and return the entry lock, held shared
+        while the staged files are in use
+        """
+        while True:
+            # a valid entry is used without waiting for the tasks already using it:
+            lockFile = self._lock(key + ".lock", fcntl.LOCK_SH)
+            if self.isValid(key):
+                os.utime(os.path.join(self.entryPath(key), "entry.json"), None)
+                return lockFile
+            lockFile.close()
+            lockFile = self._lock(key + ".lock", fcntl.LOCK_EX)
+            if not self.isValid(key):
+                shutil.rmtree(self.entryPath(key), ignore_errors=True)
+                tmpPath = tempfile.mkdtemp(prefix=".tmp", dir=self.stagingDir)
+                try:
+                    files = {}
+                    for name, source in sources:
+                        if os.path.isdir(source):
+                            self.stageDirectory(source, os.path.join(tmpPath, name), files)
+                        else:
+                            files[name] = self.stageFile(source, os.path.join(tmpPath, name))
+                    with open(os.path.join(tmpPath, "entry.json"), "w") as manifestFile:
+                        json.dump({"files": files, "size": sum(stagedFile["staged"] for stagedFile in files.itervalues())}, manifestFile)
+                    os.rename(tmpPath, self.entryPath(key))
+                except:
+                    shutil.rmtree(tmpPath, ignore_errors=True)
+                    lockFile.close()
+                    raise
+            # mark entry as recently used:
+            os.utime(os.path.join(self.entryPath(key), "entry.json"), None)
+            # flock does not downgrade atomically, the entry may have been evicted in between:
+            fcntl.flock(lockFile, fcntl.LOCK_SH)
+            if self.isValid(key):
+                return lockFile
+            lockFile.close()
+
+    def listEntries(self):
+        entries = []
+        for key in os.listdir(self.stagingDir):
+            manifestPath = os.path.join(self.stagingDir, key, "entry.json")
+            if key.startswith(".") or key.endswith(".lock"):
+                continue
+            try:
+                with open(manifestPath) as manifestFile:
+                    manifest = json.load(manifestFile)
+                entries.append((os.path.getmtime(manifestPath), manifest, key))
+            except (IOError, OSError, ValueError):
+                continue
+        return entries
+
+    def remove(self, key):
+        """
+        Remove an entry unless a task is using it
+        """
+        entryLock = self._lock(key + ".lock", fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if entryLock is None:
+            return False
+        try:
+            shutil.rmtree(self.entryPath(key), ignore_errors=True)
+        finally:
+            entryLock.close()
+        return True
+
+    def evict(self):
+        """
+        Remove least recently used entries that are not in use until the staging area fits into its size budget
+        """
+        lockFile = self._lock(".lock", fcntl.LOCK_EX)
+        try:
+            entries = sorted(self.listEntries())
+            totalSize = sum(manifest["size"] for lastUsed, manifest, key in entries)
+            for lastUsed, manifest, key in entries:
+                if totalSize <= self.maxSizeBytes:
+                    break
+                if self.remove(key):
+                    totalSize -= manifest["size"]
+        finally:
+            lockFile.close()
+        return totalSize
+
+    def verify(self):
+        """
+        Re-check the checksums of all staged copies and remove corrupt entries, return their keys
+        """
+        corrupt = []
+        for lastUsed, manifest, key in self.listEntries():
+            for name, stagedFile in manifest["files"].iteritems():
+                path = os.path.join(self.entryPath(key), name)
+                if not os.path.exists(path) or fileChecksum(path) != stagedFile["sha1"]:
+                    if self.remove(key):
+                        corrupt.append(key)
+                    break
+        return corrupt
+
+
+def getSampleSources(params, sampleIndex):
+    """
+    (staged name, shared path) of the CanvasSomaticCaller inputs of a sample
+    """
+    return [
+        ("VFResultsTumor.txt.gz", os.path.join(params.sampleDataPath[sampleIndex], "VFResultsTumor.txt.gz")),
+        ("Tumor.partitioned", os.path.join(params.sampleDataPath[sampleIndex], "Tumor.partitioned")),
+        ("Filter_" + os.path.basename(params.sampleFilterBed[sampleIndex]), params.sampleFilterBed[sampleIndex]),
+        ("Truth_" + os.path.basename(params.truthFiles[sampleIndex]), params.truthFiles[sampleIndex]),
+        ("Reference", params.sampleReferenceGenome[sampleIndex]),
+    ]
+
+
+def getStagedSampleInputs(params, sampleIndex):
+    """
+    Command prefix that stages the inputs of a sample on the executing node and the paths to use in the task,
+    or an empty prefix and the shared paths when staging is disabled
+    """
+    sources = getSampleSources(params, sampleIndex)
+    if getattr(params, "stagingDir", None) is None:
+        return "", dict(sources)
+    prefix = "%s %s run --stagingDir %s --stagingSizeMb %i" % (sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + ".py", params.stagingDir, params.stagingSizeMb)
+    localPaths = {}
+    for key, entrySources in getStagingEntries(sources):
+        for name, source in entrySources:
+            prefix += " --input %s=%s" % (name, source)
+            localPaths[name] = os.path.join(params.stagingDir, key, name)
+    return prefix + " -- ", localPaths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage sample inputs on local disk")
+    parser.add_argument("command", choices=["run", "evict", "verify"], help="run: stage inputs, then run the command after --; evict: apply the size budget; verify: re-check checksums")
+    parser.add_argument("--stagingDir", dest="stagingDir", required=True, help="Node-local staging directory")
+    parser.add_argument("--stagingSizeMb", dest="stagingSizeMb", type=int, default=100 << 10, help="Size budget of the staging directory in MB (default 100 GB)")
+    parser.add_argument("--input", dest="inputs", action="append", default=[], help="name=path of an input file or folder to stage")
+    arguments = sys.argv[1:]
+    command = []
+    if "--" in arguments:
+        command = arguments[arguments.index("--") + 1:]
+        arguments = arguments[0:arguments.index("--")]
+    options = parser.parse_args(arguments)
+    area = StagingArea(options.stagingDir, options.stagingSizeMb)
+    if options.command == "evict":
+        print area.evict()
+        return
+    if options.command == "verify":
+        for key in area.verify():
+            print "Removed corrupt staging entry %s" % key
+        return
+    sources = [tuple(value.split("=", 1)) for value in options.inputs]
+    entryLocks = []
+    try:
+        # entries are locked in key order, tasks staging the same entries cannot wait on each other:
+        for key, entrySources in sorted(getStagingEntries(sources)):
+            entryLocks.append(area.stage(key, entrySources))
+        exitCode = subprocess.call(command)
+    finally:
+        for entryLock in entryLocks:
+            entryLock.close()
+    area.evict()
+    sys.exit(exitCode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Resource telemetry of optimizer tasks.
+
+'run' runs the task after -- and appends its wall time, CPU time, peak RSS, I/O and exit status as
+one JSON line to the Telemetry.jsonl of the run; 'summary' reports on a telemetry file.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import resource
+import argparse
+import subprocess
+
+POLL_INTERVAL = 0.2
+
+
+def readProcIo(pid):
+    """
+    Characters read and written by a process and its reaped children, None where /proc is unavailable
+    """
+    try:
+        with open("/proc/%i/io" % pid) as ioFile:
+            counters = dict(line.split(": ") for line in ioFile.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def isZombie(pid):
+    try:
+        with open("/proc/%i/stat" % pid) as statFile:
+            return statFile.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except (IOError, OSError, IndexError):
+        return True
+
+
+def runMeasured(command):
+    """
+    Run command and return its exit status and resource usage
+    """
+    start = time.time()
+    process = subprocess.Popen(command)
+    io = readProcIo(process.pid)
+    if io is not None:
+        # /proc of the finished, not yet reaped, task still holds its final I/O counters:
+        pollInterval = 0.01
+        while not isZombie(process.pid):
+            io = readProcIo(process.pid) or io
+            time.sleep(pollInterval)
+            pollInterval = min(2 * pollInterval, POLL_INTERVAL)
+        io = readProcIo(process.pid) or io
+    pid, status, usage = os.wait4(process.pid, 0)
+    wallSeconds = time.time() - start
+    if os.WIFSIGNALED(status):
+        exitStatus = 128 + os.WTERMSIG(status)
+    else:
+        exitStatus = os.WEXITSTATUS(status)
+    record = {
+        "start": start,
+        "wallSeconds": round(wallSeconds, 3),
+        "userSeconds": round(usage.ru_utime, 3),
+        "systemSeconds": round(usage.ru_stime, 3),
+        "maxRssMb": round(usage.ru_maxrss / 1024.0, 1),
+        "readBytes": io[0] if io is not None else usage.ru_inblock * 512,
+        "writeBytes": io[1] if io is not None else usage.ru_oublock * 512,
+        "blockReadBytes": usage.ru_inblock * 512,
+        "blockWriteBytes": usage.ru_oublock * 512,
+        "exitStatus": exitStatus,
+        "host": socket.gethostname(),
+    }
+    return exitStatus, record
+
+
+def runMeasuredInline(record, function, *arguments):
+    """
+    Call function in this process, add the resource usage of the call to record and return the
+    result of function; maxRssMb is the peak of the whole process
+    """
+    start = time.time()
+    usageBefore = resource.getrusage(resource.RUSAGE_SELF)
+    ioBefore = readProcIo(os.getpid())
+    record.update({"start": start, "exitStatus": 1, "host": socket.gethostname()})
+    try:
+        result = function(*arguments)
+        record["exitStatus"] = 0
+        return result
+    finally:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = readProcIo(os.getpid())
+        record.update({
+            "wallSeconds": round(time.time() - start, 3),
+            "userSeconds": round(usage.ru_utime - usageBefore.ru_utime, 3),
+            "systemSeconds": round(usage.ru_stime - usageBefore.ru_stime, 3),
+            "maxRssMb": round(usage.ru_maxrss / 1024.0, 1),
+            "blockReadBytes": (usage.ru_inblock - usageBefore.ru_inblock) * 512,
+            "blockWriteBytes": (usage.ru_oublock - usageBefore.ru_oublock) * 512,
+        })
+        record["readBytes"] = io[0] - ioBefore[0] if io is not None and ioBefore is not None else record["blockReadBytes"]
+        record["writeBytes"] = io[1] - ioBefore[1] if io is not None and ioBefore is not None else record["blockWriteBytes"]
+
+
+def appendRecord(telemetryFile, record):
+    """
+    Append one JSON line under a POSIX lock, which also holds on NFS
+    """
+    with open(telemetryFile, "a") as outFile:
+        fcntl.lockf(outFile, fcntl.LOCK_EX)
+        try:
+            outFile.write(json.dumps(record, sort_keys=True) + "\n")
+            outFile.flush()
+        finally:
+            fcntl.lockf(outFile, fcntl.LOCK_UN)
+
+
+def readRecords(telemetryFile):
+    records = []
+    if not os.path.exists(telemetryFile):
+        return records
+    with open(telemetryFile) as inFile:
+        for fileLine in inFile:
+            try:
+                records.append(json.loads(fileLine))
+            except ValueError:
+                continue
+    return records
+
+
+def readNewRecords(telemetryFile, offset):
+    """
+    Records of the complete lines appended after offset, and the offset of the next unread line
+    """
+    records = []
+    if not os.path.exists(telemetryFile) or os.path.getsize(telemetryFile) <= offset:
+        return records, offset
+    with open(telemetryFile) as inFile:
+        inFile.seek(offset)
+        for fileLine in inFile:
+            if not fileLine.endswith("\n"):
+                # a record still being written, read it next time:
+                break
+            offset += len(fileLine)
+            try:
+                records.append(json.loads(fileLine))
+            except ValueError:
+                continue
+    return records, offset
+
+
+def getTelemetryFile(params):
+    return os.path.join(params.outputPath, "Telemetry.jsonl")
+
+
+def getTelemetryArguments(params, kind, sampleIndex, memMb, nCores=1):
+    """
+    Options describing a task of the current parameter step in its telemetry record
+    """
+    parameterStep = "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue)
+    arguments = " --telemetryFile %s" % getTelemetryFile(params)
+    arguments += " --kind %s --iteration %s --step %s --parameter %s --sample %s --memMb %i --nCores %i" % (kind, params.iteration, parameterStep, params.currentParameter, params.sampleNames[sampleIndex], memMb, nCores)
+    return arguments
+
+
+def recordInlineTask(params, kind, sampleIndex, function, *arguments):
+    """
+    Call function in the optimizer process in place of a task of the current parameter step, and
+    record its resource usage as the telemetry of that task
+    """
+    record = {
+        "kind": kind,
+        "iteration": str(params.iteration),
+        "step": "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue),
+        "parameter": params.currentParameter,
+        "sample": params.sampleNames[sampleIndex],
+        "memMb": 0,
+        "nCores": 1,
+    }
+    try:
+        return runMeasuredInline(record, function, *arguments)
+    finally:
+        appendRecord(getTelemetryFile(params), record)
+
+
+def getTelemetryPrefix(params, kind, sampleIndex, memMb, nCores=1):
+    """
+    Command prefix recording the resource usage of a task of the current parameter step
+    """
+    prefix = "%s %s run" % (sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + ".py")
+    return prefix + getTelemetryArguments(params, kind, sampleIndex, memMb, nCores) + " -- "
+
+
+def median(values):
+    values = sorted(values)
+    return (values[(len(values) - 1) // 2] + values[len(values) // 2]) / 2.0
+
+
+def summarize(records, top):
+    """
+    Report lines: slowest samples, straggler time per iteration and core-hours per parameter
+    """
+    lines = []
+    sampleTimes = {}
+    stepTimes = {}
+    parameterHours = {}
+    failures = 0
+    for record in records:
+        if record["exitStatus"] != 0:
+            failures += 1
+        sampleTimes.setdefault((record["kind"], record["sample"]), []).append(record["wallSeconds"])
+        stepTimes.setdefault((record["iteration"], record["step"], record["kind"]), []).append(record["wallSeconds"])
+        hours = parameterHours.setdefault(record["parameter"], [0.0, 0.0, 0])
+        hours[0] += (record["userSeconds"] + record["systemSeconds"]) / 3600.0
+        hours[1] += record["wallSeconds"] * record.get("nCores", 1) / 3600.0
+        hours[2] += 1
+    lines.append("%i tasks, %i failed" % (len(records), failures))
+    lines.append("")
+    lines.append("Slowest samples\t(kind, sample, tasks, mean wall s, max wall s)")
+    ranking = sorted(sampleTimes.iteritems(), key=lambda item: -sum(item[1]) / len(item[1]))
+    for (kind, sample), times in ranking[0:top]:
+        lines.append("%s\t%s\t%i\t%.1f\t%.1f" % (kind, sample, len(times), sum(times) / len(times), max(times)))
+    # a parameter step waits for its slowest sample, time beyond the median sample is straggler time:
+    iterationStraggling = {}
+    for (iteration, step, kind), times in stepTimes.iteritems():
+        straggling = iterationStraggling.setdefault(iteration, [0.0, 0.0])
+        straggling[0] += max(times) - median(times)
+        straggling[1] += max(times)
+    lines.append("")
+    lines.append("Iterations by straggler time\t(iteration, straggler s, critical path s)")
+    for iteration, (straggling, critical) in sorted(iterationStraggling.iteritems(), key=lambda item: -item[1][0])[0:top]:
+        lines.append("%s\t%.1f\t%.1f" % (iteration, straggling, critical))
+    lines.append("")
+    lines.append("Core-hours per parameter\t(parameter, tasks, CPU core-hours, reserved core-hours)")
+    for parameter, (cpuHours, reservedHours, count) in sorted(parameterHours.iteritems(), key=lambda item: -item[1][0]):
+        lines.append("%s\t%i\t%.3f\t%.3f" % (parameter, count, cpuHours, reservedHours))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and summarize resource usage of optimizer tasks")
+    parser.add_argument("command", choices=["run", "summary"], help="run: run the command after -- and record its usage; summary: report on a telemetry file")
+    parser.add_argument("--telemetryFile", dest="telemetryFile", required=True, help="Telemetry.jsonl of the run")
+    parser.add_argument("--kind", dest="kind", default="", help="Task kind (CanvasSomaticCaller or EvaluateCNV)")
+    parser.add_argument("--iteration", dest="iteration", default="", help="Optimization iteration of the task")
+    parser.add_argument("--step", dest="step", default="", help="Parameter step of the task")
+    parser.add_argument("--parameter", dest="parameter", default="", help="Optimized parameter of the step")
+    parser.add_argument("--sample", dest="sample", default="", help="Training sample of the task")
+    parser.add_argument("--memMb", dest="memMb", type=int, default=0, help="Memory requested for the task")
+    parser.add_argument("--nCores", dest="nCores", type=int, default=1, help="Cores requested for the task")
+    parser.add_argument("--top", dest="top", type=int, default=10, help="Number of samples and iterations reported by summary (default 10)")
+    arguments = sys.argv[1:]
+    command = []
+    if "--" in arguments:
+        command = arguments[arguments.index("--") + 1:]
+        arguments = arguments[0:arguments.index("--")]
+    options = parser.parse_args(arguments)
+    if options.command == "summary":
+        for line in summarize(readRecords(options.telemetryFile), options.top):
+            print line
+        return
+    exitStatus, record = runMeasured(command)
+    for key in ["kind", "iteration", "step", "parameter", "sample", "memMb", "nCores"]:
+        record[key] = getattr(options, key)
+    appendRecord(options.telemetryFile, record)
+    sys.exit(exitStatus)
+
+
+if __name__ == "__main__":
+    main()
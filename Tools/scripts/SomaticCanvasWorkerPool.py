@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+"""
+Pool of warm CanvasSomaticCaller workers (--workerPool N).
+
+A worker is a 'CanvasSomaticCaller.exe --worker' process started with the inputs of one sample. It
+reads one JSON request per line on stdin, with the ParameterConfig, OutFile and Log of a call, and
+answers one JSON line with the ExitCode and Seconds of the call. The pool runs in the optimizer
+process and serves at most N workers to the caller tasks through a Unix socket; the command of a
+task is the 'call' command of this script, which exits with the exit code of the call.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import SocketServer
+from SomaticCanvasTelemetry import readProcIo, appendRecord
+
+SOCKET_FILE = "WorkerPool.sock"
+EVICTION_GRACE_SECONDS = 1.0
+
+_pool = None
+
+
+class WorkerError(Exception):
+    pass
+
+
+def getProcessGroup(pgid):
+    """
+    Processes of a process group, none where /proc is unavailable
+    """
+    pids = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as statFile:
+                if int(statFile.read().rsplit(")", 1)[1].split()[2]) == pgid:
+                    pids.append(int(entry))
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+def resetPeakRss(pids):
+    """
+    Restart the peak RSS (VmHWM) of processes from their current RSS
+    """
+    for pid in pids:
+        try:
+            with open("/proc/%i/clear_refs" % pid, "w") as clearFile:
+                clearFile.write("5")
+        except (IOError, OSError):
+            pass
+
+
+def readGroupUsage(pids):
+    """
+    Summed user and system seconds, including reaped children, characters read and written and peak RSS in MB
+    of processes, None where /proc is unavailable
+    """
+    if not pids:
+        return None
+    ticks = float(os.sysconf("SC_CLK_TCK"))
+    usage = {"userSeconds": 0.0, "systemSeconds": 0.0, "readBytes": 0, "writeBytes": 0, "maxRssMb": 0.0}
+    for pid in pids:
+        try:
+            with open("/proc/%i/stat" % pid) as statFile:
+                fields = statFile.read().rsplit(")", 1)[1].split()
+            with open("/proc/%i/status" % pid) as statusFile:
+                status = dict(line.split(":", 1) for line in statusFile.read().splitlines() if ":" in line)
+        except (IOError, OSError):
+            continue
+        usage["userSeconds"] += (int(fields[11]) + int(fields[13])) / ticks
+        usage["systemSeconds"] += (int(fields[12]) + int(fields[14])) / ticks
+        usage["maxRssMb"] += int(status.get("VmHWM", "0 kB").split()[0]) / 1024.0
+        io = readProcIo(pid)
+        if io is not None:
+            usage["readBytes"] += io[0]
+            usage["writeBytes"] += io[1]
+    return usage
+
+
+class CallerWorker:
+    """
+    A warm worker process of one sample
+    """
+
+    def __init__(self, sampleName, command, logPath):
+        self.sampleName = sampleName
+        self.lastUsed = time.time()
+        self.nCalls = 0
+        with open(logPath, "a") as logFile:
+            # a process group of its own, so that stop() also ends the staging wrapper of the worker:
+            self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=logFile, preexec_fn=os.setsid)
+
+    def isAlive(self):
+        return self.process.poll() is None
+
+    def call(self, request):
+        """
+        Result of a call, with the resource usage of the worker over the call as its Usage where /proc is available
+        """
+        pids = getProcessGroup(self.process.pid)
+        resetPeakRss(pids)
+        before = readGroupUsage(pids)
+        start = time.time()
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except IOError, error:
+            raise WorkerError("Worker of sample %s failed: %s" % (self.sampleName, error))
+        if not line:
+            raise WorkerError("Worker of sample %s exited with status %s" % (self.sampleName, self.process.wait()))
+        self.lastUsed = time.time()
+        self.nCalls += 1
+        result = json.loads(line)
+        after = readGroupUsage(getProcessGroup(self.process.pid))
+        if before is not None and after is not None:
+            result["Usage"] = {
+                "start": start,
+                "wallSeconds": round(self.lastUsed - start, 3),
+                "userSeconds": round(max(after["userSeconds"] - before["userSeconds"], 0.0), 3),
+                "systemSeconds": round(max(after["systemSeconds"] - before["systemSeconds"], 0.0), 3),
+                "maxRssMb": round(after["maxRssMb"], 1),
+                "readBytes": max(after["readBytes"] - before["readBytes"], 0),
+                "writeBytes": max(after["writeBytes"] - before["writeBytes"], 0),
+                "host": socket.gethostname(),
+            }
+        return result
+
+    def stop(self, timeout=10.0):
+        """
+        Close stdin, on which the worker exits, and kill it if it does not
+        """
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + timeout
+        while self.isAlive() and time.time() < deadline:
+            time.sleep(0.05)
+        if self.isAlive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.process.wait()
+
+
+class WorkerPool:
+    """
+    At most maxWorkers warm workers, routed by sample
+    """
+
+    def __init__(self, maxWorkers, getWorkerCommand, logPath):
+        self.maxWorkers = maxWorkers
+        self.getWorkerCommand = getWorkerCommand
+        self.logPath = logPath
+        self.idle = {}
+        # calls waiting for a worker, per sample:
+        self.waiting = {}
+        self.nWorkers = 0
+        self.nStarted = 0
+        self.nCalls = 0
+        self.isStopped = False
+        self.condition = threading.Condition()
+
+    def getEvictable(self, arrival):
+        """
+        Most recently used idle worker that no call of its sample waits for, once it has served a call
+        since arrival, the grace period after arrival is over or no other call is in flight
+        """
+        nIdle = sum(len(workers) for workers in self.idle.itervalues())
+        isAlone = nIdle == self.nWorkers and sum(self.waiting.itervalues()) == 1
+        isGraceOver = isAlone or time.time() >= arrival + EVICTION_GRACE_SECONDS
+        workers = [worker for workerSample, workers in self.idle.iteritems() if not self.waiting.get(workerSample) for worker in workers
+                   if isGraceOver or worker.lastUsed >= arrival]
+        return max(workers, key=lambda worker: worker.lastUsed) if workers else None
+
+    def acquire(self, sampleName):
+        """
+        An idle worker of the sample, a new one while the pool has room or in place of an evictable idle worker
+        """
+        arrival = time.time()
+        victim = None
+        with self.condition:
+            self.waiting[sampleName] = self.waiting.get(sampleName, 0) + 1
+            try:
+                while True:
+                    if self.isStopped:
+                        raise WorkerError("Worker pool is stopped")
+                    if self.idle.get(sampleName):
+                        return self.idle[sampleName].pop()
+                    if self.nWorkers < self.maxWorkers:
+                        self.nWorkers += 1
+                        break
+                    victim = self.getEvictable(arrival)
+                    if victim is not None:
+                        # the new worker takes the place of the victim:
+                        self.idle[victim.sampleName].remove(victim)
+                        break
+                    self.condition.wait(min(max(arrival + EVICTION_GRACE_SECONDS - time.time(), 0.05), 1.0))
+            finally:
+                self.waiting[sampleName] -= 1
+        if victim is not None:
+            victim.stop()
+        try:
+            worker = CallerWorker(sampleName, self.getWorkerCommand(sampleName), self.logPath)
+        except Exception:
+            with self.condition:
+                self.nWorkers -= 1
+                self.condition.notifyAll()
+            raise
+        with self.condition:
+            self.nStarted += 1
+        return worker
+
+    def release(self, worker):
+        with self.condition:
+            isIdle = worker.isAlive() and not self.isStopped
+            if isIdle:
+                self.idle.setdefault(worker.sampleName, []).append(worker)
+            else:
+                self.nWorkers -= 1
+            self.condition.notifyAll()
+        if not isIdle:
+            worker.stop()
+
+    def call(self, sampleName, request):
+        """
+        Run a call on a worker of the sample; a worker that died is replaced and the call reported as failed,
+        a worker that failed otherwise is stopped
+        """
+        worker = self.acquire(sampleName)
+        try:
+            return worker.call(request)
+        except WorkerError, error:
+            worker.stop()
+            return {"OutFile": request["OutFile"], "ExitCode": 1, "Seconds": 0.0, "Error": str(error)}
+        except Exception:
+            # a worker left in the middle of a request, e.g. with an answer that is not JSON, is not reused:
+            worker.stop()
+            raise
+        finally:
+            with self.condition:
+                self.nCalls += 1
+            self.release(worker)
+
+    def stop(self):
+        with self.condition:
+            self.isStopped = True
+            workers = [worker for workers in self.idle.itervalues() for worker in workers]
+            self.idle = {}
+            self.nWorkers -= len(workers)
+        for worker in workers:
+            worker.stop()
+
+
+class WorkerPoolHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        sampleName = request.pop("Sample")
+        try:
+            result = self.server.pool.call(sampleName, request)
+        except Exception, error:
+            result = {"OutFile": request.get("OutFile"), "ExitCode": 1, "Seconds": 0.0, "Error": str(error)}
+        self.wfile.write(json.dumps(result) + "\n")
+
+
+class WorkerPoolServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+    # all caller tasks of a parameter step connect at once:
+    request_queue_size = 128
+
+
+def startWorkerPool(params, getWorkerCommand):
+    """
+    Start the pool and its socket for the caller tasks of this run, in a short temporary path as
+    Unix socket paths are limited to about 100 characters
+    """
+    global _pool
+    socketDir = tempfile.mkdtemp(prefix="SomaticCanvasWorkerPool")
+    params.workerPoolSocket = os.path.join(socketDir, SOCKET_FILE)
+    server = WorkerPoolServer(params.workerPoolSocket, WorkerPoolHandler)
+    server.pool = WorkerPool(params.workerPool, getWorkerCommand, os.path.join(params.outputPath, "WorkerPool.log"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    _pool = (server, socketDir)
+    return server.pool
+
+
+def stopWorkerPool():
+    global _pool
+    if _pool is None:
+        return
+    server, socketDir = _pool
+    _pool = None
+    server.shutdown()
+    server.server_close()
+    server.pool.stop()
+    print "Worker pool: %i calls on %i started workers" % (server.pool.nCalls, server.pool.nStarted)
+    shutil.rmtree(socketDir, ignore_errors=True)
+
+
+def getWorkerCallCommand(params, workerKey, configPath, outFile, logPath, telemetryArguments=""):
+    """
+    Command of a caller task served by the worker pool, recording the usage of the worker over the
+    call with the options of SomaticCanvasTelemetry.getTelemetryArguments
+    """
+    return "%s %s call --socket %s --workerKey %s --parameterConfig %s --outFile %s --log %s" % (
+        sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + ".py", params.workerPoolSocket, workerKey, configPath, outFile, logPath) + telemetryArguments
+
+
+def callWorkerPool(socketPath, request, retryWindow=60.0):
+    """
+    Send a request to the pool of the optimizer, retrying the connection while the socket is busy
+    """
+    deadline = time.time() + retryWindow
+    while True:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(socketPath)
+            break
+        except socket.error, error:
+            connection.close()
+            if error.errno not in (errno.EAGAIN, errno.ECONNREFUSED) or time.time() > deadline:
+                raise
+            time.sleep(0.1)
+    try:
+        connection.sendall(json.dumps(request) + "\n")
+        line = connection.makefile("r").readline()
+    finally:
+        connection.close()
+    if not line:
+        raise WorkerError("Worker pool closed the connection")
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a CanvasSomaticCaller call on the warm worker pool of an optimization run")
+    parser.add_argument("command", choices=["call"], help="call: send a call to the pool and exit with its exit code")
+    parser.add_argument("--socket", dest="socket", required=True, help="Socket of the worker pool")
+    parser.add_argument("--workerKey", dest="workerKey", required=True, help="Key of the workers of the sample")
+    parser.add_argument("--parameterConfig", dest="parameterConfig", required=True, help="SomaticCallerParameters.json of the call")
+    parser.add_argument("--outFile", dest="outFile", required=True, help="CNV.vcf.gz written by the call")
+    parser.add_argument("--log", dest="log", required=True, help="Output of the call")
+    parser.add_argument("--telemetryFile", dest="telemetryFile", default=None, help="Telemetry.jsonl to which the usage of the worker over the call is appended")
+    parser.add_argument("--kind", dest="kind", default="", help="Task kind of the telemetry record")
+    parser.add_argument("--iteration", dest="iteration", default="", help="Optimization iteration of the task")
+    parser.add_argument("--step", dest="step", default="", help="Parameter step of the task")
+    parser.add_argument("--parameter", dest="parameter", default="", help="Optimized parameter of the step")
+    parser.add_argument("--sample", dest="sample", default="", help="Training sample of the task")
+    parser.add_argument("--memMb", dest="memMb", type=int, default=0, help="Memory requested for the task")
+    parser.add_argument("--nCores", dest="nCores", type=int, default=1, help="Cores requested for the task")
+    options = parser.parse_args()
+    result = callWorkerPool(options.socket, {"Sample": options.workerKey, "ParameterConfig": options.parameterConfig, "OutFile": options.outFile, "Log": options.log})
+    print "Warm worker call of %s: exit code %s in %.2f s" % (options.workerKey, result["ExitCode"], result["Seconds"])
+    if result.get("Error"):
+        print >> sys.stderr, result["Error"]
+    # the usage of this client would size the caller tasks from a process that holds no sample data:
+    if options.telemetryFile is not None and result.get("Usage") is not None:
+        record = result["Usage"]
+        record["exitStatus"] = result["ExitCode"]
+        for key in ["kind", "iteration", "step", "parameter", "sample", "memMb", "nCores"]:
+            record[key] = getattr(options, key)
+        appendRecord(options.telemetryFile, record)
+    sys.exit(result["ExitCode"])
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import os, sys, json, copy
 import multiprocessing
 from psutil import virtual_memory
 from SomaticCanvasModelWorkflow import *
+from SomaticCanvasNativeExecutor import NativeExecutor
+from SomaticCanvasWorkerPool import startWorkerPool, stopWorkerPool
 import argparse
 
 
@@ -25,11 +27,50 @@ def getParams():
     params.configPath = options.configPath
     params.trainingSamples = options.trainingSamples
     params.evaluateCNVPath = options.evaluateCNVPath
-    with open(options.modelParametersSet) as modelParametersSetFile:
-        params.modelParametersSet = json.load(modelParametersSetFile)
+    params.modelParametersSet = readParameterSet(options.modelParametersSet)
     params.mode = options.mode
-    params.nbestParams = options.nbestParams
-    params.crossValidation = options.crossValidation
+    params.monoPath = options.monoPath
+    params.totalIterations = int(options.totalIterations)
+    params.nbestParams = int(options.nbestParams)
+    params.crossValidation = float(options.crossValidation)
+    params.crossValidationMode = options.crossValidationMode
+    params.crossValidationFolds = int(options.crossValidationFolds)
+    params.crossValidationSeed = options.searchSeed if options.searchSeed is not None else 0
+    params.cacheDir = options.cacheDir
+    params.asynchronous = options.asynchronous
+    params.asyncInFlight = int(options.asyncInFlight)
+    params.asyncEvaluations = int(options.asyncEvaluations)
+    params.pollInterval = 5
+    params.racing = options.racing
+    params.racingMinFraction = float(options.racingMinFraction)
+    params.racingEta = int(options.racingEta)
+    params.searchEngine = options.searchEngine
+    params.proposalsPerIteration = int(options.proposalsPerIteration)
+    params.searchSeed = options.searchSeed
+    params.cacheSizeMb = int(float(options.cacheSizeGb) * 1024)
+    params.evaluator = options.evaluator
+    params.stagingDir = options.stagingDir
+    params.stagingSizeMb = int(float(options.stagingSizeGb) * 1024)
+    params.screening = options.screening
+    params.screeningTrajectories = int(options.screeningTrajectories)
+    params.screeningLevels = int(options.screeningLevels)
+    params.screeningThreshold = float(options.screeningThreshold)
+    params.retention = options.retention
+    params.callIndex = options.callIndex
+    params.workerPool = int(options.workerPool)
+    params.fidelityChromosomes = options.fidelityChromosomes
+    params.fidelityDir = options.fidelityDir
+    params.fidelityIterations = int(options.fidelityIterations)
+    params.fidelityPromotion = float(options.fidelityPromotion)
+    params.fidelityAudit = int(options.fidelityAudit)
+    params.retentionTopK = int(options.retentionTopK)
+    params.batchMode = options.batchMode
+    params.batchSize = int(options.batchSize)
+    params.qsubPath = options.qsubPath
+    params.taskSizing = options.taskSizing
+    params.maxTaskMemoryMb = int(float(options.maxTaskMemoryGb) * 1024)
+    params.maxTaskCores = int(options.maxTaskCores)
+    params.telemetryHistory = options.telemetryHistory
     params.currentParameter = ""
     params.currentParameterValue = 0
     # read training samples 
@@ -49,11 +90,49 @@ def getCommandlineOptions() :
     parser.add_argument('-o', '--outputPath', dest='outputPath', help='Output directory for Canvas builds')
     parser.add_argument('-c', '--configPath', dest='configPath', help='Canvas somatic model parameters config file')
     parser.add_argument('-v', '--evaluateCNV', dest='evaluateCNVPath', help='Canvas somatic model parameters configFile')
-    parser.add_argument('-m', '--mode', dest='mode', default='sge', choices=['sge', 'local'], help="select run mode (local|sge, default=sge)")
+    parser.add_argument('-m', '--mode', dest='mode', default='sge', choices=['sge', 'local', 'native'], help="select run mode (local|sge|native, default=sge); native runs the tasks of a single node without pyflow")
     parser.add_argument('-p', '--modelParametersSet', dest='modelParametersSet', help="Path to .json file with Canvas model parameters")
+    parser.add_argument('--monoPath', dest='monoPath', action='store', default=MONO_PATH, help='mono runtime used to run CanvasSomaticCaller and EvaluateCNV (default %s)' % MONO_PATH)
+    parser.add_argument('--iterations', dest='totalIterations', action='store', default = 40, help='Number of optimization iterations (default 40)')
     parser.add_argument('--email', dest='mailTo', action='store', help='e-mail to notify on job completion or error (may be specified more than once)')
     parser.add_argument('--nbestParams', dest='nbestParams', action='store', default = 2, help='Number of best best parameters to keep at each iteration')
     parser.add_argument('--crossValidationFraction', dest='crossValidation', action='store', default = 0.2, help='Proportion of samples to use in testing')
+    parser.add_argument('--crossValidation', dest='crossValidationMode', default='none', choices=['none', 'holdout', 'kfold'], help="Optimize separate fold trajectories on training samples and report their held-out metrics: a single holdout of --crossValidationFraction samples or --crossValidationFolds folds (default=none)")
+    parser.add_argument('--crossValidationFolds', dest='crossValidationFolds', action='store', default = 5, help='Number of folds of --crossValidation kfold (default 5)')
+    parser.add_argument('--searchEngine', dest='searchEngine', default='mutation', choices=['mutation', 'random', 'tpe'], help="Parameter proposal engine: mutate one parameter at a time, or propose joint configurations at random or from a TPE surrogate (default=mutation)")
+    parser.add_argument('--proposalsPerIteration', dest='proposalsPerIteration', action='store', default = 4, help='Number of joint configurations evaluated per iteration by the random and tpe search engines (default 4)')
+    parser.add_argument('--searchSeed', dest='searchSeed', type=int, default = None, help='Random seed of the random and tpe search engines')
+    parser.add_argument('--racing', dest='racing', action='store_true', default=False, help='Successive halving: evaluate candidates on a sample subset and promote only the best ones to more samples')
+    parser.add_argument('--racingMinFraction', dest='racingMinFraction', action='store', default = 0.2, help='Fraction of training samples used in the first racing rung (default 0.2)')
+    parser.add_argument('--racingEta', dest='racingEta', action='store', default = 3, help='Racing reduction factor: 1/eta of candidates are promoted to eta times more samples (default 3)')
+    parser.add_argument('--async', dest='asynchronous', action='store_true', default=False, help='Steady-state optimization: propose a new candidate as soon as any evaluation completes instead of running synchronized iterations')
+    parser.add_argument('--asyncInFlight', dest='asyncInFlight', action='store', default = 8, help='Number of candidate evaluations kept running in --async mode (default 8)')
+    parser.add_argument('--asyncEvaluations', dest='asyncEvaluations', action='store', default = 160, help='Total number of candidate evaluations in --async mode (default 160)')
+    parser.add_argument('--cacheDir', dest='cacheDir', action='store', default = None, help='Directory for caching CanvasSomaticCaller and EvaluateCNV results across runs (disabled by default)')
+    parser.add_argument('--cacheSizeGb', dest='cacheSizeGb', action='store', default = 50, help='Maximum size of the result cache in GB (default 50)')
+    parser.add_argument('--stagingDir', dest='stagingDir', action='store', default = None, help='Node-local directory where CanvasSomaticCaller tasks stage the sample inputs before reading them (disabled by default)')
+    parser.add_argument('--stagingSizeGb', dest='stagingSizeGb', action='store', default = 100, help='Disk budget of the staging directory on each node in GB (default 100)')
+    parser.add_argument('--screening', dest='screening', action='store_true', default=False, help="Instead of optimizing, rank the influence of the model parameters by Morris screening and write ScreeningEffects.json and the pruned ScreenedModelParameters.json for -p")
+    parser.add_argument('--screeningTrajectories', dest='screeningTrajectories', action='store', default = 10, help='Morris trajectories of --screening, each costing one evaluation per parameter plus one (default 10)')
+    parser.add_argument('--screeningLevels', dest='screeningLevels', action='store', default = 4, help='Grid levels of the parameter ranges in --screening (default 4)')
+    parser.add_argument('--screeningThreshold', dest='screeningThreshold', action='store', default = 0.1, help='Parameters with a mean absolute effect below this fraction of the largest one are pruned (default 0.1)')
+    parser.add_argument('--workerPool', dest='workerPool', action='store', default = 0, help='Serve the CanvasSomaticCaller tasks from at most this many warm CanvasSomaticCaller --worker processes, one sample each, instead of starting mono for every task (local and native modes, disabled by default)')
+    parser.add_argument('--fidelityChromosomes', dest='fidelityChromosomes', action='store', default = None, help='Comma-separated chromosomes of the low-fidelity inputs: candidates are evaluated on the sample inputs restricted to them first and only the best ones on the full inputs (disabled by default)')
+    parser.add_argument('--fidelityDir', dest='fidelityDir', action='store', default = None, help='Directory caching the low-fidelity inputs across runs (default outputPath/LowFidelity/Inputs)')
+    parser.add_argument('--fidelityIterations', dest='fidelityIterations', action='store', default = 0, help='Number of first iterations evaluated at low fidelity first (default 0, all iterations)')
+    parser.add_argument('--fidelityPromotion', dest='fidelityPromotion', action='store', default = 0.25, help='Fraction of the candidates promoted from low to full fidelity, at least --nbestParams (default 0.25)')
+    parser.add_argument('--fidelityAudit', dest='fidelityAudit', action='store', default = 0, help='Candidates not promoted that are also evaluated at full fidelity, at random, for an unbiased FidelityAgreement.txt (default 0)')
+    parser.add_argument('--callIndex', dest='callIndex', action='store', default = None, help='Directory of the CNV call index shared across runs: the calls of every sample are indexed once as they are parsed, for SomaticCanvasCallIndex.py overlap and diff queries (disabled by default)')
+    parser.add_argument('--retention', dest='retention', default='all', choices=['all', 'topK'], help="Keep the outputs of every parameter step, or only of the --retentionTopK best steps and the selected configuration, archiving the calls of the others (default=all)")
+    parser.add_argument('--retentionTopK', dest='retentionTopK', action='store', default = 5, help='Parameter steps kept in full with --retention topK (default 5)')
+    parser.add_argument('--batchMode', dest='batchMode', default='none', choices=['none', 'chunk', 'array'], help="Run the samples of a parameter step as one task per sample, as tasks of --batchSize samples, or as one SGE array job (default=none)")
+    parser.add_argument('--batchSize', dest='batchSize', action='store', default = 10, help='Samples run one after the other by a task of --batchMode chunk (default 10)')
+    parser.add_argument('--qsubPath', dest='qsubPath', action='store', default = 'qsub', help="qsub command submitting the array jobs of --batchMode array; 'SomaticCanvasBatch.py qsub' emulates it locally (default qsub)")
+    parser.add_argument('--taskSizing', dest='taskSizing', default='fixed', choices=['adaptive', 'fixed'], help="Size task memory from sample input sizes and observed peak RSS, or give every task the same share of memory (default=fixed)")
+    parser.add_argument('--maxTaskMemoryGb', dest='maxTaskMemoryGb', action='store', default = 32, help='Upper bound of the memory requested by an adaptively sized task in GB (default 32)')
+    parser.add_argument('--maxTaskCores', dest='maxTaskCores', action='store', default = 4, help='Upper bound of the cores requested by an adaptively sized task (default 4)')
+    parser.add_argument('--telemetryHistory', dest='telemetryHistory', action='append', default = [], help='Telemetry.jsonl of a previous run used to size tasks (may be specified more than once)')
+    parser.add_argument('--evaluator', dest='evaluator', default='EvaluateCNV', choices=['EvaluateCNV', 'python'], help="Score CNV calls with EvaluateCNV tasks or in-process with SomaticCanvasEvaluator.py (default=EvaluateCNV)")
 
 
     options = parser.parse_args()
@@ -89,22 +168,59 @@ def getCommandlineOptions() :
         parser.print_help()
         sys.exit(2)
 
+    if (options.crossValidationMode != 'none' and (options.searchEngine != 'mutation' or options.racing or options.asynchronous)):
+        print "\nCross-validation is only supported with the mutation search engine, without --racing and --async!\n\n"
+        parser.print_help()
+        sys.exit(2)
+
+    if (options.fidelityChromosomes is not None and (options.crossValidationMode != 'none' or options.asynchronous or options.screening)):
+        print "\nLow-fidelity evaluation is only supported by synchronous iterations, without --crossValidation, --async and --screening!\n\n"
+        parser.print_help()
+        sys.exit(2)
+
     return options
 
 
 def main():
 
     params = getParams()
-    wflow = OptimizeSomaticCanvasFullWorkflow(params)
-    if params.mode == "local":  
+    if params.screening:
+        wflow = ScreeningWorkflow(params)
+    elif params.asynchronous:
+        wflow = AsyncOptimizeSomaticCanvasWorkflow(params)
+    else:
+        wflow = OptimizeSomaticCanvasFullWorkflow(params)
+    if params.mode == "local" or params.mode == "native":
         nCores=multiprocessing.cpu_count()
         memoryTotal = virtual_memory().total >> 20
         params.memoryCore  = int(memoryTotal/nCores)
+        params.maxTaskMemoryMb = min(params.maxTaskMemoryMb, memoryTotal)
+        params.maxTaskCores = min(params.maxTaskCores, nCores)
     else:
         nCores = 128
         memoryTotal = "unlimited"
         params.memoryCore = 3048
-    wflow.run(mode = params.mode, dataDirRoot = params.outputPath, isContinue = "Auto", isForceContinue = True, isQuiet = True, nCores = nCores, memMb = memoryTotal, retryMode = "all")
+    if params.workerPool > 0:
+        if params.mode == "sge" or params.batchMode == "array":
+            sys.exit("--workerPool needs -m local or -m native without --batchMode array: caller tasks reach the worker pool through a local socket")
+        # the low-fidelity calls of a sample read other inputs and have workers of their own:
+        nWorkerKeys = params.sampleSize * (2 if params.fidelityChromosomes else 1)
+        if params.workerPool < nWorkerKeys:
+            print "Warning: --workerPool %i is smaller than the %i samples%s, workers are restarted in every parameter step" % (
+                params.workerPool, nWorkerKeys, " of both fidelities" if params.fidelityChromosomes else "")
+        if params.evaluator != "python":
+            print "Note: --workerPool only serves the CanvasSomaticCaller tasks, --evaluator python also removes the start-up of the EvaluateCNV tasks"
+        ensureDir(params.outputPath)
+        # set before the workflow copies params into its sub-workflows:
+        startWorkerPool(params, lambda workerKey: getCallerWorkerCommand(params, workerKey))
+    try:
+        if params.mode == "native":
+            ensureDir(params.outputPath)
+            executor = NativeExecutor(nCores, memoryTotal, os.path.join(params.outputPath, "NativeTasks.log"), retryMode = "all")
+            sys.exit(executor.run(wflow))
+        wflow.run(mode = params.mode, dataDirRoot = params.outputPath, isContinue = "Auto", isForceContinue = True, isQuiet = True, nCores = nCores, memMb = memoryTotal, retryMode = "all")
+    finally:
+        stopWorkerPool()
 
 
 if __name__=="__main__":
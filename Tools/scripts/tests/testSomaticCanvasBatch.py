@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SomaticCanvasBatch
+from SomaticCanvasBatch import *
+
+
+def runQuietly(function, *arguments):
+    """
+    Call function with the output of its subprocesses discarded
+    """
+    savedFds = [os.dup(1), os.dup(2)]
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
+    try:
+        return function(*arguments)
+    finally:
+        os.dup2(savedFds[0], 1)
+        os.dup2(savedFds[1], 2)
+        os.close(savedFds[0])
+        os.close(savedFds[1])
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def makeEntry(self, sampleName, stages):
+        """
+        Manifest entry of a sample whose stages append their label to Runs.txt and exit with the given
+        status on each of their attempts in turn
+        """
+        outputPath = os.path.join(self.path, sampleName)
+        os.makedirs(outputPath)
+        entry = {"sample": sampleName, "outputPath": outputPath, "stages": []}
+        for label, exitStatuses in stages:
+            command = "cd %s && echo %s >> Runs.txt && echo >> %s.count && exit $(echo %s | cut -d' ' -f$(wc -l < %s.count))" % (
+                outputPath, label, label, " ".join(str(status) for status in exitStatuses), label)
+            entry["stages"].append({"label": label, "command": command})
+        return entry
+
+    def getRuns(self, entry):
+        runsPath = os.path.join(entry["outputPath"], "Runs.txt")
+        return open(runsPath).read().split() if os.path.exists(runsPath) else []
+
+    def testStatusOfCompleteSample(self):
+        entry = self.makeEntry("s1", [("Caller", [0]), ("Evaluate", [0])])
+        self.assertFalse(isComplete(entry))
+        self.assertEqual(runEntry(entry, 0), 0)
+        self.assertTrue(isComplete(entry))
+        status = readStatus(entry)
+        self.assertEqual((status["status"], status["attempts"], status["completedStages"]), ("complete", 2, ["Caller", "Evaluate"]))
+        # a complete sample is not rerun:
+        self.assertEqual(runEntry(entry, 0), 0)
+        self.assertEqual(self.getRuns(entry), ["Caller", "Evaluate"])
+
+    def testRetry(self):
+        entry = self.makeEntry("s1", [("Caller", [1, 2, 0]), ("Evaluate", [0])])
+        self.assertEqual(runQuietly(runEntry, entry, 2), 0)
+        self.assertEqual(self.getRuns(entry), ["Caller", "Caller", "Caller", "Evaluate"])
+        self.assertEqual(readStatus(entry)["attempts"], 4)
+
+    def testFailureKeepsCompletedStages(self):
+        entry = self.makeEntry("s1", [("Caller", [0]), ("Evaluate", [3, 3, 0])])
+        self.assertEqual(runQuietly(runEntry, entry, 1), 3)
+        status = readStatus(entry)
+        self.assertEqual((status["status"], status["stage"], status["exitStatus"], status["completedStages"]), ("failed", "Evaluate", 3, ["Caller"]))
+        self.assertEqual(runQuietly(reportFailures, [entry]), [entry])
+        # the retried sample only reruns the failed stage:
+        self.assertEqual(runEntry(entry, 0), 0)
+        self.assertEqual(self.getRuns(entry), ["Caller", "Evaluate", "Evaluate", "Evaluate"])
+        self.assertEqual(reportFailures([entry]), [])
+
+    def testStatusOfOtherConfiguration(self):
+        entry = self.makeEntry("s1", [("Caller", [0, 0]), ("Evaluate", [0, 0])])
+        entry["configHash"] = "aa01"
+        self.assertEqual(runEntry(entry, 0), 0)
+        self.assertTrue(isComplete(entry))
+        # the step folder is reused for another configuration, whose samples are run again:
+        entry["configHash"] = "bb02"
+        self.assertFalse(isComplete(entry))
+        self.assertEqual(readStatus(entry), None)
+        self.assertEqual(runEntry(entry, 0), 0)
+        self.assertEqual(self.getRuns(entry), ["Caller", "Evaluate", "Caller", "Evaluate"])
+        self.assertEqual(readStatus(entry)["configHash"], "bb02")
+
+    def testToRanges(self):
+        self.assertEqual(toRanges([5, 1, 2, 3, 7, 8]), [[1, 3], [5, 5], [7, 8]])
+        self.assertEqual(toRanges([]), [])
+
+    def testArrayJobResubmitsFailedSamples(self):
+        entries = [self.makeEntry("s1", [("Caller", [0])]), self.makeEntry("s2", [("Caller", [1, 0])]),
+                   self.makeEntry("s3", [("Caller", [1, 1, 1])])]
+        manifestPath = os.path.join(self.path, "Manifest.json")
+        writeManifest(manifestPath, entries, 1024, 1)
+        qsubPath = "%s %s qsub" % (sys.executable, os.path.splitext(SomaticCanvasBatch.__file__)[0] + ".py")
+        self.assertEqual(runQuietly(submitArrayJob, manifestPath, qsubPath, 1, "Test"), 1)
+        self.assertEqual([self.getRuns(entry) for entry in entries], [["Caller"], ["Caller", "Caller"], ["Caller", "Caller"]])
+        self.assertEqual(readStatus(entries[2])["status"], "failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+import os
+import sys
+import gzip
+import numpy
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasCallIndex import *
+
+CALLS_A = [("chr1", 1000, 2000, 3, "PASS"), ("chr1", 100, 500, 2, "PASS"), ("chr1", 200, 300, 1, "q10"), ("chr2", 50, 60, 2, "PASS")]
+CALLS_B = [("chr1", 100, 500, 2, "PASS"), ("chr1", 200, 300, 0, "PASS"), ("chr1", 3000, 4000, 1, "PASS")]
+
+
+class TestOverlapSlice(unittest.TestCase):
+
+    def testCallStartingBeforeTheRegion(self):
+        starts = numpy.array([100, 200, 1000])
+        maxEnds = numpy.maximum.accumulate(numpy.array([500, 300, 2000]))
+        # the call at 200-300 ends before the region but lies between calls that may overlap it:
+        self.assertEqual(overlapSlice(starts, maxEnds, 400, 450), (0, 2))
+        self.assertEqual(overlapSlice(starts, maxEnds, 600, 999), (2, 2))
+        self.assertEqual(overlapSlice(starts, maxEnds, 2000, 2000), (2, 3))
+        self.assertEqual(overlapSlice(starts, maxEnds, 2001, 5000), (3, 3))
+
+    def testParseRegion(self):
+        self.assertEqual(parseRegion("chr8:120,000,000-130000000"), ("chr8", 120000000, 130000000))
+        self.assertEqual(parseRegion("chrX")[0:2], ("chrX", 1))
+
+
+class TestCallIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = CallIndex(os.path.join(self.path, "Index"))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writeCalls(self, name, calls):
+        callsPath = os.path.join(self.path, name + ".vcf.gz")
+        with gzip.open(callsPath, "wb") as callsFile:
+            callsFile.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSample\n")
+            for chromosome, start, end, cn, callFilter in calls:
+                callsFile.write("%s\t%i\t.\tN\t<CNV>\t20\t%s\tSVTYPE=CNV;END=%i\tGT:CN\t./.:%i\n" % (chromosome, start, callFilter, end, cn))
+        return callsPath
+
+    def indexCallsets(self):
+        hashA = self.index.indexCalls("c1", "s1", self.writeCalls("A", CALLS_A))
+        self.assertEqual(self.index.indexCalls("c2", "s1", self.writeCalls("A2", CALLS_A)), hashA)
+        hashB = self.index.indexCalls("c3", "s1", self.writeCalls("B", CALLS_B))
+        return hashA, hashB
+
+    def testCallsetsAreStoredOnce(self):
+        hashA, hashB = self.indexCallsets()
+        self.assertNotEqual(hashA, hashB)
+        self.assertEqual(self.index.loadCallsets("s1"), {("c1", "s1"): hashA, ("c2", "s1"): hashA, ("c3", "s1"): hashB})
+        self.assertEqual(self.index.summary()[0:3], (3, 11, 2))
+        self.assertEqual([segment[0] for segment in self.index.loadSegments(callsHash=hashA)], ["chr1", "chr2"])
+
+    def testLoadCallsOfRegion(self):
+        hashA, hashB = self.indexCallsets()
+        segment = self.index.loadSegments("chr1")[hashA]
+        calls = self.index.loadCalls(segment, 400, 450)
+        self.assertEqual((list(calls["start"]), list(calls["end"]), list(calls["cn"])), ([100], [500], [2]))
+        calls = self.index.loadCalls(segment)
+        self.assertEqual(list(calls["start"]), [100, 200, 1000])
+        self.assertEqual(list(calls["filter"]), ["PASS", "q10", "PASS"])
+
+    def testFindRegionVariants(self):
+        self.indexCallsets()
+        variants = findRegionVariants(self.index, "s1", "chr1:250-260")
+        self.assertEqual([(calls, sorted(configHashes)) for calls, configHashes in variants],
+                         [(("chr1:100-500 CN=2 PASS", "chr1:200-300 CN=1 q10"), ["c1", "c2"]),
+                          (("chr1:100-500 CN=2 PASS", "chr1:200-300 CN=0 PASS"), ["c3"])])
+        # a callset without calls on the chromosome has no variant in the region:
+        variants = findRegionVariants(self.index, "s1", "chr2:1-100")
+        self.assertEqual([(calls, sorted(configHashes)) for calls, configHashes in variants],
+                         [(("chr2:50-60 CN=2 PASS",), ["c1", "c2"]), ((), ["c3"])])
+
+    def testFindRegionVariantsOfRun(self):
+        self.indexCallsets()
+        self.index.recordStep("Run", 0, "Parameter_A_1", "c3")
+        variants = findRegionVariants(self.index, "s1", "chr1:250-260", "Run")
+        self.assertEqual([configHashes for calls, configHashes in variants], [["c3"]])
+
+    def testDiffCalls(self):
+        hashA, hashB = self.indexCallsets()
+        nSame, onlyA, onlyB, changed = diffCalls(self.index, hashA, hashB)
+        self.assertEqual(nSame, 1)
+        self.assertEqual(onlyA, ["chr1:1000-2000 CN=3 PASS", "chr2:50-60 CN=2 PASS"])
+        self.assertEqual(onlyB, ["chr1:3000-4000 CN=1 PASS"])
+        self.assertEqual(changed, ["chr1:200-300 CN=1 q10 -> CN=0 PASS"])
+        self.assertEqual(diffCalls(self.index, hashA, hashA), (4, [], [], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasCrossValidation import *
+from SomaticCanvasResultsStore import getResultsStore
+from SomaticCanvasModelWorkflow import OptimizeSomaticCanvasWorkflow, ParseOptimizeSomaticCanvasWorkflow, addCrossValidationStep
+
+
+class Params:
+
+    def __init__(self, path, mode, sampleSize):
+        self.outputPath = os.path.join(path, "Output")
+        self.configPath = os.path.join(path, "Config")
+        self.sampleNames = ["s" + str(sampleIndex) for sampleIndex in range(sampleSize)]
+        self.sampleSize = sampleSize
+        self.crossValidationMode = mode
+        self.crossValidation = 0.2
+        self.crossValidationFolds = 3
+        self.crossValidationSeed = 0
+        self.nbestParams = 1
+        self.totalIterations = 1
+        self.iteration = 0
+        self.otimizationStep = 1
+
+
+class StubEngine:
+
+    def propose(self, parameterConfig, parameterConfigFile, history):
+        return [("A", 1, dict(parameterConfig, A=1)), ("B", 2, dict(parameterConfig, B=2))]
+
+
+def evaluateSteps(workflow):
+    """
+    Stand-in for FullWorkflow: record an accuracy of 50 + 10 * A + B on the samples of the step when it is added
+    """
+    def addWorkflowTask(taskID, fullWorkflow):
+        params = fullWorkflow.params
+        parameterStep = "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue)
+        with open(os.path.join(params.outputPath, "Iteration_" + str(params.iteration), parameterStep, "SomaticCallerParameters.json")) as configFile:
+            config = json.load(configFile)
+        accuracy = 50.0 + 10 * config["A"] + config["B"]
+        getResultsStore(params).recordSampleMetrics(params.iteration, parameterStep, dict((params.sampleNames[sampleIndex], {"Accuracy": accuracy, "DirectionAccuracy": accuracy})
+                                                                                          for sampleIndex in params.sampleIndices))
+        workflow.tasks.append((parameterStep, list(params.sampleIndices)))
+        return taskID
+    workflow.tasks = []
+    workflow.addWorkflowTask = addWorkflowTask
+    workflow.waitForTasks = lambda tasks: 0
+    return workflow
+
+
+class TestFolds(unittest.TestCase):
+
+    def testKFoldTestSetsPartitionSamples(self):
+        folds = getCrossValidationFolds(Params("", "kfold", 10))
+        self.assertEqual([fold[0] for fold in folds], ["Fold_0", "Fold_1", "Fold_2", ALL_SAMPLES_FOLD])
+        self.assertEqual(sorted(sum([fold[2] for fold in folds[0:3]], [])), range(10))
+        self.assertEqual(sorted(len(fold[2]) for fold in folds[0:3]), [3, 3, 4])
+        for foldName, trainIndices, testIndices in folds[0:3]:
+            self.assertEqual(sorted(trainIndices + testIndices), range(10))
+        self.assertEqual(folds[3], (ALL_SAMPLES_FOLD, range(10), []))
+
+    def testHoldout(self):
+        params = Params("", "holdout", 10)
+        folds = getCrossValidationFolds(params)
+        self.assertEqual([(fold[0], len(fold[1]), len(fold[2])) for fold in folds], [("Fold_0", 8, 2), (ALL_SAMPLES_FOLD, 10, 0)])
+        # at least one held-out and one training sample:
+        params.crossValidation = 0.01
+        self.assertEqual(len(getCrossValidationFolds(params)[0][2]), 1)
+        params.crossValidation = 0.99
+        self.assertEqual(len(getCrossValidationFolds(params)[0][1]), 1)
+
+    def testFoldsDependOnSeedOnly(self):
+        params = Params("", "kfold", 10)
+        folds = getCrossValidationFolds(params)
+        self.assertEqual(getCrossValidationFolds(params), folds)
+        params.crossValidationSeed = 1
+        self.assertNotEqual(getCrossValidationFolds(params), folds)
+
+    def testMoreFoldsThanSamples(self):
+        folds = getCrossValidationFolds(Params("", "kfold", 2))
+        self.assertEqual(sorted(fold[2] for fold in folds), [[], [0], [1]])
+        self.assertEqual(getCrossValidationFolds(Params("", "none", 10)), [])
+
+
+class TestSharedSteps(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.params = Params(self.path, "kfold", 6)
+        os.makedirs(self.params.configPath)
+        with open(getFoldConfigPath(self.params, -1, ALL_SAMPLES_FOLD), "w") as configFile:
+            json.dump({"A": 0, "B": 0}, configFile)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testSameConfigurationIsOneStep(self):
+        steps = {}
+        first = addCrossValidationStep(steps, "A", 1, {"A": 1}, [0, 1])
+        self.assertEqual(addCrossValidationStep(steps, "A", 1, {"A": 1}, [1, 2]), first)
+        self.assertNotEqual(addCrossValidationStep(steps, "A", 2, {"A": 2}, [3]), first)
+        self.assertEqual(sorted(sorted(sampleIndices) for stepParameter, label, value, config, sampleIndices in steps.values()), [[0, 1, 2], [3]])
+
+    def testFoldsShareCandidates(self):
+        workflow = evaluateSteps(OptimizeSomaticCanvasWorkflow(self.params))
+        folds = getCrossValidationFolds(self.params)
+        workflow.crossValidateCandidates(StubEngine(), folds)
+        # the folds start from the same configuration and apply the same mutations:
+        self.assertEqual(sorted(step[0].split("_")[1] for step in workflow.tasks), ["A", "B", "Base"])
+        for parameterStep, sampleIndices in workflow.tasks:
+            self.assertEqual(sampleIndices, range(6))
+        foldSteps = readCrossValidationFolds(self.params.outputPath, 0)
+        self.assertEqual(len(set(fold["base"] for fold in foldSteps)), 1)
+        self.assertEqual([len(fold["candidates"]) for fold in foldSteps], [2] * 4)
+
+    def testFinalSelectionIsScoredOnTestSamples(self):
+        folds = getCrossValidationFolds(self.params)
+        evaluateSteps(OptimizeSomaticCanvasWorkflow(self.params)).crossValidateCandidates(StubEngine(), folds)
+        workflow = evaluateSteps(ParseOptimizeSomaticCanvasWorkflow(self.params))
+        workflow.parseCrossValidation()
+        self.assertEqual(len(workflow.tasks), 1)
+        self.assertEqual(workflow.tasks[0][1], range(6))
+        for fold in folds:
+            self.assertEqual(json.load(open(getFoldConfigPath(self.params, 0, fold[0]))), {"A": 1, "B": 0})
+        lines = [line for line in readReport(os.path.join(self.params.outputPath, "CrossValidation.txt")) if line[0] == "Final"]
+        self.assertEqual([line[1] for line in lines], ["Fold_0", "Fold_1", "Fold_2", ALL_SAMPLES_FOLD, "Mean"])
+        self.assertEqual([line[6] for line in lines], ["60.0000"] * 3 + ["nan", "60.0000"])
+
+    def testNoFinalScoringBeforeLastIteration(self):
+        self.params.totalIterations = 2
+        folds = getCrossValidationFolds(self.params)
+        evaluateSteps(OptimizeSomaticCanvasWorkflow(self.params)).crossValidateCandidates(StubEngine(), folds)
+        workflow = evaluateSteps(ParseOptimizeSomaticCanvasWorkflow(self.params))
+        workflow.parseCrossValidation()
+        self.assertEqual(workflow.tasks, [])
+        self.assertEqual([line[0] for line in readReport(os.path.join(self.params.outputPath, "CrossValidation.txt"))], ["0"] * 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
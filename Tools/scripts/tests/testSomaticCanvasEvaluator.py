@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import os
+import sys
+import numpy
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasEvaluator import *
+
+# EvaluateCNV TruthSet CNV.vcf.gz ExcludedRegions.bed outputDir, run with its default options:
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "EvaluateCNV")
+
+
+def getDataFile(name):
+    return os.path.join(DATA_PATH, name)
+
+
+class TestEvaluateCNVParity(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def checkParity(self, truthSetName, resultsName):
+        index = SampleEvaluationIndex(getDataFile(truthSetName), getDataFile("ExcludedRegions.bed"))
+        calls, results = index.evaluate(getDataFile("CNV.vcf.gz"))
+        self.assertEqual(compareResults(results, getDataFile(resultsName)), [])
+        outFilePath = os.path.join(self.path, "Results.txt")
+        index.writeResults(getDataFile("CNV.vcf.gz"), outFilePath)
+        self.assertEqual(open(outFilePath).read(), open(getDataFile(resultsName)).read())
+
+    def testTruthVcf(self):
+        self.checkParity("TruthSet.vcf", "EvaluateCNVResults.txt")
+
+    def testTruthBed(self):
+        self.checkParity("TruthSet.bed", "EvaluateCNVResultsBedTruth.txt")
+
+    def testCompareReportsDifferences(self):
+        index = SampleEvaluationIndex(getDataFile("TruthSet.vcf"), None)
+        calls, results = index.evaluate(getDataFile("CNV.vcf.gz"))
+        differences = compareResults(results, getDataFile("EvaluateCNVResults.txt"))
+        self.assertTrue("Accuracy" in [metric for metric, ours, theirs in differences])
+
+
+class TestExcludeIntervals(unittest.TestCase):
+
+    def testVectorizedMatchesSequential(self):
+        intervals = ExcludeIntervals(numpy.array([100, 300, 1000]), numpy.array([200, 900, 1100]))
+        self.assertTrue(intervals.isSortedDisjoint)
+        starts = numpy.array([0, 150, 250, 950, 2000])
+        ends = numpy.array([1200, 400, 950, 1050, 3000])
+        expected = [intervals.excludeSequential(start, end) for start, end in zip(starts, ends)]
+        self.assertEqual(list(intervals.exclude(starts, ends)), expected)
+        self.assertEqual(expected, [1200, 150, 700, 50, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import os
+import sys
+import gzip
+import numpy
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasFidelity import *
+
+RECORDS = "#chrom\tstart\tend\ntrack name=calls\nchr1\t100\t200\nchr8\t100\t200\n8\t300\t400\n\nchr10\t100\t200\nchr18\t100\t200\n"
+
+
+class TestRanks(unittest.TestCase):
+
+    def testTiesGetAverageRanks(self):
+        self.assertEqual(list(rankValues([10, 20, 20, 30])), [1.0, 2.5, 2.5, 4.0])
+        self.assertEqual(list(rankValues([3.0, 1.0, 2.0])), [3.0, 1.0, 2.0])
+        self.assertEqual(list(rankValues([5, 5, 5])), [2.0, 2.0, 2.0])
+
+    def testSpearmanCorrelation(self):
+        self.assertAlmostEqual(spearmanCorrelation([1, 2, 3, 4], [1, 8, 27, 64]), 1.0)
+        self.assertAlmostEqual(spearmanCorrelation([1, 2, 3, 4], [4, 3, 2, 1]), -1.0)
+        # Pearson correlation of the average ranks [1, 2.5, 2.5, 4] and [1, 2, 3, 4]:
+        self.assertAlmostEqual(spearmanCorrelation([0.1, 0.5, 0.5, 0.9], [1, 2, 3, 4]), numpy.sqrt(0.9))
+
+    def testSpearmanWithoutVariation(self):
+        self.assertTrue(numpy.isnan(spearmanCorrelation([1, 1, 1], [1, 2, 3])))
+        self.assertTrue(numpy.isnan(spearmanCorrelation([1], [1])))
+
+
+class TestSubsetFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testPlainFile(self):
+        source = os.path.join(self.path, "calls.bed")
+        target = os.path.join(self.path, "subset.bed")
+        with open(source, "w") as sourceFile:
+            sourceFile.write(RECORDS)
+        self.assertEqual(subsetFile(source, target, parseChromosomes("chr8,1")), (3, 5))
+        self.assertFalse(isGzip(target))
+        self.assertEqual(open(target).read(), "#chrom\tstart\tend\ntrack name=calls\nchr1\t100\t200\nchr8\t100\t200\n8\t300\t400\n")
+
+    def testGzipFile(self):
+        source = os.path.join(self.path, "calls.txt.gz")
+        target = os.path.join(self.path, "subset.txt.gz")
+        with gzip.open(source, "wb") as sourceFile:
+            sourceFile.write(RECORDS)
+        self.assertEqual(subsetFile(source, target, parseChromosomes("chr18")), (1, 5))
+        self.assertTrue(isGzip(target))
+        self.assertEqual(gzip.open(target).read(), "#chrom\tstart\tend\ntrack name=calls\nchr18\t100\t200\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
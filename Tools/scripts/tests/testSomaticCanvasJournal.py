@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasJournal import *
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.journalPath = getJournalPath(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writeEvents(self, journal):
+        journal.recordProposals(0, [("Parameter_A_1", "A", 1, {"A": 1}), ("Parameter_A_2", "A", 2, {"A": 2})])
+        journal.recordEvaluation(0, "Parameter_A_1", ["s2", "s1"], "ab01")
+        journal.recordBest(0, {"A": 1}, 0.5)
+        journal.recordProposals(1, [("Parameter_B_1", "B", 1, {"A": 1, "B": 1})])
+        journal.recordEvaluation(1, "Parameter_B_1", ["s1"], "cd02")
+
+    def testReplay(self):
+        self.writeEvents(OptimizerJournal(self.journalPath))
+        state = OptimizerJournal(self.journalPath).state
+        self.assertEqual([step["step"] for step in state.getProposals(0)], ["Parameter_A_1", "Parameter_A_2"])
+        self.assertEqual(state.getProposals(2), None)
+        self.assertEqual(state.getEvaluatedSamples(0, "Parameter_A_1"), {"s1": "ab01", "s2": "ab01"})
+        self.assertEqual(state.getEvaluatedSamples(0, "Parameter_A_2"), {})
+        self.assertEqual(state.getBest(0), ({"A": 1}, 0.5))
+        self.assertEqual(state.getCompletedIterations(), 1)
+
+    def testEvaluationsCarryNoMetrics(self):
+        OptimizerJournal(self.journalPath).recordEvaluation(0, "Parameter_A_1", ["s1"], "ab01")
+        events, intactLength = readEvents(self.journalPath)
+        self.assertEqual(events, [{"event": "evaluation", "iteration": "0", "step": "Parameter_A_1", "samples": ["s1"], "configHash": "ab01"}])
+
+    def testTornLineIsTruncated(self):
+        self.writeEvents(OptimizerJournal(self.journalPath))
+        intactSize = os.path.getsize(self.journalPath)
+        with open(self.journalPath, "a") as journalFile:
+            journalFile.write(json.dumps({"event": "best", "iteration": "1", "fold": None, "config": {}, "score": 0.7})[0:25])
+        journal = OptimizerJournal(self.journalPath)
+        self.assertEqual(os.path.getsize(self.journalPath), intactSize)
+        self.assertEqual(journal.state.getCompletedIterations(), 1)
+        # events appended after the cut replay as usual:
+        journal.recordBest(1, {"B": 1}, 0.7)
+        self.assertEqual(OptimizerJournal(self.journalPath).state.getCompletedIterations(), 2)
+
+    def testCorruptLineBeforeTheEnd(self):
+        self.writeEvents(OptimizerJournal(self.journalPath))
+        lines = open(self.journalPath).readlines()
+        lines[1] = lines[1][0:10] + "\n"
+        with open(self.journalPath, "w") as journalFile:
+            journalFile.writelines(lines)
+        self.assertRaises(Exception, OptimizerJournal, self.journalPath)
+
+    def testMissingJournal(self):
+        self.assertEqual(readEvents(self.journalPath), ([], 0))
+        self.assertEqual(OptimizerJournal(self.journalPath).state.getCompletedIterations(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import numpy
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasModelWorkflow import *
+
+
+class Params:
+
+    def __init__(self, path):
+        self.outputPath = os.path.join(path, "Output")
+        self.configPath = os.path.join(path, "Config")
+        self.sampleNames = ["s0", "s1"]
+        self.sampleSize = 2
+        self.searchEngine = "random"
+        self.searchSeed = 1
+        self.modelParametersSet = {"A": [0, 100], "B": [0.0, 1.0]}
+        self.asyncInFlight = 2
+        self.asyncEvaluations = 6
+        self.pollInterval = 0.01
+        os.makedirs(self.configPath)
+        writeModelParameters(os.path.join(self.configPath, "SomaticCallerParameters.json"), {"A": 50, "B": 0.5})
+
+
+class EngineParams:
+
+    def __init__(self, searchEngine, iteration=0):
+        self.searchEngine = searchEngine
+        self.searchSeed = 1
+        self.iteration = iteration
+        self.proposalsPerIteration = 4
+        self.modelParametersSet = {"A": [0, 3], "B": [0, 1]}
+
+
+class TestProposalEngines(unittest.TestCase):
+
+    def propose(self, params, history, pending=()):
+        return getProposalEngine(params).propose({"A": 1, "B": 0}, None, history, pending)
+
+    def testStartingConfigurationWithoutHistory(self):
+        proposals = self.propose(EngineParams("random"), [])
+        self.assertEqual(proposals[0], ("Proposal", 0, {"A": 1, "B": 0}))
+        self.assertEqual([proposal[1] for proposal in proposals], range(4))
+        # once evaluated or in flight, it is not proposed again:
+        for history, pending in [([({"A": 1, "B": 0}, 50.0)], []), ([], [{"A": 1, "B": 0}])]:
+            self.assertNotIn({"A": 1, "B": 0}, [config for label, index, config in self.propose(EngineParams("random"), history, pending)])
+
+    def testProposalsAreNew(self):
+        history = [({"A": 0, "B": 0}, 10.0), ({"A": 3, "B": 1}, 20.0)]
+        pending = [{"A": 2, "B": 1}]
+        for searchEngine in ["random", "tpe"]:
+            params = EngineParams(searchEngine)
+            # 8 configurations in the bounds, 3 of them evaluated or in flight:
+            params.proposalsPerIteration = 8
+            configs = [config for label, index, config in self.propose(params, history, pending)]
+            self.assertEqual(len(configs), 5)
+            self.assertEqual(len(set(hashConfig(config) for config in configs)), 5)
+            for config in configs:
+                self.assertNotIn(config, [config for config, score in history] + pending)
+                self.assertTrue(0 <= config["A"] <= 3 and 0 <= config["B"] <= 1)
+
+    def testSeededPerIteration(self):
+        params = EngineParams("tpe")
+        params.modelParametersSet = {"A": [0.0, 1.0], "B": [0.0, 1.0]}
+        proposals = self.propose(params, [])
+        self.assertEqual(self.propose(EngineParams("tpe"), []), self.propose(EngineParams("tpe"), []))
+        self.assertEqual(self.propose(params, []), proposals)
+        params.iteration = 1
+        self.assertNotEqual(self.propose(params, []), proposals)
+        params.iteration = 0
+        params.searchSeed = 2
+        self.assertNotEqual(self.propose(params, []), proposals)
+
+    def testExpectedImprovementRanking(self):
+        params = EngineParams("tpe")
+        params.modelParametersSet = {"A": [0.0, 1.0], "B": [0.0, 1.0]}
+        engine = getProposalEngine(params)
+        random = numpy.random.RandomState(0)
+        # the score peaks at A = 0.8, B = 0.2:
+        history = [({"A": a, "B": b}, -abs(a - 0.8) - abs(b - 0.2)) for a, b in random.uniform(size=(20, 2))]
+        candidates = engine.sampleCandidates(history, params.proposalsPerIteration)
+        self.assertEqual(len(candidates), engine.nCandidates)
+        observations = numpy.array([engine.toUnit(config) for config, score in history])
+        order = numpy.argsort([-score for config, score in history])
+        good, bad = observations[order[:5]], observations[order[5:]]
+        expectedImprovement = engine.logDensity(candidates, good) - engine.logDensity(candidates, bad)
+        self.assertTrue(numpy.all(numpy.diff(expectedImprovement) <= 1e-9))
+        # the best ranked candidates are closer to the best configurations than the worst ranked ones:
+        distances = numpy.abs(candidates - [0.8, 0.2]).sum(axis=1)
+        self.assertLess(distances[:10].mean(), distances[-10:].mean())
+
+
+class StepEvaluations:
+    """
+    Stand-in for the FullWorkflow tasks of a workflow: a step is evaluated, with the accuracy A on
+    every sample, when the workflow waits for it. Steps complete in the order they were added.
+    """
+
+    def __init__(self, workflow):
+        self.inFlight = []
+        self.maxInFlight = 0
+        self.added = []
+        workflow.addWorkflowTask = self.addWorkflowTask
+        workflow.waitForAnyTask = self.waitForAnyTask
+
+    def addWorkflowTask(self, taskID, fullWorkflow):
+        params = fullWorkflow.params
+        parameterStep = "Parameter_" + params.currentParameter + "_" + str(params.currentParameterValue)
+        self.inFlight.append((taskID, params, parameterStep))
+        self.added.append(parameterStep)
+        self.maxInFlight = max(self.maxInFlight, len(self.inFlight))
+        return taskID
+
+    def evaluate(self, params, parameterStep):
+        with open(os.path.join(params.outputPath, "Iteration_" + str(params.iteration), parameterStep, "SomaticCallerParameters.json")) as configFile:
+            config = json.load(configFile)
+        getResultsStore(params).recordSampleMetrics(params.iteration, parameterStep, dict((sampleName, {"Accuracy": float(config["A"]), "DirectionAccuracy": 1.0})
+                                                                                          for sampleName in params.sampleNames))
+        getJournal(params).recordEvaluation(params.iteration, parameterStep, params.sampleNames, hashConfig(config))
+
+    def waitForAnyTask(self, labels):
+        taskID, params, parameterStep = self.inFlight.pop(0)
+        self.evaluate(params, parameterStep)
+        return [taskID]
+
+
+class TestAsyncOptimization(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.params = Params(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def optimize(self):
+        workflow = AsyncOptimizeSomaticCanvasWorkflow(self.params)
+        evaluations = StepEvaluations(workflow)
+        workflow.workflow()
+        return evaluations
+
+    def testInFlightAndBudget(self):
+        evaluations = self.optimize()
+        self.assertEqual(evaluations.maxInFlight, 2)
+        self.assertEqual(evaluations.added, ["Parameter_Candidate_" + str(candidateIndex) for candidateIndex in range(6)])
+        history = loadEvaluationHistory(self.params)
+        self.assertEqual(len(history), 6)
+        # the starting configuration is evaluated first:
+        self.assertEqual(history[0][0], {"A": 50, "B": 0.5})
+        bestConfig, bestScore = max(history, key=lambda evaluation: evaluation[1])
+        self.assertEqual(readModelParameters(os.path.join(self.params.outputPath, "Best", "SomaticCallerParameters.json")), bestConfig)
+        self.assertEqual(float(open(os.path.join(self.params.outputPath, "Best", "Score.txt")).read()), bestScore)
+
+    def testSeededProposals(self):
+        self.optimize()
+        configs = [config for config, score in loadEvaluationHistory(self.params)]
+        otherParams = Params(os.path.join(self.path, "Other"))
+        self.params = otherParams
+        self.optimize()
+        self.assertEqual([config for config, score in loadEvaluationHistory(otherParams)], configs)
+
+    def testUnfinishedCandidatesAreEvaluatedAfterRestart(self):
+        workflow = AsyncOptimizeSomaticCanvasWorkflow(self.params)
+        evaluations = StepEvaluations(workflow)
+        # the run stops with two candidates in flight:
+        evaluations.waitForAnyTask = lambda labels: self.fail("interrupted")
+        workflow.waitForAnyTask = evaluations.waitForAnyTask
+        self.assertRaises(AssertionError, workflow.workflow)
+        self.assertEqual(evaluations.added, ["Parameter_Candidate_0", "Parameter_Candidate_1"])
+        evaluations = self.optimize()
+        self.assertEqual(evaluations.added, ["Parameter_Candidate_" + str(candidateIndex) for candidateIndex in range(6)])
+        self.assertEqual(len(loadEvaluationHistory(self.params)), 6)
+
+
+class StubWorkflow:
+    """
+    pyflow's waitForTasks() on tasks completed by the test
+    """
+
+    def __init__(self):
+        self.events = {}
+        self.retvals = {}
+
+    def addTask(self, label):
+        self.events[label] = threading.Event()
+
+    def finish(self, label, retval=0):
+        self.retvals[label] = retval
+        self.events[label].set()
+
+    def waitForTasks(self, label):
+        self.events[label].wait()
+        return self.retvals[label]
+
+
+class TestAnyTaskWaiter(unittest.TestCase):
+
+    def testReturnsFirstCompletedTasks(self):
+        wflow = StubWorkflow()
+        for label in ["t1", "t2", "t3"]:
+            wflow.addTask(label)
+        waiter = AnyTaskWaiter(wflow, 0.01)
+        threading.Timer(0.05, wflow.finish, ["t2"]).start()
+        self.assertEqual(waiter.wait(["t1", "t2", "t3"]), ["t2"])
+        wflow.finish("t3")
+        self.assertEqual(waiter.wait(["t1", "t3"]), ["t3"])
+        wflow.finish("t1")
+        self.assertEqual(waiter.wait(["t1"]), ["t1"])
+
+    def testFailureStopsWaiting(self):
+        wflow = StubWorkflow()
+        for label in ["t1", "t2"]:
+            wflow.addTask(label)
+        waiter = AnyTaskWaiter(wflow, 0.01)
+        threading.Timer(0.05, wflow.finish, ["t1", 1]).start()
+        self.assertRaises(Exception, waiter.wait, ["t1", "t2"])
+        wflow.finish("t2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasNativeExecutor import *
+
+
+class TaskListWorkflow:
+    """
+    Workflow adding command tasks (label, command, options) and waiting for some of them
+    """
+
+    def __init__(self, tasks, waitedLabels=None):
+        self.tasks = tasks
+        self.waitedLabels = waitedLabels
+        self.waitStatus = None
+
+    def workflow(self):
+        for label, command, options in self.tasks:
+            self.addTask(label, command, **options)
+        self.waitStatus = self.waitForTasks(self.waitedLabels)
+
+
+class TestNativeExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.logPath = os.path.join(self.path, "Tasks.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def getConcurrency(self, eventsPath):
+        """
+        Largest number of tasks running at once from the start and end events they appended
+        """
+        running = concurrency = 0
+        for event in open(eventsPath).read().split():
+            running += 1 if event == "start" else -1
+            concurrency = max(concurrency, running)
+        return concurrency
+
+    def makeTasks(self, nTasks, **options):
+        eventsPath = os.path.join(self.path, "Events.txt")
+        command = "echo start >> %s; sleep 0.2; echo end >> %s" % (eventsPath, eventsPath)
+        return eventsPath, [("Task_%i" % i, command, options) for i in range(nTasks)]
+
+    def testFailureStopsWaitingTasks(self):
+        workflow = TaskListWorkflow([("A", "sleep 0.3; false", {"retryMax": 0}), ("B", "true", {})], ["B"])
+        executor = NativeExecutor(1, 1024, self.logPath, retryMode="all")
+        self.assertEqual(executor.run(workflow), 1)
+        self.assertEqual(workflow.waitStatus, 1)
+        self.assertEqual((executor.tasks["root+A"].state, executor.tasks["root+B"].state), ("error", "error"))
+
+    def testRetry(self):
+        countPath = os.path.join(self.path, "Attempts.txt")
+        command = "echo >> %s; test $(wc -l < %s) -ge 3" % (countPath, countPath)
+        workflow = TaskListWorkflow([("A", command, {"retryMax": 2, "retryWait": 0})])
+        self.assertEqual(NativeExecutor(1, 1024, self.logPath, retryMode="all").run(workflow), 0)
+        self.assertEqual((workflow.waitStatus, len(open(countPath).readlines())), (0, 3))
+
+    def testRetryMax(self):
+        workflow = TaskListWorkflow([("A", "false", {"retryMax": 1, "retryWait": 0})])
+        self.assertEqual(NativeExecutor(1, 1024, self.logPath, retryMode="all").run(workflow), 1)
+
+    def testCoreLimit(self):
+        eventsPath, tasks = self.makeTasks(4)
+        self.assertEqual(NativeExecutor(2, 4096, self.logPath).run(TaskListWorkflow(tasks)), 0)
+        self.assertEqual(self.getConcurrency(eventsPath), 2)
+
+    def testMemoryLimit(self):
+        eventsPath, tasks = self.makeTasks(3, memMb=600)
+        self.assertEqual(NativeExecutor(4, 1024, self.logPath).run(TaskListWorkflow(tasks)), 0)
+        self.assertEqual(self.getConcurrency(eventsPath), 1)
+
+    def testOversizedTask(self):
+        workflow = TaskListWorkflow([("A", "true", {"nCores": 2})])
+        self.assertEqual(NativeExecutor(1, 1024, self.logPath).run(workflow), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
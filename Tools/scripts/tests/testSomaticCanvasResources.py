@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SomaticCanvasResources
+from SomaticCanvasResources import *
+from SomaticCanvasTelemetry import appendRecord, readNewRecords
+
+
+def makeRecord(sample, maxRssMb, kind="CanvasSomaticCaller", exitStatus=0, memMb=None):
+    return {"kind": kind, "sample": sample, "maxRssMb": maxRssMb, "exitStatus": exitStatus, "memMb": memMb,
+            "wallSeconds": 10.0, "userSeconds": 20.0, "systemSeconds": 0.0}
+
+
+class Params:
+
+    def __init__(self, outputPath):
+        self.outputPath = outputPath
+        self.taskSizing = "adaptive"
+        self.maxTaskMemoryMb = 32768
+        self.maxTaskCores = 4
+        self.memoryCore = 4096
+        self.sampleNames = ["s1"]
+        self.sampleDataPath = [outputPath]
+
+
+class TestTaskSizingModel(unittest.TestCase):
+
+    def testFit(self):
+        model = TaskSizingModel([makeRecord("s1", 2000), makeRecord("s2", 3000), makeRecord("s3", 4000)], 32768, 4)
+        sampleInputMb = {"s1": 100.0, "s2": 200.0, "s3": 300.0, "s4": 1000.0}
+        intercept, slope = model.fit("CanvasSomaticCaller", sampleInputMb)
+        self.assertAlmostEqual(intercept, 1000.0)
+        self.assertAlmostEqual(slope, 10.0)
+        self.assertEqual(model.memory("CanvasSomaticCaller", "s4", sampleInputMb), roundUpMemory(MEMORY_MARGIN * 11000))
+        self.assertEqual(model.cores("CanvasSomaticCaller"), 2)
+
+    def testObservedPeakIsFloor(self):
+        model = TaskSizingModel([makeRecord("s1", 5000)], 32768, 4)
+        self.assertEqual(model.memory("CanvasSomaticCaller", "s1", {"s1": 1.0}), roundUpMemory(MEMORY_MARGIN * 5000))
+
+    def testOutOfMemoryDoubles(self):
+        model = TaskSizingModel([makeRecord("s1", 3900, exitStatus=137, memMb=4096)], 32768, 4)
+        self.assertEqual(model.observedMemMb[("CanvasSomaticCaller", "s1")], 8192)
+
+    def testAddRecordsRefits(self):
+        model = TaskSizingModel([makeRecord("s1", 2000), makeRecord("s2", 3000)], 32768, 4)
+        sampleInputMb = {"s1": 100.0, "s2": 200.0, "s3": 300.0}
+        self.assertEqual(model.fit("CanvasSomaticCaller", sampleInputMb), None)
+        model.addRecords([makeRecord("s3", 4000)])
+        self.assertNotEqual(model.fit("CanvasSomaticCaller", sampleInputMb), None)
+
+
+class TestIncrementalTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.telemetryFile = os.path.join(self.path, "Telemetry.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        SomaticCanvasResources._sizingModels.clear()
+
+    def testReadNewRecords(self):
+        self.assertEqual(readNewRecords(self.telemetryFile, 0), ([], 0))
+        appendRecord(self.telemetryFile, makeRecord("s1", 1000))
+        records, offset = readNewRecords(self.telemetryFile, 0)
+        self.assertEqual(len(records), 1)
+        appendRecord(self.telemetryFile, makeRecord("s2", 2000))
+        with open(self.telemetryFile, "a") as outFile:
+            outFile.write(json.dumps(makeRecord("s3", 3000))[0:20])
+        records, offset = readNewRecords(self.telemetryFile, offset)
+        self.assertEqual([record["sample"] for record in records], ["s2"])
+        # the partial line is read once it is complete:
+        with open(self.telemetryFile, "a") as outFile:
+            outFile.write(json.dumps(makeRecord("s3", 3000))[20:] + "\n")
+        records, offset = readNewRecords(self.telemetryFile, offset)
+        self.assertEqual([record["sample"] for record in records], ["s3"])
+        self.assertEqual(offset, os.path.getsize(self.telemetryFile))
+
+    def testModelPerOutputPath(self):
+        params = Params(self.path)
+        lowParams = Params(os.path.join(self.path, "LowFidelity"))
+        os.makedirs(lowParams.outputPath)
+        model = getTaskSizingModel(params)
+        self.assertTrue(getTaskSizingModel(lowParams) is not model)
+        appendRecord(self.telemetryFile, makeRecord("s1", 6000))
+        self.assertTrue(getTaskSizingModel(params) is model)
+        self.assertEqual(model.observedMemMb[("CanvasSomaticCaller", "s1")], 6000)
+        self.assertEqual(getTaskSizingModel(lowParams).observedMemMb, {})
+        memMb, nCores = getTaskResources(params, "CanvasSomaticCaller", 0)
+        self.assertEqual(memMb, roundUpMemory(MEMORY_MARGIN * 6000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasResultCache import *
+
+
+class TestParameterNormalization(unittest.TestCase):
+
+    def testEquivalentValues(self):
+        self.assertEqual(normalizeParameterValue(1), normalizeParameterValue(1.0))
+        self.assertEqual(normalizeParameterValue(1), normalizeParameterValue("1.0"))
+        self.assertEqual(normalizeParameterValue(0.25), normalizeParameterValue("0.25"))
+        self.assertNotEqual(normalizeParameterValue(0.25), normalizeParameterValue(0.3))
+
+    def testNonFiniteValues(self):
+        self.assertEqual(normalizeParameterValue(float("inf")), "inf")
+        self.assertEqual(normalizeParameterValue("-inf"), "-inf")
+        self.assertEqual(normalizeParameterValue(float("nan")), "nan")
+
+    def testKeyOrder(self):
+        self.assertEqual(hashConfig({"A": 1, "B": "x", "C": 0.5}), hashConfig({"C": "0.5", "B": "x", "A": 1.0}))
+        self.assertNotEqual(hashConfig({"A": 1}), hashConfig({"A": 2}))
+
+
+class TestInputKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writeFile(self, name, content):
+        with open(os.path.join(self.path, name), "w") as outFile:
+            outFile.write(content)
+        return os.path.join(self.path, name)
+
+    def testCopiedInputKeepsKey(self):
+        source = self.writeFile("a.txt", "chr1\t1\t100\n")
+        copy = os.path.join(self.path, "b.txt")
+        shutil.copy(source, copy)
+        self.assertEqual(describeInput(source), describeInput(copy))
+
+    def testRegeneratedInputChangesKey(self):
+        path = self.writeFile("a.txt", "chr1\t1\t100\n")
+        stat = os.stat(path)
+        before = describeInput(path)
+        # same size and whole-second mtime, different content:
+        self.writeFile("a.txt", "chr2\t1\t100\n")
+        os.utime(path, (stat.st_atime, stat.st_mtime + 0.5))
+        self.assertNotEqual(before, describeInput(path))
+
+    def testMissingInput(self):
+        self.assertEqual(describeInput(os.path.join(self.path, "missing")), [os.path.join(self.path, "missing"), None])
+
+    def testReferenceKey(self):
+        self.writeFile("GenomeSize.xml", "<SequenceSizes/>")
+        self.writeFile("genome.fa", ">chr1\nACGT\n")
+        before = describeReference(self.path)
+        self.writeFile("genome.fa", ">chr1\nACGTACGT\n")
+        self.assertNotEqual(before, describeReference(self.path))
+        before = describeReference(self.path)
+        self.writeFile("GenomeSize.xml", "<SequenceSizes></SequenceSizes>")
+        self.assertNotEqual(before, describeReference(self.path))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.path, "Cache"), 1)
+        self.outputPath = os.path.join(self.path, "Output")
+        os.makedirs(self.outputPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def storeEntry(self, key, size, lastUsed):
+        with open(os.path.join(self.outputPath, "Results.txt"), "w") as outFile:
+            outFile.write("x" * size)
+        self.cache.store("evaluate", key, self.outputPath, EVALUATE_FILES)
+        manifestPath = os.path.join(self.cache.entryPath("evaluate", key), "entry.json")
+        os.utime(manifestPath, (lastUsed, lastUsed))
+
+    def testStoreAndRestore(self):
+        self.storeEntry("ab01", 10, time.time())
+        restorePath = os.path.join(self.path, "Restored")
+        os.makedirs(restorePath)
+        self.assertTrue(self.cache.restore("evaluate", "ab01", restorePath))
+        self.assertEqual(open(os.path.join(restorePath, "Results.txt")).read(), "x" * 10)
+        self.assertFalse(self.cache.restore("evaluate", "cd02", restorePath))
+
+    def testEvictLeastRecentlyUsed(self):
+        now = time.time()
+        self.storeEntry("aa01", 600 << 10, now - 300)
+        self.storeEntry("bb02", 600 << 10, now - 100)
+        self.storeEntry("cc03", 300 << 10, now - 200)
+        # 1.5 MB in a 1 MB cache: the oldest entry goes
+        self.assertEqual(self.cache.evict(), 900 << 10)
+        self.assertFalse(self.cache.contains("evaluate", "aa01"))
+        self.assertTrue(self.cache.contains("evaluate", "bb02"))
+        self.assertTrue(self.cache.contains("evaluate", "cc03"))
+
+    def testRestoreWaitsForLock(self):
+        self.storeEntry("ab01", 10, time.time())
+        restorePath = os.path.join(self.path, "Restored")
+        os.makedirs(restorePath)
+        lockFile = self.cache._lock()
+        restored = []
+        restoreThread = threading.Thread(target=lambda: restored.append(self.cache.restore("evaluate", "ab01", restorePath)))
+        restoreThread.start()
+        restoreThread.join(0.2)
+        self.assertEqual(restored, [])
+        lockFile.close()
+        restoreThread.join()
+        self.assertEqual(restored, [True])
+
+    def testRestoreMarksUsed(self):
+        now = time.time()
+        self.storeEntry("aa01", 600 << 10, now - 300)
+        self.storeEntry("bb02", 600 << 10, now - 100)
+        restorePath = os.path.join(self.path, "Restored")
+        os.makedirs(restorePath)
+        self.cache.restore("evaluate", "aa01", restorePath)
+        self.cache.evict()
+        self.assertTrue(self.cache.contains("evaluate", "aa01"))
+        self.assertFalse(self.cache.contains("evaluate", "bb02"))
+
+
+if __name__ == "__main__":
+    unittest.main()
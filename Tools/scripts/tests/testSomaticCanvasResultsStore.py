@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import os
+import sys
+import numpy
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasResultsStore import *
+
+
+def makeTable(rows):
+    """
+    ResultsTable of (iteration, step, sample, accuracy) rows
+    """
+    values = numpy.zeros((len(rows), len(EVALUATE_CNV_METRICS)))
+    values[:, EVALUATE_CNV_METRICS.index("Accuracy")] = [row[3] for row in rows]
+    return ResultsTable([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows], values)
+
+
+class TestPromotion(unittest.TestCase):
+
+    def testBestFractionInCandidateOrder(self):
+        scores = [(0.5, 0.5), (0.9, 0.1), (0.1, 0.9), (0.7, 0.7), (0.8, 0.8), (0.2, 0.2)]
+        self.assertEqual(promoteCandidates(scores, 1, 3), [1, 4])
+
+    def testAtLeastMinimum(self):
+        scores = [(0.5, 0.5), (0.9, 0.1), (0.1, 0.9), (0.7, 0.7)]
+        self.assertEqual(promoteCandidates(scores, 3, 3), [0, 1, 3])
+        self.assertEqual(promoteCandidates(scores, 10, 3), [0, 1, 2, 3])
+
+    def testDirectionAccuracyBreaksTies(self):
+        scores = [(0.5, 0.1), (0.5, 0.9), (0.4, 1.0)]
+        self.assertEqual(promoteCandidates(scores, 1, 3), [1])
+
+    def testEqualScoresKeepEarlierCandidate(self):
+        scores = [(0.3, 0.3), (0.5, 0.5), (0.5, 0.5), (0.5, 0.5)]
+        self.assertEqual(promoteCandidates(scores, 1, 2), [1, 2])
+
+    def testRoundsUp(self):
+        self.assertEqual(len(promoteCandidates([(k, k) for k in range(7)], 1, 3)), 3)
+        self.assertEqual(promoteCandidates([], 1, 3), [])
+
+
+class TestResultsTable(unittest.TestCase):
+
+    def testMediansAndMeans(self):
+        table = makeTable([("0", "B", "s1", 0.9), ("0", "A", "s1", 0.4), ("0", "A", "s2", 0.1),
+                           ("0", "B", "s2", 0.2), ("0", "A", "s3", 1.0), ("0", "B", "s3", 0.5),
+                           ("0", "B", "s4", 0.3)])
+        medians, means = table.stepSummary("Accuracy")
+        self.assertEqual(list(table.stepNames), ["A", "B"])
+        numpy.testing.assert_allclose(medians, [0.4, 0.4])
+        numpy.testing.assert_allclose(means, [0.5, 0.475])
+        numpy.testing.assert_allclose(table.stepScores(), [0.45, 0.4375])
+
+    def testStepsOfDifferentIterations(self):
+        table = makeTable([("0", "A", "s1", 0.2), ("1", "A", "s1", 0.6), ("1", "A", "s2", 0.8)])
+        medians, means = table.stepSummary("Accuracy")
+        self.assertEqual(list(table.stepIterations), ["0", "1"])
+        numpy.testing.assert_allclose(medians, [0.2, 0.7])
+
+    def testRankSteps(self):
+        table = makeTable([("0", "A", "s1", 0.2), ("0", "B", "s1", 0.9), ("0", "C", "s1", 0.5), ("0", "C", "s2", 0.5)])
+        self.assertEqual([table.stepNames[k] for k in table.rankSteps()], ["B", "C", "A"])
+        self.assertEqual([table.stepNames[k] for k in table.rankSteps(2)], ["C"])
+
+    def testEmptyTable(self):
+        table = makeTable([])
+        medians, means = table.stepSummary("Accuracy")
+        self.assertEqual(len(medians), 0)
+        self.assertEqual(list(table.rankSteps()), [])
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = ResultsStore(os.path.join(self.path, "OptimizationResults.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testUpsert(self):
+        self.store.recordSampleMetrics(0, "Parameter_A_1", {"s1": {"Accuracy": 0.5}, "s2": {"Accuracy": 0.7}})
+        self.store.recordSampleMetrics(0, "Parameter_A_1", {"s1": {"Accuracy": 0.6}})
+        table = self.store.loadTable(0)
+        self.assertEqual(len(table), 2)
+        accuracies = dict(zip(table.samples, table.column("Accuracy")))
+        self.assertEqual(accuracies, {"s1": 0.6, "s2": 0.7})
+        self.assertTrue(numpy.isnan(table.column("Recall")).all())
+
+    def testSteps(self):
+        self.store.recordStep(0, "Parameter_A_1", "A", 1, {"A": 1}, "ab01")
+        self.assertEqual(self.store.loadSteps(), {("0", "Parameter_A_1"): ("A", 1, {"A": 1}, "ab01")})
+        self.assertEqual(self.store.loadSteps(1), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
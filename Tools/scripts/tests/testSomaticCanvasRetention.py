@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasRetention import *
+from SomaticCanvasResultsStore import getResultsStore
+
+
+class Params:
+
+    def __init__(self, outputPath, sampleNames):
+        self.outputPath = outputPath
+        self.sampleNames = sampleNames
+        self.sampleSize = len(sampleNames)
+        self.retention = "topK"
+        self.retentionTopK = 1
+        self.crossValidationMode = "none"
+
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.params = Params(self.path, ["s0", "s1", "s2", "s3"])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def addStep(self, step, sampleAccuracies):
+        """
+        Parameter step of iteration 0 evaluating {"Step": step} with calls and metrics of its samples
+        """
+        store = getResultsStore(self.params)
+        store.recordStep(0, step, "Step", step, {"Step": step}, hashConfig({"Step": step}))
+        store.recordSampleMetrics(0, step, dict((sampleName, {"Accuracy": accuracy}) for sampleName, accuracy in sampleAccuracies.iteritems()))
+        for sampleName in sampleAccuracies:
+            samplePath = os.path.join(self.path, "Iteration_0", step, sampleName)
+            os.makedirs(samplePath)
+            with gzip.open(os.path.join(samplePath, "CNV.vcf.gz"), "wb") as callsFile:
+                callsFile.write("chr1\t1\t%s\n" % step)
+        with open(os.path.join(self.path, "Iteration_0", step, "SomaticCallerParameters.json"), "w") as configFile:
+            configFile.write("{}")
+
+    def isKept(self, step):
+        return os.path.isdir(os.path.join(self.path, "Iteration_0", step, "s0")) or os.path.isdir(os.path.join(self.path, "Iteration_0", step, "s1"))
+
+    def testTopKAndSelected(self):
+        allSamples = ["s0", "s1", "s2", "s3"]
+        self.addStep("A", dict((sampleName, 50.0) for sampleName in allSamples))
+        self.addStep("B", dict((sampleName, 60.0) for sampleName in allSamples))
+        self.addStep("C", dict((sampleName, 40.0) for sampleName in allSamples))
+        collectArtifacts(self.params, [{"Step": "C"}])
+        self.assertEqual([self.isKept(step) for step in "ABC"], [False, True, True])
+        self.assertEqual(getCallsArchive(self.params).summary()[0:3], (1, 4, 1))
+        extracted = os.path.join(self.path, "Extracted.vcf.gz")
+        getCallsArchive(self.params).extract(0, "A", "s2", extracted)
+        self.assertEqual(gzip.open(extracted).read(), "chr1\t1\tA\n")
+        self.assertTrue(os.path.exists(os.path.join(self.path, "Iteration_0", "A", "SomaticCallerParameters.json")))
+
+    def testCrossValidationRanksPerFold(self):
+        self.params.crossValidationMode = "kfold"
+        self.params.crossValidationFolds = 2
+        self.params.crossValidationSeed = 0
+        folds = getCrossValidationFolds(self.params)
+        self.addStep("Base", dict((sampleName, 10.0) for sampleName in self.params.sampleNames))
+        for foldName, trainIndices, testIndices in folds[0:2]:
+            trainSamples = [self.params.sampleNames[sampleIndex] for sampleIndex in trainIndices]
+            self.addStep("Best" + foldName, dict((sampleName, 90.0) for sampleName in trainSamples))
+            self.addStep("Worst" + foldName, dict((sampleName, 5.0) for sampleName in trainSamples))
+        collectArtifacts(self.params, [{"Step": "None"}])
+        self.assertTrue(self.isKept("BestFold_0") and self.isKept("BestFold_1") and self.isKept("Base"))
+        self.assertFalse(self.isKept("WorstFold_0") or self.isKept("WorstFold_1"))
+
+    def testInterruptedCollectionIsFinished(self):
+        self.addStep("A", {"s0": 50.0})
+        archive = getCallsArchive(self.params)
+        # calls archived, outputs not removed yet:
+        archive.archiveCalls("0", "A", {"s0": os.path.join(self.path, "Iteration_0", "A", "s0", "CNV.vcf.gz")})
+        self.assertEqual(archive.loadPendingSteps(), [("0", "A")])
+        finishPendingCollection(self.params)
+        self.assertFalse(self.isKept("A"))
+        self.assertEqual(archive.loadPendingSteps(), [])
+        self.assertEqual(archive.loadCollectedSteps(), set([("0", "A")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import numpy
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import SomaticCanvasScreening
+from SomaticCanvasScreening import *
+
+
+class TestMorrisDesign(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ["A", "B", "C"]
+        self.design = morrisDesign(self.names, 5, 4, 17)
+
+    def testTrajectories(self):
+        delta = 4 / (2.0 * 3)
+        grid = [level / 3.0 for level in range(4)]
+        self.assertEqual(len(self.design["trajectories"]), 5)
+        for trajectory in self.design["trajectories"]:
+            points = numpy.array(trajectory["points"])
+            self.assertEqual(points.shape, (4, 3))
+            # every parameter is changed once, by delta, and the points stay on the grid:
+            self.assertEqual(sorted(trajectory["changed"]), [0, 1, 2])
+            for step, parameterIndex in enumerate(trajectory["changed"]):
+                change = points[step + 1] - points[step]
+                self.assertAlmostEqual(abs(change[parameterIndex]), delta)
+                self.assertEqual(numpy.count_nonzero(change), 1)
+            for value in points.flatten():
+                self.assertTrue(min(abs(value - level) for level in grid) < 1e-9)
+
+    def testSeed(self):
+        self.assertEqual(morrisDesign(self.names, 5, 4, 17), self.design)
+        self.assertNotEqual(morrisDesign(self.names, 5, 4, 18), self.design)
+        self.assertEqual(len(getDesignPoints(self.design)), 5 * 4)
+
+
+class TestElementaryEffects(unittest.TestCase):
+
+    def testLinearObjective(self):
+        design = morrisDesign(["A", "B", "C"], 4, 4, 3)
+        points = getDesignPoints(design)
+        metrics = [[10 * a - 2 * b, a] for a, b, c in points]
+        effects = elementaryEffects(design, points, metrics)
+        for name, expected in [("A", [10, 1]), ("B", [-2, 0]), ("C", [0, 0])]:
+            self.assertEqual(len(effects[name]), 4)
+            numpy.testing.assert_allclose(effects[name], [expected] * 4, atol=1e-9)
+        summary = summarizeEffects(effects, {"A": [0, 1], "B": [0, 1], "C": [0, 1]}, 0.1)
+        self.assertAlmostEqual(summary["B"]["Score"]["muStar"], 2.0)
+        self.assertAlmostEqual(summary["B"]["Score"]["mu"], -2.0)
+        self.assertEqual([summary[name]["rank"] for name in "ABC"], [1, 2, 3])
+        self.assertEqual([summary[name]["retained"] for name in "ABC"], [True, True, False])
+
+    def testRoundedStepsAreSkipped(self):
+        design = morrisDesign(["A", "B"], 2, 4, 5)
+        points = getDesignPoints(design)
+        # B rounds to a single value, none of its steps realizes a change:
+        realizedPoints = [[a, 0.5] for a, b in points]
+        effects = elementaryEffects(design, realizedPoints, [[a, 0] for a, b in points])
+        self.assertEqual(len(effects["A"]), 2)
+        self.assertEqual(effects["B"], [])
+
+    def testSingleValueRange(self):
+        self.assertEqual(toUnitValue(5, 5, 5), 0.0)
+        self.assertEqual(toUnitValue(0.5, 0.0, 2.0), 0.25)
+        design = morrisDesign(["A", "B"], 2, 4, 5)
+        points = getDesignPoints(design)
+        realizedPoints = [[a, toUnitValue(7, 7, 7)] for a, b in points]
+        summary = summarizeEffects(elementaryEffects(design, realizedPoints, [[a, 0] for a, b in points]), {"A": [0, 1], "B": [7, 7]}, 0.1)
+        self.assertEqual(summary["B"]["nEffects"], 0)
+        self.assertEqual((summary["B"]["Score"]["muStar"], summary["B"]["retained"]), (0.0, False))
+
+    def testRankKeepsMostInfluential(self):
+        summary = {"A": {"Score": {"muStar": 0.0}}, "B": {"Score": {"muStar": 0.0}}}
+        rankEffects(summary, 0.5)
+        self.assertEqual([summary[name]["retained"] for name in "AB"], [True, False])
+
+
+class TestRePrune(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testEffectsFileUnchanged(self):
+        effects = {"A": [[4.0, 0.0]], "B": [[1.0, 0.0]]}
+        summary = summarizeEffects(effects, {"A": [0, 1], "B": [0, 2]}, 0.5)
+        effectsPath = os.path.join(self.path, EFFECTS_FILE)
+        writeScreeningResults(effectsPath, os.path.join(self.path, SCREENED_PARAMETERS_FILE), summary)
+        before = open(effectsPath).read()
+        outputPath = os.path.join(self.path, "Pruned.json")
+        with open(os.devnull, "w") as devnull:
+            subprocess.check_call([sys.executable, os.path.splitext(SomaticCanvasScreening.__file__)[0] + ".py", effectsPath, "--threshold", "0.2", "--output", outputPath], stdout=devnull)
+        self.assertEqual(open(effectsPath).read(), before)
+        self.assertEqual(json.load(open(outputPath)), {"A": [0, 1], "B": [0, 2]})
+        self.assertEqual(json.load(open(os.path.join(self.path, SCREENED_PARAMETERS_FILE))), {"A": [0, 1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasStaging import *
+
+# tmpfs, a filesystem other than the one of the temporary directory where inputs are copied instead of hardlinked:
+LOCAL_DIR = "/dev/shm"
+
+
+def isOtherFilesystem(path):
+    return os.path.isdir(path) and os.stat(path).st_dev != os.stat(tempfile.gettempdir()).st_dev
+
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.sharedPath = os.path.join(self.path, "Shared")
+        os.makedirs(os.path.join(self.sharedPath, "Reference"))
+        self.sources = []
+        for name, size in [("Sample1.txt", 1000), ("Sample2.txt", 2000)]:
+            self.sources.append((name, self.writeFile(name, size)))
+        self.writeFile(os.path.join("Reference", "genome.fa"), 5000)
+        self.writeFile(os.path.join("Reference", "GenomeSize.xml"), 100)
+        self.area = StagingArea(os.path.join(self.path, "Staging"), 1)
+        if isOtherFilesystem(LOCAL_DIR):
+            self.copyArea = StagingArea(tempfile.mkdtemp(dir=LOCAL_DIR), 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        if isOtherFilesystem(LOCAL_DIR):
+            shutil.rmtree(self.copyArea.stagingDir)
+
+    def writeFile(self, name, size):
+        path = os.path.join(self.sharedPath, name)
+        with open(path, "wb") as outFile:
+            outFile.write(os.urandom(size))
+        return path
+
+    def stage(self, sources, area=None):
+        key = stagingKey(sources)
+        return key, (area or self.area).stage(key, sources)
+
+    def readManifest(self, key):
+        with open(os.path.join(self.area.entryPath(key), "entry.json")) as manifestFile:
+            return json.load(manifestFile)
+
+    def testReferenceIsStagedOnceForAllSamples(self):
+        reference = ("Reference", os.path.join(self.sharedPath, "Reference"))
+        entries = getStagingEntries([self.sources[0], reference]) + getStagingEntries([self.sources[1], reference])
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[1], entries[3])
+        key, lockFile = self.stage([reference])
+        lockFile.close()
+        staged = os.path.join(self.area.entryPath(key), "Reference", "genome.fa")
+        self.assertFalse(os.path.islink(staged))
+        self.assertEqual(fileChecksum(staged), fileChecksum(os.path.join(self.sharedPath, "Reference", "genome.fa")))
+
+    def testHardlinksCountAgainstBudget(self):
+        # the staging directory is on the filesystem of the inputs:
+        key, lockFile = self.stage(self.sources)
+        lockFile.close()
+        self.assertEqual(os.stat(os.path.join(self.area.entryPath(key), "Sample1.txt")).st_nlink, 2)
+        manifest = self.readManifest(key)
+        self.assertEqual(manifest["size"], 3000)
+        self.assertEqual(manifest["files"]["Sample1.txt"]["sha1"], fileChecksum(self.sources[0][1]))
+
+    @unittest.skipUnless(isOtherFilesystem(LOCAL_DIR), "needs a second filesystem")
+    def testChangedCopyIsStagedAgain(self):
+        key, lockFile = self.stage(self.sources[0:1], self.copyArea)
+        lockFile.close()
+        staged = os.path.join(self.copyArea.entryPath(key), "Sample1.txt")
+        self.assertEqual(os.stat(staged).st_nlink, 1)
+        # a copy rewritten with the same size is no longer valid:
+        with open(staged, "r+b") as stagedFile:
+            stagedFile.write("x")
+        os.utime(staged, (0, 0))
+        self.assertFalse(self.copyArea.isValid(key))
+        self.stage(self.sources[0:1], self.copyArea)[1].close()
+        self.assertEqual(fileChecksum(staged), fileChecksum(self.sources[0][1]))
+
+    @unittest.skipUnless(isOtherFilesystem(LOCAL_DIR), "needs a second filesystem")
+    def testCorruptCopyIsRemovedByVerify(self):
+        key, lockFile = self.stage(self.sources[0:1], self.copyArea)
+        lockFile.close()
+        staged = os.path.join(self.copyArea.entryPath(key), "Sample1.txt")
+        stat = os.stat(staged)
+        with open(staged, "r+b") as stagedFile:
+            stagedFile.write("x")
+        os.utime(staged, (stat.st_atime, stat.st_mtime))
+        self.assertTrue(self.copyArea.isValid(key))
+        self.assertEqual(self.copyArea.verify(), [key])
+        self.assertFalse(os.path.exists(self.copyArea.entryPath(key)))
+
+    def testChangedSourceInvalidatesEntry(self):
+        key, lockFile = self.stage(self.sources[0:1])
+        lockFile.close()
+        self.assertTrue(self.area.isValid(key))
+        self.writeFile("Sample1.txt", 1001)
+        self.assertFalse(self.area.isValid(key))
+        self.assertNotEqual(stagingKey(self.sources[0:1]), key)
+
+    def testEntryInUseIsShared(self):
+        key, lockFile = self.stage(self.sources)
+        # a second task uses the valid entry while the first one holds it:
+        key, secondLockFile = self.stage(self.sources)
+        self.assertFalse(self.area.remove(key))
+        lockFile.close()
+        self.assertFalse(self.area.remove(key))
+        secondLockFile.close()
+        self.assertTrue(self.area.remove(key))
+        self.assertFalse(os.path.exists(self.area.entryPath(key)))
+
+    def testEvictionLeastRecentlyUsedFirst(self):
+        keys = []
+        for source in self.sources + [("Other.txt", self.writeFile("Other.txt", 3000))]:
+            key, lockFile = self.stage([source])
+            lockFile.close()
+            keys.append(key)
+        inUse = self.area.stage(keys[0], self.sources[0:1])
+        os.utime(os.path.join(self.area.entryPath(keys[0]), "entry.json"), (1, 1))
+        os.utime(os.path.join(self.area.entryPath(keys[1]), "entry.json"), (2, 2))
+        self.area.maxSizeBytes = 3500
+        # the least recently used entry is in use and kept, the next ones go:
+        self.assertEqual(self.area.evict(), 1000)
+        self.assertEqual([os.path.exists(self.area.entryPath(key)) for key in keys], [True, False, False])
+        inUse.close()
+        self.area.maxSizeBytes = 0
+        self.assertEqual(self.area.evict(), 0)
+        self.assertEqual(self.area.listEntries(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
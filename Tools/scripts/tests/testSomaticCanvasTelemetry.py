@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasTelemetry import *
+
+
+class Params:
+
+    def __init__(self, path):
+        self.outputPath = path
+        self.iteration = 2
+        self.currentParameter = "A"
+        self.currentParameterValue = 5
+        self.sampleNames = ["s0", "s1"]
+
+
+def makeRecord(kind, sample, iteration, step, parameter, wallSeconds, cpuSeconds, exitStatus=0, nCores=1):
+    return {"kind": kind, "sample": sample, "iteration": iteration, "step": step, "parameter": parameter, "wallSeconds": wallSeconds,
+            "userSeconds": cpuSeconds, "systemSeconds": 0.0, "exitStatus": exitStatus, "nCores": nCores}
+
+
+class TestRunMeasured(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testUsageOfCommand(self):
+        outputPath = os.path.join(self.path, "out.bin")
+        script = "open(%r, 'wb').write('x' * (4 << 20)); data = 'y' * (64 << 20); raise SystemExit(3)" % outputPath
+        exitStatus, record = runMeasured([sys.executable, "-c", script])
+        self.assertEqual((exitStatus, record["exitStatus"]), (3, 3))
+        self.assertGreaterEqual(record["writeBytes"], 4 << 20)
+        self.assertGreaterEqual(record["maxRssMb"], 64)
+        self.assertGreater(record["wallSeconds"], 0)
+        self.assertEqual(record["host"], socket.gethostname())
+
+    def testSignal(self):
+        exitStatus, record = runMeasured(["sh", "-c", "kill -9 $$"])
+        self.assertEqual(exitStatus, 128 + 9)
+
+    def testReadProcIo(self):
+        before = readProcIo(os.getpid())
+        if before is None:
+            self.skipTest("no /proc")
+        with open(os.path.join(self.path, "out.bin"), "wb") as outFile:
+            outFile.write("x" * 100000)
+        after = readProcIo(os.getpid())
+        self.assertGreaterEqual(after[1] - before[1], 100000)
+        # a finished, reaped process has no counters:
+        process = subprocess.Popen(["true"])
+        process.wait()
+        self.assertEqual(readProcIo(process.pid), None)
+
+    def testInlineTask(self):
+        params = Params(self.path)
+        self.assertEqual(recordInlineTask(params, "PythonEvaluator", 1, lambda: "x" * 10), "x" * 10)
+        self.assertRaises(ValueError, recordInlineTask, params, "PythonEvaluator", 0, int, "x")
+        records = readRecords(getTelemetryFile(params))
+        self.assertEqual([(record["sample"], record["exitStatus"]) for record in records], [("s1", 0), ("s0", 1)])
+        self.assertEqual((records[0]["kind"], records[0]["iteration"], records[0]["step"], records[0]["parameter"]), ("PythonEvaluator", "2", "Parameter_A_5", "A"))
+        for key in ["wallSeconds", "userSeconds", "maxRssMb", "readBytes", "writeBytes"]:
+            self.assertGreaterEqual(records[0][key], 0)
+
+
+class TestSummary(unittest.TestCase):
+
+    def testSummary(self):
+        records = [makeRecord("CanvasSomaticCaller", "s0", "0", "Parameter_A_1", "A", 10.0, 3600.0),
+                   makeRecord("CanvasSomaticCaller", "s1", "0", "Parameter_A_1", "A", 30.0, 3600.0, nCores=2),
+                   makeRecord("CanvasSomaticCaller", "s2", "0", "Parameter_A_1", "A", 20.0, 0.0),
+                   makeRecord("CanvasSomaticCaller", "s0", "1", "Parameter_B_1", "B", 12.0, 1800.0, exitStatus=1),
+                   makeRecord("CanvasSomaticCaller", "s1", "1", "Parameter_B_1", "B", 12.0, 1800.0)]
+        lines = summarize(records, 2)
+        self.assertEqual(lines[0], "5 tasks, 1 failed")
+        slowest = lines[lines.index("Slowest samples\t(kind, sample, tasks, mean wall s, max wall s)") + 1:]
+        self.assertEqual(slowest[0:3], ["CanvasSomaticCaller\ts1\t2\t21.0\t30.0", "CanvasSomaticCaller\ts2\t1\t20.0\t20.0", ""])
+        # iteration 0 waits 10 s beyond its median sample, iteration 1 none:
+        straggling = lines[lines.index("Iterations by straggler time\t(iteration, straggler s, critical path s)") + 1:]
+        self.assertEqual(straggling[0:3], ["0\t10.0\t30.0", "1\t0.0\t12.0", ""])
+        hours = lines[lines.index("Core-hours per parameter\t(parameter, tasks, CPU core-hours, reserved core-hours)") + 1:]
+        self.assertEqual(hours, ["A\t3\t2.000\t0.025", "B\t2\t1.000\t0.007"])
+
+    def testMedian(self):
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SomaticCanvasWorkerPool import *
+
+# stand-in for CanvasSomaticCaller.exe --worker, answering "garbage" to the calls of that parameter config
+# and allocating 64 MB in the calls of "allocate":
+STUB_WORKER = """
+import sys, json, time
+for line in iter(sys.stdin.readline, ""):
+    request = json.loads(line)
+    time.sleep(0.1)
+    if request["ParameterConfig"] == "allocate":
+        data = "x" * (64 << 20)
+        del data
+    if request["ParameterConfig"] == "garbage":
+        sys.stdout.write("garbage\\n")
+    else:
+        sys.stdout.write(json.dumps({"OutFile": request["OutFile"], "ExitCode": 0, "Seconds": 0.1}) + "\\n")
+    sys.stdout.flush()
+"""
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        workerPath = os.path.join(self.path, "Worker.py")
+        with open(workerPath, "w") as workerFile:
+            workerFile.write(STUB_WORKER)
+        self.workerCommand = "%s %s" % (sys.executable, workerPath)
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.stop()
+        shutil.rmtree(self.path)
+
+    def makePool(self, maxWorkers):
+        pool = WorkerPool(maxWorkers, lambda sampleName: self.workerCommand, os.path.join(self.path, "WorkerPool.log"))
+        self.pools.append(pool)
+        return pool
+
+    def runStep(self, pool, sampleNames):
+        """
+        Calls of all samples at once, as the caller tasks of a parameter step
+        """
+        results = {}
+        threads = [threading.Thread(target=lambda sampleName=sampleName: results.__setitem__(sampleName, pool.call(sampleName, {"ParameterConfig": "config", "OutFile": sampleName})))
+                   for sampleName in sampleNames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def testWorkerIsReused(self):
+        pool = self.makePool(1)
+        for step in range(3):
+            self.assertEqual(self.runStep(pool, ["s1"])["s1"]["ExitCode"], 0)
+        self.assertEqual((pool.nCalls, pool.nStarted), (3, 1))
+
+    def testPoolSmallerThanSamples(self):
+        pool = self.makePool(2)
+        nSteps = 5
+        for step in range(nSteps):
+            results = self.runStep(pool, ["s1", "s2", "s3"])
+            self.assertEqual(sorted(result["ExitCode"] for result in results.itervalues()), [0, 0, 0])
+        self.assertEqual(pool.nCalls, 3 * nSteps)
+        # the sample without a worker and at most one sample whose worker it stopped on arrival are restarted per step:
+        self.assertTrue(pool.nStarted <= 2 * nSteps + 1, pool.nStarted)
+        self.assertEqual(pool.nWorkers, 2)
+
+    def testSamplesInTurn(self):
+        pool = self.makePool(2)
+        for step in range(10):
+            for sampleName in ["s1", "s2", "s3"]:
+                self.runStep(pool, [sampleName])
+        # the most recently used worker is stopped, so every other call after the first three finds its worker:
+        self.assertEqual((pool.nCalls, pool.nStarted), (30, 16))
+
+    def testWorkerIsStoppedOnAnyError(self):
+        pool = self.makePool(1)
+        self.assertRaises(ValueError, pool.call, "s1", {"ParameterConfig": "garbage", "OutFile": "s1"})
+        self.assertEqual(pool.nWorkers, 0)
+        self.assertFalse(pool.idle.get("s1"))
+        self.assertEqual(pool.call("s1", {"ParameterConfig": "config", "OutFile": "s1"})["ExitCode"], 0)
+        self.assertEqual(pool.nStarted, 2)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/clear_refs"), "needs /proc")
+    def testUsageOfEachCall(self):
+        pool = self.makePool(1)
+        usage = pool.call("s1", {"ParameterConfig": "allocate", "OutFile": "s1"})["Usage"]
+        self.assertTrue(usage["maxRssMb"] >= 64, usage)
+        self.assertTrue(usage["wallSeconds"] >= 0.1, usage)
+        # the peak of the previous call is not carried over:
+        usage = pool.call("s1", {"ParameterConfig": "config", "OutFile": "s1"})["Usage"]
+        self.assertTrue(usage["maxRssMb"] < 64, usage)
+
+
+if __name__ == "__main__":
+    unittest.main()